@@ -0,0 +1,218 @@
+# Measures the agent loop: steps/s, p50/p99 step latency and the time split between the llm,
+# Engine.execute, the templates and Function.safe_call, for a single agent and for concurrent agents.
+# Usage: python -m benchmarks.agent_loop --backend mock-text --latency 0.05 --jitter 0.01 --agents 1 16 64
+#        python -m benchmarks.agent_loop --backend replay --replay session.jsonl
+import argparse
+import asyncio
+import contextlib
+import os
+import threading
+import time
+from collections import defaultdict
+
+from microchain import (
+    Agent, AgentPool, Engine, Function, LLM, VicunaTemplate,
+    OpenAIChatGenerator, OpenAITextGenerator, AsyncOpenAIChatGenerator, AsyncOpenAITextGenerator,
+)
+from microchain.functions import Reasoning
+from microchain.models.replay import RecordingGenerator, AsyncRecordingGenerator, AsyncReplayGenerator, ReplayGenerator
+from benchmarks.mock_server import MockServer
+
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+
+    @property
+    def example_args(self):
+        return [2, 2]
+
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class Product(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the product of two numbers"
+
+    @property
+    def example_args(self):
+        return [2, 2]
+
+    def __call__(self, a: float, b: float):
+        return a * b
+
+class Timings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(float)
+        self.step_starts = dict()
+        self.step_latencies = []
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.totals[name] += seconds
+
+    def timed(self, name, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def atimed(self, name, function):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def on_iteration_start(self, agent):
+        self.step_starts[id(agent)] = time.perf_counter()
+
+    def on_iteration_step(self, agent, step_output):
+        self.step_latencies.append(time.perf_counter() - self.step_starts.pop(id(agent)))
+
+class TimedGenerator:
+    def __init__(self, generator, timings):
+        self.generator = generator
+        self.timings = timings
+
+    def __call__(self, prompt, stop=None):
+        start = time.perf_counter()
+        try:
+            return self.generator(prompt, stop=stop)
+        finally:
+            self.timings.add("llm", time.perf_counter() - start)
+
+class AsyncTimedGenerator(TimedGenerator):
+    async def __call__(self, prompt, stop=None):
+        start = time.perf_counter()
+        try:
+            return await self.generator(prompt, stop=stop)
+        finally:
+            self.timings.add("llm", time.perf_counter() - start)
+
+class TimedTemplate:
+    def __init__(self, template, timings):
+        self.template = template
+        self.timings = timings
+
+    def __call__(self, prompt):
+        start = time.perf_counter()
+        try:
+            return self.template(prompt)
+        finally:
+            self.timings.add("templates", time.perf_counter() - start)
+
+def make_generator(args, url, use_async):
+    if args.backend == "replay":
+        generator = AsyncReplayGenerator(args.replay, sequential=True, loop=True) if use_async else ReplayGenerator(args.replay, sequential=True, loop=True)
+    elif args.backend == "mock-chat":
+        generator_class = AsyncOpenAIChatGenerator if use_async else OpenAIChatGenerator
+        generator = generator_class(model="mock", api_key="mock", api_base=url, temperature=0)
+    else:
+        generator_class = AsyncOpenAITextGenerator if use_async else OpenAITextGenerator
+        generator = generator_class(model="mock", api_key="mock", api_base=url, temperature=0)
+
+    if args.record:
+        generator = AsyncRecordingGenerator(generator, args.record) if use_async else RecordingGenerator(generator, args.record)
+    return generator
+
+def make_episode(args, url, timings, use_async):
+    engine = Engine(state=dict())
+    for function in [Reasoning(), Sum(), Product()]:
+        engine.register(function)
+        function.safe_call = timings.timed("safe_call", function.safe_call)
+        function.asafe_call = timings.atimed("safe_call", function.asafe_call)
+    engine.execute = timings.timed("execute", engine.execute)
+    engine.aexecute = timings.atimed("execute", engine.aexecute)
+
+    generator = make_generator(args, url, use_async)
+    generator = AsyncTimedGenerator(generator, timings) if use_async else TimedGenerator(generator, timings)
+    templates = [TimedTemplate(VicunaTemplate(), timings)] if args.backend != "mock-chat" else []
+    llm = LLM(generator=generator, templates=templates)
+
+    prompt = f"Act as a calculator. You can use the following functions:\n\n{engine.help}\n\nOnly output valid Python function calls."
+    return llm, engine, prompt
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if len(values) > 0 else 0
+
+def report(name, timings, elapsed):
+    steps = len(timings.step_latencies)
+    step_time = sum(timings.step_latencies)
+    totals = dict(timings.totals)
+    split = dict(
+        llm=totals.get("llm", 0),
+        templates=totals.get("templates", 0),
+        execute=totals.get("execute", 0) - totals.get("safe_call", 0),
+        safe_call=totals.get("safe_call", 0),
+    )
+    split["other"] = max(step_time - sum(split.values()), 0)
+    shares = " ".join(f"{key}={value:.3f}s ({100 * value / step_time if step_time > 0 else 0:.1f}%)" for key, value in split.items())
+    print(f"{name}: steps={steps} elapsed={elapsed:.2f}s steps/s={steps / elapsed:.1f} p50={1000 * percentile(timings.step_latencies, 0.5):.2f}ms p99={1000 * percentile(timings.step_latencies, 0.99):.2f}ms")
+    print(f"    {shares}")
+
+def run_single(args, url):
+    timings = Timings()
+    llm, engine, prompt = make_episode(args, url, timings, use_async=False)
+    agent = Agent(llm=llm, engine=engine, on_iteration_start=timings.on_iteration_start, on_iteration_step=timings.on_iteration_step)
+    agent.prompt = prompt
+
+    start = time.perf_counter()
+    agent.run(iterations=args.steps)
+    return timings, time.perf_counter() - start
+
+def run_concurrent(args, url, agents):
+    timings = Timings()
+    pool = AgentPool(
+        lambda: make_episode(args, url, timings, use_async=True),
+        concurrency=agents,
+        agent_kwargs=dict(on_iteration_start=timings.on_iteration_start, on_iteration_step=timings.on_iteration_step),
+    )
+    start = time.perf_counter()
+    results = asyncio.run(pool.arun(agents, iterations=args.steps))
+    errors = [result.error for result in results if result.error is not None]
+    if len(errors) > 0:
+        raise errors[0]
+    return timings, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["mock-text", "mock-chat", "replay"], default="mock-text")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--agents", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--record", help="record the llm replies to this JSONL file")
+    parser.add_argument("--replay", help="JSONL file recorded with --record, used by --backend replay")
+    args = parser.parse_args()
+
+    if args.backend == "replay" and not args.replay:
+        parser.error("--backend replay requires --replay")
+
+    server = None
+    url = None
+    if args.backend != "replay":
+        server = MockServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+        url = server.url
+
+    try:
+        for agents in args.agents:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                timings, elapsed = run_single(args, url) if agents == 1 else run_concurrent(args, url, agents)
+            report(f"{args.backend} agents={agents}", timings, elapsed)
+    finally:
+        if server is not None:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
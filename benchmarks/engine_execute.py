@@ -0,0 +1,60 @@
+# Measures Engine.execute throughput (commands/s) on a registry of a few hundred functions.
+# Usage: python -m benchmarks.engine_execute [--functions 300] [--commands 20000]
+import argparse
+import random
+import time
+
+from microchain import Engine, Function
+
+
+def make_function(index):
+    def call(self, a: int, b: float, text: str):
+        return a
+
+    return type(f"Function{index}", (Function, ), dict(
+        description=property(lambda self: f"Function number {index}"),
+        example_args=property(lambda self: [1, 2.0, "text"]),
+        __call__=call,
+    ))()
+
+def make_commands(functions, commands, distinct):
+    pool = []
+    for i in range(distinct):
+        name = f"Function{random.randrange(functions)}"
+        pool.append(random.choice([
+            f'{name}({i}, 2.5, "text")',
+            f'{name}(a={i}, b=2.5, text="text")',
+            f'{name}({i}, b=2, text="some longer text argument")',
+            f'{name}({i}, 2.5)',
+            f'Unknown{i}()',
+        ]))
+    return [random.choice(pool) for _ in range(commands)]
+
+def run(engine, commands):
+    start = time.perf_counter()
+    for command in commands:
+        engine.execute(command)
+    return len(commands) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--functions", type=int, default=300)
+    parser.add_argument("--commands", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    commands = make_commands(args.functions, args.commands, args.distinct)
+
+    for cache_size in [0, 1024]:
+        engine = Engine(state=dict(), parse_cache_size=cache_size)
+        for index in range(args.functions):
+            engine.register(make_function(index))
+        engine.agent = object()
+        engine.help_called = True
+
+        print(f"parse_cache_size={cache_size}: {run(engine, commands):.0f} commands/s")
+
+if __name__ == "__main__":
+    main()
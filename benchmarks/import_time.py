@@ -0,0 +1,46 @@
+# Measures the import time of microchain with python -X importtime, in fresh interpreters.
+# Usage: python -m benchmarks.import_time [--runs 10] [--max-ms 50]
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+STATEMENTS = {
+    "import microchain": "import microchain",
+    "engine": "from microchain import Agent, Engine, Function",
+    "openai": "from microchain import OpenAIChatGenerator, LLM",
+}
+
+def import_time(statement):
+    # Sum of the cumulative times of the top level microchain imports, in milliseconds.
+    # Lazily loaded modules show up as top level imports of their own
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, check=True)
+    total = 0
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        if len(name) - len(name.lstrip()) == 1 and name.strip().startswith("microchain"):
+            total += int(parts[1])
+    return total / 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, help="exit with an error if the median of `import microchain` is slower")
+    args = parser.parse_args()
+
+    medians = dict()
+    for name, statement in STATEMENTS.items():
+        times = [import_time(statement) for _ in range(args.runs)]
+        medians[name] = statistics.median(times)
+        print(f"{name}: median={medians[name]:.1f}ms min={min(times):.1f}ms max={max(times):.1f}ms")
+
+    if args.max_ms is not None and medians["import microchain"] > args.max_ms:
+        print(f"import microchain is slower than {args.max_ms}ms")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Local OpenAI-compatible stand-in server with configurable latency, jitter and scripted replies.
+# Usage: python -m benchmarks.mock_server --port 8000 --latency 0.2 --jitter 0.05 --replies replies.txt
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_REPLIES = [
+    'Reasoning(reasoning="I need to compute the sum")',
+    "Sum(a=2, b=2)",
+    "Product(a=4, b=5)",
+]
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/chat/completions"):
+            chat = True
+        elif self.path.endswith("/completions"):
+            chat = False
+        else:
+            return self.send_json(404, dict(error=dict(message=f"Unknown endpoint {self.path}")))
+
+        self.server.wait()
+        n = request.get("n") or 1
+        replies = [self.server.next_reply() for _ in range(n)]
+        prompt = json.dumps(request.get("messages")) if chat else request.get("prompt", "")
+        usage = dict(prompt_tokens=len(prompt) // 4, completion_tokens=sum(len(reply) // 4 for reply in replies))
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        common = dict(id="mock", created=int(time.time()), model=request.get("model", "mock"))
+
+        if request.get("stream"):
+            # One chunk per word, like a token stream
+            chunks = []
+            for word in itertools.chain.from_iterable(reply.split(" ") for reply in replies[:1]):
+                text = word + " "
+                choice = dict(index=0, delta=dict(content=text)) if chat else dict(index=0, text=text)
+                chunks.append(dict(common, object="chat.completion.chunk" if chat else "text_completion", choices=[choice]))
+            return self.send_stream(chunks)
+
+        if chat:
+            choices = [dict(index=i, message=dict(role="assistant", content=reply), finish_reason="stop") for i, reply in enumerate(replies)]
+            return self.send_json(200, dict(common, object="chat.completion", choices=choices, usage=usage))
+        choices = [dict(index=i, text=reply, finish_reason="stop") for i, reply in enumerate(replies)]
+        return self.send_json(200, dict(common, object="text_completion", choices=choices, usage=usage))
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, replies=DEFAULT_REPLIES, latency=0, jitter=0, error_rate=0, seed=0):
+        super().__init__((host, port), MockHandler)
+        self.replies = itertools.cycle(replies)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def wait(self):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(delay, 0))
+
+    def next_reply(self):
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                return "I think the answer is 4"
+            return next(self.replies)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--replies", help="file with one scripted reply per line")
+    args = parser.parse_args()
+
+    replies = DEFAULT_REPLIES
+    if args.replies:
+        with open(args.replies) as file:
+            replies = [line.strip() for line in file if line.strip()]
+
+    server = MockServer(args.host, args.port, replies=replies, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    print(f"Serving on {server.url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ from microchain import OpenAITextGenerator, HFChatTemplate, LLM, Function, Engin
 from microchain.functions import Reasoning, Stop
 
 class Sum(Function):
+    cacheable = True
+
     @property
     def description(self):
         return "Use this function to compute the sum of two numbers"
@@ -18,6 +20,8 @@ class Sum(Function):
         return a + b
 
 class Product(Function):
+    cacheable = True
+
     @property
     def description(self):
         return "Use this function to compute the product of two numbers"
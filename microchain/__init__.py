@@ -1,9 +1,69 @@
-from microchain.models.openai_generators import OpenAITextGenerator, OpenAIChatGenerator
-from microchain.models.llama_generators import ReplicateLlama31ChatGenerator
-from microchain.models.templates import HFChatTemplate, VicunaTemplate
-from microchain.models.llm import LLM
+import importlib
+from typing import TYPE_CHECKING
 
-from microchain.engine.function import Function, FunctionResult
-from microchain.engine.engine import Engine
 
-from microchain.engine.agent import Agent, StepOutput
\ No newline at end of file
+# Public names are imported on first access, so that `import microchain` stays cheap
+# and the optional dependencies are loaded only by the modules that need them
+exports = {
+    "microchain.models.openai_generators": ["OpenAITextGenerator", "OpenAIChatGenerator", "AsyncOpenAITextGenerator", "AsyncOpenAIChatGenerator"],
+    "microchain.models.llama_generators": ["ReplicateLlama31ChatGenerator", "AsyncReplicateLlama31ChatGenerator"],
+    "microchain.models.llama_cpp_generators": ["LlamaCppGenerator"],
+    "microchain.models.templates": ["HFChatTemplate", "VicunaTemplate"],
+    "microchain.models.llm": ["LLM"],
+    "microchain.models.cache": ["CachedGenerator", "AsyncCachedGenerator"],
+    "microchain.models.replay": ["RecordingGenerator", "AsyncRecordingGenerator", "ReplayGenerator", "AsyncReplayGenerator"],
+    "microchain.models.token_tracker": ["TokenTracker", "TokenUsage", "load_pricing"],
+    "microchain.models.retry": ["GeneratorError", "RetryPolicy"],
+    "microchain.models.scheduler": ["RequestScheduler", "SchedulerStats"],
+
+    "microchain.engine.function": ["Function", "FunctionResult"],
+    "microchain.engine.engine": ["Engine"],
+    "microchain.engine.function_cache": ["FunctionCache"],
+    "microchain.engine.grammar": ["Grammar", "ToolCalls"],
+    "microchain.engine.process_pool": ["ProcessPool"],
+
+    "microchain.engine.agent": ["Agent", "StepOutput"],
+    "microchain.engine.checkpoint": ["Checkpoint"],
+    "microchain.engine.repair": ["Repair"],
+    "microchain.engine.metrics": ["Metrics", "StepMetrics", "MemorySink", "JSONLSink", "PrometheusSink"],
+    "microchain.engine.pool": ["AgentPool", "EpisodeResult", "PoolStats"],
+    "microchain.engine.context": ["ContextPolicy", "FullContext", "SlidingWindowContext", "SummaryContext", "LLMSummarizer"],
+}
+modules = {name: module for module, names in exports.items() for name in names}
+
+__all__ = list(modules)
+
+def __getattr__(name):
+    if name not in modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(modules[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+if TYPE_CHECKING:
+    from microchain.models.openai_generators import OpenAITextGenerator, OpenAIChatGenerator, AsyncOpenAITextGenerator, AsyncOpenAIChatGenerator
+    from microchain.models.llama_generators import ReplicateLlama31ChatGenerator, AsyncReplicateLlama31ChatGenerator
+    from microchain.models.llama_cpp_generators import LlamaCppGenerator
+    from microchain.models.templates import HFChatTemplate, VicunaTemplate
+    from microchain.models.llm import LLM
+    from microchain.models.cache import CachedGenerator, AsyncCachedGenerator
+    from microchain.models.replay import RecordingGenerator, AsyncRecordingGenerator, ReplayGenerator, AsyncReplayGenerator
+    from microchain.models.token_tracker import TokenTracker, TokenUsage, load_pricing
+    from microchain.models.retry import GeneratorError, RetryPolicy
+    from microchain.models.scheduler import RequestScheduler, SchedulerStats
+
+    from microchain.engine.function import Function, FunctionResult
+    from microchain.engine.engine import Engine
+    from microchain.engine.function_cache import FunctionCache
+    from microchain.engine.grammar import Grammar, ToolCalls
+    from microchain.engine.process_pool import ProcessPool
+
+    from microchain.engine.agent import Agent, StepOutput
+    from microchain.engine.checkpoint import Checkpoint
+    from microchain.engine.repair import Repair
+    from microchain.engine.metrics import Metrics, StepMetrics, MemorySink, JSONLSink, PrometheusSink
+    from microchain.engine.pool import AgentPool, EpisodeResult, PoolStats
+    from microchain.engine.context import ContextPolicy, FullContext, SlidingWindowContext, SummaryContext, LLMSummarizer
@@ -1,7 +1,15 @@
+import asyncio
+import inspect
+import time
 from dataclasses import dataclass
 from termcolor import colored
 
 from microchain.engine.function import FunctionResult
+from microchain.engine.metrics import StepMetrics
+from microchain.engine.grammar import ToolCalls
+from microchain.models.current import current_agent, current_step, current_grammar
+from microchain.models.retry import GeneratorError
+from microchain.models.llm import sample_replies
 
 
 @dataclass
@@ -12,7 +20,7 @@ class StepOutput:
     result: FunctionResult
 
 class Agent:
-    def __init__(self, llm, engine, on_iteration_start=None, on_iteration_step=None, on_iteration_end=None, stop_list=["\n"], enable_langfuse=False):
+    def __init__(self, llm, engine, on_iteration_start=None, on_iteration_step=None, on_iteration_end=None, stop_list=None, candidates=1, multi_call=False, context_policy=None, repair=None, checkpoint=None, max_cost=None, max_tokens=None, metrics=None, quiet=False, name=None, enable_langfuse=False):
         self.llm = llm
         self.engine = engine
         self.max_tries = 10
@@ -23,9 +31,26 @@ class Agent:
         self.on_iteration_start = on_iteration_start
         self.on_iteration_step = on_iteration_step
         self.on_iteration_end = on_iteration_end
-        self.stop_list = stop_list
+        self.multi_call = multi_call
+        # Replies with several calls span many lines
+        self.stop_list = stop_list if stop_list is not None else ([] if multi_call else ["\n"])
+        self.candidates = candidates
+        self.context_policy = context_policy
+        self.repair = repair
+        self.last_repairs = []
+        self.pinned = 0
+        self.checkpoint = checkpoint
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.metrics = metrics
+        self.quiet = quiet
+        self.name = name if name is not None else f"agent-{id(self):x}"
+        self.step_count = 0
         self.enable_langfuse = enable_langfuse
 
+        if self.max_cost is not None:
+            self.check_pricing()
+
         self.engine.bind(self)
         self.reset()
 
@@ -45,18 +70,49 @@ class Agent:
         self.stop = observe()(self.stop)
         self.step = observe()(self.step)
         self.run = observe()(self.run)
+        self.astep = observe()(self.astep)
+        self.arun = observe()(self.arun)
 
     def reset(self):
         self.history = []
+        self.pinned = 0
         self.do_stop = False
+        self.step_count = 0
+
+    def log(self, message, color):
+        if not self.quiet:
+            print(colored(message, color))
+
+    @property
+    def token_tracker(self):
+        return getattr(getattr(self.llm, "generator", None), "token_tracker", None)
+
+    def token_usage(self):
+        if not self.token_tracker:
+            return 0, 0
+        usage = self.token_tracker.totals(agent=self.name)
+        return usage.prompt_tokens, usage.completion_tokens
+
+    def check_pricing(self):
+        # A cost budget needs the usage and the price of the model, otherwise it would never trip
+        if not self.token_tracker:
+            raise ValueError("max_cost needs a generator with a token_tracker")
+        model = getattr(self.llm.generator, "model", None)
+        if not self.token_tracker.priced(model):
+            raise ValueError(f"No price for the model {model}, pass pricing= to the TokenTracker to use max_cost")
+
+    def budget_exceeded(self):
+        if not self.token_tracker:
+            return False
+        return self.token_tracker.exceeded(max_cost=self.max_cost, max_tokens=self.max_tokens, agent=self.name)
 
     def execute_command(self, command: str):
         result, output = self.engine.execute(command)
         if result == FunctionResult.ERROR:
             raise Exception(f"Your command ({command}) contains an error. output={output}")
 
-        print(colored(f">> {command}", "blue"))
-        print(colored(f"{output}", "green"))
+        self.log(f">> {command}", "blue")
+        self.log(f"{output}", "green")
 
         self.history.append(dict(
             role="assistant",
@@ -85,23 +141,70 @@ class Agent:
             )
         for command in self.bootstrap:
             self.execute_command(command)
+        self.pinned = len(self.history)
+
+    def build_context(self):
+        if self.context_policy is None:
+            return self.history
+        return self.context_policy(self.history, self.pinned)
+
+    async def abuild_context(self):
+        if self.context_policy is None:
+            return self.history
+        if hasattr(self.context_policy, "acall"):
+            return await self.context_policy.acall(self.history, self.pinned)
+        return self.context_policy(self.history, self.pinned)
 
     def clean_reply(self, reply):
+        if isinstance(reply, ToolCalls):
+            return reply
         reply = reply.replace("\_", "_")
         reply = reply.strip()
-        reply = reply[:reply.rfind(")")+1]
+        end = max(reply.rfind(")"), reply.rfind("]")) if self.multi_call else reply.rfind(")")
+        reply = reply[:end+1]
         return reply
 
+    def select_reply(self, replies):
+        # Picks the first candidate that passes the engine validation, then the first one that self.repair fixes,
+        # if none does the first one is executed to report its error
+        self.last_repairs = []
+        cleaned = [self.clean_reply(reply) for reply in replies]
+        if len(cleaned) == 1 and self.repair is None:
+            return cleaned[0]
+        validate = self.engine.validate_many if self.multi_call else self.engine.validate
+        for reply in cleaned:
+            if len(reply) >= 2 and validate(reply)[0] == FunctionResult.SUCCESS:
+                return reply
+        if self.repair is not None:
+            for reply in replies:
+                repaired, self.last_repairs = self.repair(reply, self.clean_reply, validate, self.engine.functions)
+                if repaired is not None:
+                    return repaired
+        return next((reply for reply in cleaned if len(reply) >= 2), cleaned[0])
+
     def stop(self):
         self.do_stop = True
 
-    def step(self, transient_history=[]):
+    def restore(self):
+        # Rebuilds the session saved in self.checkpoint, continue it with run(resume=True)
+        self.checkpoint.restore(self)
+
+    def step_loop(self, transient_history):
+        # Yields ("context", None) to receive the messages selected by the context policy, ("llm", messages) to
+        # receive the candidate replies and ("execute", reply) to receive the result of running it,
+        # step() and astep() only differ in how they obtain them
         result = FunctionResult.ERROR
         temp_messages = []
         tries = 0
         abort = False
         output = ""
         reply = ""
+        errors = dict()
+        repairs = dict()
+        llm_time = parse_time = function_time = 0
+        start = time.perf_counter()
+        start_tokens = self.token_usage()
+        history = yield "context", None
         while result != FunctionResult.SUCCESS:
             tries += 1
 
@@ -110,15 +213,33 @@ class Agent:
                 break
 
             if tries > self.max_tries:
-                print(colored(f"Tried {self.max_tries} times (agent.max_tries) Aborting", "red"))
+                self.log(f"Tried {self.max_tries} times (agent.max_tries) Aborting", "red")
+                abort = True
+                break
+
+            if self.budget_exceeded():
+                self.log("Token budget exceeded. Aborting", "red")
+                errors["budget"] = 1
                 abort = True
                 break
             
-            reply = self.llm(self.history + transient_history + temp_messages, stop=self.stop_list)
-            reply = self.clean_reply(reply)
+            llm_start = time.perf_counter()
+            replies = yield "llm", history + transient_history + temp_messages
+            llm_time += time.perf_counter() - llm_start
+            if isinstance(replies, GeneratorError):
+                # The generator gave up, there is no reply to try again with
+                self.log(f"Error: {replies}. Aborting", "red")
+                errors["generator"] = 1
+                output = str(replies)
+                abort = True
+                break
+            reply = self.select_reply(replies)
+            for repair in self.last_repairs:
+                repairs[repair] = repairs.get(repair, 0) + 1
 
             if len(reply) < 2:
-                print(colored("Error: empty reply, retrying", "red"))
+                self.log("Error: empty reply, retrying", "red")
+                errors["empty"] = errors.get("empty", 0) + 1
                 temp_messages.append(dict(
                     role="assistant",
                     content="..."
@@ -129,12 +250,16 @@ class Agent:
                 ))
                 continue
 
-            print(colored(f">> {reply}", "yellow"))
+            self.log(f">> {reply}", "yellow")
             
-            result, output = self.engine.execute(reply)
+            result, output = yield "execute", reply
+            parse_time += self.engine.last_parse_time
+            function_time += self.engine.last_function_time
+            if self.engine.last_error is not None:
+                errors[self.engine.last_error] = errors.get(self.engine.last_error, 0) + 1
 
             if result == FunctionResult.ERROR:
-                print(colored(output, "red"))
+                self.log(output, "red")
                 temp_messages.append(dict(
                     role="assistant",
                     content=reply
@@ -144,8 +269,27 @@ class Agent:
                     content=output
                 ))
             else:
-                print(colored(output, "green"))
+                self.log(output, "green")
                 break
+
+        self.step_count += 1
+        if self.metrics is not None:
+            prompt_tokens, completion_tokens = self.token_usage()
+            self.metrics.emit(StepMetrics(
+                agent=self.name,
+                step=self.step_count,
+                result="abort" if abort else result.name.lower(),
+                tries=min(tries, self.max_tries),
+                llm_time=llm_time,
+                parse_time=parse_time,
+                function_time=function_time,
+                total_time=time.perf_counter() - start,
+                prompt_tokens=prompt_tokens - start_tokens[0],
+                completion_tokens=completion_tokens - start_tokens[1],
+                saved_tokens=getattr(self.context_policy, "last_saved_tokens", 0),
+                errors=errors,
+                repairs=repairs,
+            ))
         
         return StepOutput(
             abort=abort,
@@ -154,26 +298,108 @@ class Agent:
             result=result,
         )
 
-    def run(self, iterations=10, resume=False, transient_history=[]):
+    def step(self, transient_history=[]):
+        loop = self.step_loop(transient_history)
+        value = None
+        token = current_agent.set(self.name)
+        step_token = current_step.set(self.step_count + 1)
+        try:
+            while True:
+                try:
+                    kind, payload = loop.send(value)
+                except StopIteration as e:
+                    return e.value
+                if kind == "context":
+                    value = self.build_context()
+                elif kind == "llm":
+                    # Only the agent's own calls are constrained, not the summarizer or the llm calls made by functions
+                    grammar_token = current_grammar.set(self.engine.grammar(self.multi_call))
+                    try:
+                        value = self.generate(payload)
+                    except GeneratorError as e:
+                        value = e
+                    finally:
+                        current_grammar.reset(grammar_token)
+                else:
+                    value = self.execute(payload)
+        finally:
+            current_agent.reset(token)
+            current_step.reset(step_token)
+
+    async def astep(self, transient_history=[]):
+        loop = self.step_loop(transient_history)
+        value = None
+        token = current_agent.set(self.name)
+        step_token = current_step.set(self.step_count + 1)
+        try:
+            while True:
+                try:
+                    kind, payload = loop.send(value)
+                except StopIteration as e:
+                    return e.value
+                if kind == "context":
+                    value = await self.abuild_context()
+                elif kind == "llm":
+                    # Only the agent's own calls are constrained, not the summarizer or the llm calls made by functions
+                    grammar_token = current_grammar.set(self.engine.grammar(self.multi_call))
+                    try:
+                        value = await self.agenerate(payload)
+                    except GeneratorError as e:
+                        value = e
+                    finally:
+                        current_grammar.reset(grammar_token)
+                else:
+                    value = await self.aexecute(payload)
+        finally:
+            current_agent.reset(token)
+            current_step.reset(step_token)
+
+    def execute(self, reply):
+        return self.engine.execute_many(reply) if self.multi_call else self.engine.execute(reply)
+
+    async def aexecute(self, reply):
+        return await self.engine.aexecute_many(reply) if self.multi_call else await self.engine.aexecute(reply)
+
+    def generate(self, messages):
+        if self.candidates <= 1:
+            return [self.llm(messages, stop=self.stop_list)]
+        return sample_replies(self.llm, messages, self.candidates, self.stop_list)
+
+    async def agenerate(self, messages):
+        if self.candidates > 1 and hasattr(self.llm, "asample"):
+            return await self.llm.asample(messages, n=self.candidates, stop=self.stop_list)
+        return await asyncio.gather(*[self.acall_llm(messages) for _ in range(max(self.candidates, 1))])
+
+    async def acall_llm(self, messages):
+        if hasattr(self.llm, "acall"):
+            return await self.llm.acall(messages, stop=self.stop_list)
+        if inspect.iscoroutinefunction(self.llm.__call__):
+            return await self.llm(messages, stop=self.stop_list)
+        return await asyncio.to_thread(self.llm, messages, stop=self.stop_list)
+
+    def run_loop(self, iterations, resume):
+        # Yields every time a step is needed and receives its StepOutput
         if self.prompt is None and self.system_prompt is None:
             raise ValueError("You must set a prompt before running the agent")
         
         if not resume:
             if self.prompt:
-                print(colored(f"prompt:\n{self.prompt}", "blue"))
+                self.log(f"prompt:\n{self.prompt}", "blue")
             if self.system_prompt:
-                print(colored(f"system_prompt:\n{self.system_prompt}", "blue"))
+                self.log(f"system_prompt:\n{self.system_prompt}", "blue")
             self.reset()
             self.build_initial_messages()
+            if self.checkpoint is not None:
+                self.checkpoint.start(self)
 
-        print(colored(f"Running {iterations if iterations > 0 else 'infinite'} iterations", "green"))
+        self.log(f"Running {iterations if iterations > 0 else 'infinite'} iterations", "green")
         it = 0
         while iterations < 0 or it < iterations:
             if self.on_iteration_start is not None: self.on_iteration_start(self)
             if self.do_stop:
                 break
 
-            step_output = self.step(transient_history)
+            step_output = yield
             if self.on_iteration_step is not None: self.on_iteration_step(self, step_output)
 
             if step_output.abort:
@@ -187,8 +413,30 @@ class Agent:
                 role="user",
                 content=step_output.output
             ))
+            if self.checkpoint is not None:
+                self.checkpoint.append(self, step_output)
             if self.on_iteration_end is not None:
                 self.on_iteration_end(self)
             
             it = it + 1
-        print(colored(f"Finished {iterations} iterations", "green"))
+        self.log(f"Finished {iterations} iterations", "green")
+
+    def run(self, iterations=10, resume=False, transient_history=[]):
+        loop = self.run_loop(iterations, resume)
+        step_output = None
+        while True:
+            try:
+                loop.send(step_output)
+            except StopIteration:
+                return
+            step_output = self.step(transient_history)
+
+    async def arun(self, iterations=10, resume=False, transient_history=[]):
+        loop = self.run_loop(iterations, resume)
+        step_output = None
+        while True:
+            try:
+                loop.send(step_output)
+            except StopIteration:
+                return
+            step_output = await self.astep(transient_history)
@@ -0,0 +1,167 @@
+import base64
+import json
+import os
+import pickle
+import struct
+
+
+OFFSET = struct.Struct("<Q")
+
+def encode(value):
+    return base64.b64encode(pickle.dumps(value)).decode()
+
+def decode(value):
+    return pickle.loads(base64.b64decode(value))
+
+def pickle_state(state):
+    return {key: pickle.dumps(value) for key, value in state.items()}
+
+def state_changes(before, after):
+    # Keys of engine.state whose pickles differ between two pickle_state results, and the deleted keys
+    changed = [key for key, value in after.items() if before.get(key) != value]
+    deleted = [key for key in before if key not in after]
+    return changed, deleted
+
+class Checkpoint:
+    # Append-only JSONL log of the committed steps of an agent. Each step record holds the keys of engine.state
+    # that the step changed, and the whole state is snapshotted every snapshot_every steps so that restoring
+    # does not apply the whole log. The .idx file holds the offset of every step record for random access
+    def __init__(self, path, snapshot_every=10, fsync=False):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.log = None
+        self.index = None
+        self.steps = 0
+        # Pickles of the values of engine.state as of the last record, to find the changed keys
+        self.pickled = dict()
+
+    def write(self, record, indexed=False):
+        offset = self.log.tell()
+        self.log.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+        self.log.flush()
+        if indexed:
+            self.index.write(OFFSET.pack(offset))
+            self.index.flush()
+        if self.fsync:
+            os.fsync(self.log.fileno())
+            os.fsync(self.index.fileno())
+
+    def snapshot(self, state):
+        self.pickled = pickle_state(state)
+        self.write(dict(type="state", step=self.steps, state=encode(state)))
+
+    def changes(self, state):
+        pickled = pickle_state(state)
+        changed, deleted = state_changes(self.pickled, pickled)
+        self.pickled = pickled
+        if len(changed) == 0 and len(deleted) == 0:
+            return None
+        return encode(({key: pickled[key] for key in changed}, deleted))
+
+    def start(self, agent):
+        # Called after the initial messages and the bootstrap, truncates any previous session
+        self.close()
+        self.log = open(self.path, "wb")
+        self.index = open(self.index_path, "wb")
+        self.steps = 0
+        self.write(dict(type="start", prompt=agent.prompt, system_prompt=agent.system_prompt, history=agent.history, pinned=agent.pinned))
+        self.snapshot(agent.engine.state)
+
+    def append(self, agent, step_output):
+        self.steps += 1
+        record = dict(type="step", step=self.steps, reply=step_output.reply, output=step_output.output, result=step_output.result.name.lower())
+        # The changes are written in the step record, so that a torn line loses both
+        changes = self.changes(agent.engine.state)
+        if changes is not None:
+            record["state"] = changes
+        self.write(record, indexed=True)
+        if self.steps % self.snapshot_every == 0:
+            self.snapshot(agent.engine.state)
+
+    def __len__(self):
+        return os.path.getsize(self.index_path) // OFFSET.size if os.path.exists(self.index_path) else 0
+
+    def read_step(self, step):
+        # Steps are numbered from 1
+        if step < 1 or step > len(self):
+            raise IndexError(f"Step {step} is not in the checkpoint")
+        with open(self.index_path, "rb") as index:
+            index.seek((step - 1) * OFFSET.size)
+            offset, = OFFSET.unpack(index.read(OFFSET.size))
+        with open(self.path, "rb") as log:
+            log.seek(offset)
+            return json.loads(log.readline())
+
+    def records(self):
+        # Yields (offset, size, record), stopping at a line torn by a crash
+        with open(self.path, "rb") as log:
+            offset = 0
+            for line in log:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return
+                yield offset, len(line), record
+                offset += len(line)
+
+    def restore(self, agent):
+        # Rebuilds agent.history and engine.state from the log without calling the llm, the bootstrap or any function.
+        # The state changes of the steps after the last snapshot are applied to it
+        self.close()
+        start = None
+        steps = []
+        snapshot = None
+        end = 0
+        for offset, size, record in self.records():
+            end = offset + size
+            if record["type"] == "start":
+                start = record
+            elif record["type"] == "step":
+                steps.append((offset, record))
+            elif record["type"] == "state":
+                snapshot = record
+        if start is None or snapshot is None:
+            raise ValueError(f"{self.path} is not a valid checkpoint")
+
+        agent.reset()
+        agent.prompt = start["prompt"]
+        agent.system_prompt = start["system_prompt"]
+        agent.history = list(start["history"])
+        agent.pinned = start["pinned"]
+        for _, record in steps:
+            agent.history.append(dict(role="assistant", content=record["reply"]))
+            agent.history.append(dict(role="user", content=record["output"]))
+        agent.step_count = len(steps)
+
+        state = agent.engine.state
+        state.clear()
+        state.update(decode(snapshot["state"]))
+        for _, record in steps[snapshot["step"]:]:
+            if "state" in record:
+                changed, deleted = decode(record["state"])
+                for key in deleted:
+                    state.pop(key, None)
+                state.update({key: pickle.loads(value) for key, value in changed.items()})
+        self.pickled = pickle_state(state)
+        # The prompt already went through the engine.help check when the session started
+        agent.engine.help_called = True
+
+        # Drop a torn tail and rebuild the index, then continue appending
+        with open(self.path, "r+b") as log:
+            log.truncate(end)
+        with open(self.index_path, "wb") as index:
+            index.write(b"".join(OFFSET.pack(offset) for offset, _ in steps))
+        self.log = open(self.path, "ab")
+        self.index = open(self.index_path, "ab")
+        self.steps = len(steps)
+
+    def close(self):
+        for file in [self.log, self.index]:
+            if file is not None:
+                file.close()
+        self.log = None
+        self.index = None
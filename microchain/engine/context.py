@@ -0,0 +1,152 @@
+import asyncio
+import inspect
+from collections import deque
+
+
+def estimate_tokens(text):
+    # Rough estimate for english text, pass a tokenizer based counter for exact budgets
+    return len(text) // 4 + 1
+
+class ContextPolicy:
+    # Decides which part of Agent.history is sent to the llm. The first `pinned` messages
+    # (system prompt, prompt and bootstrap) are always kept, the rest are assistant/user exchanges
+    def __init__(self, count_tokens=estimate_tokens, token_cache_size=8192, saved_tokens_size=1000):
+        self.count_tokens = count_tokens
+        self.token_cache_size = token_cache_size
+        self.token_counts = dict()
+        # Tokens saved at each of the last `saved_tokens_size` steps
+        self.saved_tokens = deque(maxlen=saved_tokens_size)
+
+    @property
+    def last_saved_tokens(self):
+        return self.saved_tokens[-1] if len(self.saved_tokens) > 0 else 0
+
+    def count(self, messages):
+        total = 0
+        for message in messages:
+            content = message["content"]
+            tokens = self.token_counts.get(content)
+            if tokens is None:
+                if len(self.token_counts) >= self.token_cache_size:
+                    self.token_counts.clear()
+                tokens = self.token_counts[content] = self.count_tokens(content)
+            total += tokens
+        return total
+
+    def select(self, pinned, exchanges):
+        raise NotImplementedError
+
+    async def aselect(self, pinned, exchanges):
+        return self.select(pinned, exchanges)
+
+    def __call__(self, history, pinned):
+        messages = self.select(history[:pinned], history[pinned:])
+        self.saved_tokens.append(self.count(history) - self.count(messages))
+        return messages
+
+    async def acall(self, history, pinned):
+        messages = await self.aselect(history[:pinned], history[pinned:])
+        self.saved_tokens.append(self.count(history) - self.count(messages))
+        return messages
+
+class FullContext(ContextPolicy):
+    def select(self, pinned, exchanges):
+        return pinned + exchanges
+
+class SlidingWindowContext(ContextPolicy):
+    # Keeps the last `keep_last` exchanges, dropping the oldest ones until the context fits `max_tokens`
+    def __init__(self, keep_last=10, max_tokens=None, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_last = keep_last
+        self.max_tokens = max_tokens
+
+    def window(self, pinned, exchanges):
+        start = max(len(exchanges) - 2*self.keep_last, 0)
+        if self.max_tokens is not None:
+            budget = self.max_tokens - self.count(pinned)
+            used = self.count(exchanges[start:])
+            while used > budget and start < len(exchanges):
+                used -= self.count(exchanges[start:start+2])
+                start += 2
+        return start
+
+    def select(self, pinned, exchanges):
+        return pinned + exchanges[self.window(pinned, exchanges):]
+
+class SummaryContext(SlidingWindowContext):
+    # Folds the exchanges that leave the window into a running summary.
+    # summarize(summary, messages) gets the previous summary (None at first) and the newly folded messages
+    def __init__(self, summarize, keep_last=10, max_tokens=None, **kwargs):
+        super().__init__(keep_last=keep_last, max_tokens=max_tokens, **kwargs)
+        self.summarize = summarize
+        self.summary = None
+        self.folded = 0
+
+    def fold(self, pinned, exchanges):
+        # Returns the start of the window and the exchanges that left it since the last call
+        if len(exchanges) < self.folded:
+            # The history was rewritten, start a new summary
+            self.summary = None
+            self.folded = 0
+        # The summary counts towards max_tokens, the exchanges already in it are not sent again when the window grows back
+        start = max(self.window(self.build(pinned, []), exchanges), self.folded)
+        return start, exchanges[self.folded:start]
+
+    def select(self, pinned, exchanges):
+        # A longer summary can push more exchanges out of the window, they are folded until it fits
+        start, folded = self.fold(pinned, exchanges)
+        while len(folded) > 0:
+            if inspect.iscoroutinefunction(self.summarize):
+                raise TypeError(f"{self.summarize.__name__} is asynchronous, use agent.arun()")
+            self.summary = self.summarize(self.summary, folded)
+            self.folded = start
+            start, folded = self.fold(pinned, exchanges)
+        return self.build(pinned, exchanges[start:])
+
+    async def aselect(self, pinned, exchanges):
+        start, folded = self.fold(pinned, exchanges)
+        while len(folded) > 0:
+            if hasattr(self.summarize, "acall"):
+                self.summary = await self.summarize.acall(self.summary, folded)
+            elif inspect.iscoroutinefunction(self.summarize):
+                self.summary = await self.summarize(self.summary, folded)
+            else:
+                # Run blocking summarizers in a worker thread so the event loop stays free
+                self.summary = await asyncio.to_thread(self.summarize, self.summary, folded)
+            self.folded = start
+            start, folded = self.fold(pinned, exchanges)
+        return self.build(pinned, exchanges[start:])
+
+    def build(self, pinned, window):
+        if self.summary is None:
+            return pinned + window
+
+        summary = f"Summary of the previous steps:\n{self.summary}"
+        if len(pinned) > 0 and pinned[-1]["role"] == "user":
+            # Keep the roles alternating
+            pinned = pinned[:-1] + [dict(role="user", content=f"{pinned[-1]['content']}\n\n{summary}")]
+        else:
+            pinned = pinned + [dict(role="user", content=summary)]
+        return pinned + window
+
+class LLMSummarizer:
+    def __init__(self, llm, prompt="Summarize the following steps of an agent in a few sentences, keeping every result that may be needed later."):
+        self.llm = llm
+        self.prompt = prompt
+
+    def content(self, summary, messages):
+        steps = "\n".join([f"{message['role']}: {message['content']}" for message in messages])
+        content = f"{self.prompt}\n\nPrevious summary:\n{summary}\n\nSteps:\n{steps}" if summary else f"{self.prompt}\n\nSteps:\n{steps}"
+        return [dict(role="user", content=content)]
+
+    def __call__(self, summary, messages):
+        if getattr(self.llm, "is_async", False) or inspect.iscoroutinefunction(self.llm.__call__):
+            raise TypeError(f"{type(self.llm).__name__} is asynchronous, use agent.arun() to summarize with it")
+        return self.llm(self.content(summary, messages))
+
+    async def acall(self, summary, messages):
+        if hasattr(self.llm, "acall"):
+            return await self.llm.acall(self.content(summary, messages))
+        if inspect.iscoroutinefunction(self.llm.__call__):
+            return await self.llm(self.content(summary, messages))
+        return await asyncio.to_thread(self.llm, self.content(summary, messages))
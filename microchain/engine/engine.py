@@ -1,17 +1,60 @@
 import ast
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from microchain.engine.function import Function, FunctionResult
+from microchain.engine.function_cache import FunctionCache
+from microchain.engine.grammar import Grammar, ToolCalls
+
+
+def is_constant(node):
+    # Constants and signed numbers, -1 is a unary operation on the constant 1
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return isinstance(node.operand, ast.Constant) and type(node.operand.value) in [int, float]
+    return isinstance(node, ast.Constant)
 
 class Engine:
-    def __init__(self, state=dict()):
+    def __init__(self, state=dict(), parse_cache_size=1024, max_workers=8):
         self.state = state
         self.functions = dict()
         self.help_called = False
         self.agent = None
+        self.parse_cache_size = parse_cache_size
+        self.parse_cache = OrderedDict()
+        self.help_cache = None
+        self.grammar_cache = dict()
+        self.last_error = None
+        self.last_parse_time = 0
+        self.last_function_time = 0
+        self.last_results = []
+        self.max_workers = max_workers
+        self.executor = None
     
-    def register(self, function):
+    def register(self, function, cache=None, process_pool=None):
+        # Passing a FunctionCache makes the function cacheable and shares the cache with the other users of the instance,
+        # passing a ProcessPool runs the function in its worker processes
+        function.process_pool = process_pool
+        if cache is not None:
+            function.cache = cache
+        elif function.cacheable and function.cache is None:
+            function.cache = FunctionCache(max_size=function.cache_size, ttl=function.cache_ttl)
+        function.compile_validator()
         self.functions[function.name] = function
         function.bind(state=self.state, engine=self)
+        self.invalidate()
+
+    def unregister(self, name):
+        if name not in self.functions:
+            raise ValueError(f"Function {name} is not registered")
+        del self.functions[name]
+        self.invalidate()
+
+    def invalidate(self):
+        # Drops everything derived from the registered functions
+        self.help_cache = None
+        self.grammar_cache = dict()
 
     def bind(self, agent):
         self.agent = agent
@@ -21,54 +64,236 @@ class Engine:
             raise ValueError("You must bind the engine to an agent before stopping")
         self.agent.stop()
 
-    def execute(self, command):
-        if self.agent is None:
-            raise ValueError("You must bind the engine to an agent before executing commands")
-        if not self.help_called:
-            raise ValueError("You never accessed the help property. Building a prompt without including the help string is a very bad idea.")
+    def parse(self, command):
+        # Native tool calls are already parsed
+        if isinstance(command, ToolCalls) and len(command.calls) == 1:
+            function_name, function_kwargs = command.calls[0]
+            return FunctionResult.SUCCESS, (function_name, (), tuple(function_kwargs.items())), None
+
+        # Parsing does not depend on the registered functions, so results (errors included) are cached
+        parsed = self.parse_cache.get(command)
+        if parsed is not None:
+            self.parse_cache.move_to_end(command)
+            return parsed
+
+        parsed = self.parse_command(command)
+        if self.parse_cache_size > 0:
+            self.parse_cache[command] = parsed
+            if len(self.parse_cache) > self.parse_cache_size:
+                self.parse_cache.popitem(last=False)
+        return parsed
+
+    def parse_command(self, command):
         try:
             tree = ast.parse(command)
         except SyntaxError:
-            return FunctionResult.ERROR, f"Error: syntax error in command {command}. Please try again."
+            return FunctionResult.ERROR, f"Error: syntax error in command {command}. Please try again.", "syntax"
         
         if len(tree.body) != 1:
-            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
+            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again.", "unknown"
 
         if not isinstance(tree.body[0], ast.Expr):
-            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
+            return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again.", "unknown"
 
         if not isinstance(tree.body[0].value, ast.Call):
-            return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again."
+            return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again.", "not_call"
         
         if not isinstance(tree.body[0].value.func, ast.Name):
-            return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again."
+            return FunctionResult.ERROR, f"Error: the command {command} must be a function call. Please try again.", "not_call"
 
         function_name = tree.body[0].value.func.id
         function_args = tree.body[0].value.args
         function_kwargs = tree.body[0].value.keywords
 
         for arg in function_args:
-            if not isinstance(arg, ast.Constant):
-                return FunctionResult.ERROR, f"Error: the command {command} must be a function call, you cannot use variables. Please try again."
+            if not is_constant(arg):
+                return FunctionResult.ERROR, f"Error: the command {command} must be a function call, you cannot use variables. Please try again.", "variables"
 
         for kwarg in function_kwargs:
             if not isinstance(kwarg, ast.keyword):
-                return FunctionResult.ERROR, f"Error: the command {command} must be a function call, you cannot use variables. Please try again."
-            if not isinstance(kwarg.value, ast.Constant):
-                return FunctionResult.ERROR, f"Error: the command {command} must be a function call, you cannot use variables. Please try again."
+                return FunctionResult.ERROR, f"Error: the command {command} must be a function call, you cannot use variables. Please try again.", "variables"
+            if not is_constant(kwarg.value):
+                return FunctionResult.ERROR, f"Error: the command {command} must be a function call, you cannot use variables. Please try again.", "variables"
+
+        function_args = tuple(ast.literal_eval(arg) for arg in function_args)
+        function_kwargs = tuple((kwarg.arg, ast.literal_eval(kwarg.value)) for kwarg in function_kwargs)
 
-        function_args = [arg.value for arg in function_args]
-        function_kwargs = {kwarg.arg: kwarg.value.value for kwarg in function_kwargs}
+        return FunctionResult.SUCCESS, (function_name, function_args, function_kwargs), None
+
+    def validate(self, command):
+        # Checks a command without running it, on success returns the function to call and its arguments.
+        # The category of the last error is stored in last_error
+        self.last_error = None
+        result, parsed, self.last_error = self.parse(command)
+        if result == FunctionResult.ERROR:
+            return result, parsed
+
+        function_name, function_args, function_kwargs = parsed
+        function_args = list(function_args)
+        function_kwargs = dict(function_kwargs)
 
         if function_name not in self.functions:
+            self.last_error = "unknown"
             return FunctionResult.ERROR, f"Error: unknown command {command}. Please try again."
         
-        if len(function_args) + len(function_kwargs) != len(self.functions[function_name].call_parameters):
+        if not self.functions[function_name].check_arguments(function_args, function_kwargs):
+            self.last_error = "arguments"
             return FunctionResult.ERROR, self.functions[function_name].error
 
-        return self.functions[function_name].safe_call(args=function_args, kwargs=function_kwargs)   
+        return FunctionResult.SUCCESS, (self.functions[function_name], function_args, function_kwargs)
+
+    def check_ready(self):
+        if self.agent is None:
+            raise ValueError("You must bind the engine to an agent before executing commands")
+        if not self.help_called:
+            raise ValueError("You never accessed the help property. Building a prompt without including the help string is a very bad idea.")
+
+    def prepare(self, command):
+        self.check_ready()
+        start = time.perf_counter()
+        result, call = self.validate(command)
+        self.last_parse_time = time.perf_counter() - start
+        self.last_function_time = 0
+        return result, call
+
+    def error_category(self, function, output):
+        if output == function.error:
+            return "arguments"
+        if output.startswith("Error inside function call"):
+            return "function"
+        return "timeout"
+
+    def finish(self, start, function, result, output):
+        self.last_function_time = time.perf_counter() - start
+        if result == FunctionResult.ERROR:
+            self.last_error = self.error_category(function, output)
+        return result, output
+
+    def execute(self, command):
+        result, call = self.prepare(command)
+        if result == FunctionResult.ERROR:
+            return result, call
+
+        function, function_args, function_kwargs = call
+        start = time.perf_counter()
+        return self.finish(start, function, *function.call(args=function_args, kwargs=function_kwargs))
+
+    async def aexecute(self, command):
+        # Same as execute but async functions and timeouts are awaited on the running loop
+        result, call = self.prepare(command)
+        if result == FunctionResult.ERROR:
+            return result, call
+
+        function, function_args, function_kwargs = call
+        start = time.perf_counter()
+        return self.finish(start, function, *await function.acall(args=function_args, kwargs=function_kwargs))
     
+    def split(self, reply):
+        # Splits a reply into its commands, one per line or as a list of calls
+        if isinstance(reply, ToolCalls):
+            return [ToolCalls([call]) for call in reply.calls]
+        try:
+            tree = ast.parse(reply)
+        except SyntaxError:
+            return [reply]
+        if len(tree.body) > 1:
+            return [ast.get_source_segment(reply, statement) for statement in tree.body]
+        if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr) and isinstance(tree.body[0].value, (ast.List, ast.Tuple)) and len(tree.body[0].value.elts) > 0:
+            return [ast.get_source_segment(reply, element) for element in tree.body[0].value.elts]
+        return [reply]
+
+    def validate_many(self, reply):
+        # Validates every command of a reply, on success returns the list of calls
+        calls = []
+        errors = []
+        for command in self.split(reply):
+            result, call = self.validate(command)
+            if result == FunctionResult.ERROR:
+                errors.append((command, call, self.last_error))
+            calls.append(call)
+        if len(errors) > 0:
+            self.last_error = errors[0][2]
+            return FunctionResult.ERROR, "\n".join(f"[error] {command} -> {output}" for command, output, _ in errors)
+        return FunctionResult.SUCCESS, calls
+
+    def prepare_many(self, reply):
+        # Consecutive functions that are safe for parallel execution are batched together, the others run alone and in order
+        self.check_ready()
+        start = time.perf_counter()
+        result, calls = self.validate_many(reply)
+        self.last_parse_time = time.perf_counter() - start
+        self.last_function_time = 0
+        self.last_results = []
+        if result == FunctionResult.ERROR:
+            return result, calls
+
+        batches = []
+        for call in calls:
+            if call[0].parallel and len(batches) > 0 and batches[-1][0][0].parallel:
+                batches[-1].append(call)
+            else:
+                batches.append([call])
+        return result, batches
+
+    def finish_many(self, start, reply, batches):
+        self.last_function_time = time.perf_counter() - start
+        functions = [function for batch in batches for function, _, _ in batch]
+        for function, (result, output) in zip(functions, self.last_results):
+            if result == FunctionResult.ERROR:
+                self.last_error = self.error_category(function, output)
+                break
+        return FunctionResult.SUCCESS, "\n".join(f"[{result.name.lower()}] {command} -> {output}" for command, (result, output) in zip(self.split(reply), self.last_results))
+
+    def execute_many(self, reply):
+        # Runs all the commands of a reply if they are all valid
+        result, batches = self.prepare_many(reply)
+        if result == FunctionResult.ERROR:
+            return result, batches
+
+        start = time.perf_counter()
+        for batch in batches:
+            if len(batch) == 1:
+                function, function_args, function_kwargs = batch[0]
+                self.last_results.append(function.call(args=function_args, kwargs=function_kwargs))
+                continue
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self.last_results += list(self.executor.map(lambda call: call[0].call(args=call[1], kwargs=call[2]), batch))
+        return self.finish_many(start, reply, batches)
+
+    async def aexecute_many(self, reply):
+        result, batches = self.prepare_many(reply)
+        if result == FunctionResult.ERROR:
+            return result, batches
+
+        start = time.perf_counter()
+        for batch in batches:
+            if len(batch) == 1:
+                function, function_args, function_kwargs = batch[0]
+                self.last_results.append(await function.acall(args=function_args, kwargs=function_kwargs))
+                continue
+            # Blocking functions of a batch run in worker threads to overlap with the others
+            self.last_results += await asyncio.gather(*[
+                function.acall(args=function_args, kwargs=function_kwargs) if function.is_async else asyncio.to_thread(function.call, args=function_args, kwargs=function_kwargs)
+                for function, function_args, function_kwargs in batch
+            ])
+        return self.finish_many(start, reply, batches)
+
+    @property
+    def tools(self):
+        # Tool definitions for generators with native tool calling, they replace the help string in the prompt
+        self.help_called = True
+        return self.grammar().tools
+
     @property
     def help(self):
         self.help_called = True
-        return "\n".join([f.help for f in self.functions.values()])
+        if self.help_cache is None:
+            self.help_cache = "\n".join([f.help for f in self.functions.values()])
+        return self.help_cache
+
+    def grammar(self, multi_call=False):
+        # Grammar of the calls to the registered functions, for generators with guided decoding
+        if multi_call not in self.grammar_cache:
+            self.grammar_cache[multi_call] = Grammar(self.functions.values(), multi_call=multi_call)
+        return self.grammar_cache[multi_call]
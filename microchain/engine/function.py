@@ -1,5 +1,8 @@
+import asyncio
 import enum
 import inspect
+import threading
+from functools import cached_property
 import traceback
 from termcolor import colored
 
@@ -7,7 +10,39 @@ class FunctionResult(enum.Enum):
     SUCCESS = 0
     ERROR = 1
 
+def accepted_types(annotation):
+    # Types of the constants accepted for an annotation, annotations that are not plain classes are not checked
+    if annotation is float:
+        return (int, float)
+    if annotation is complex:
+        return (int, float, complex)
+    if isinstance(annotation, type) and annotation is not inspect.Parameter.empty:
+        return annotation
+    return object
+
+background = dict(loop=None, lock=threading.Lock())
+
+def background_loop():
+    # Event loop shared by the blocking agents to run async functions and functions with a timeout
+    with background["lock"]:
+        if background["loop"] is None:
+            background["loop"] = asyncio.new_event_loop()
+            threading.Thread(target=background["loop"].run_forever, daemon=True).start()
+        return background["loop"]
+
+class FunctionTimeout(Exception):
+    pass
+
 class Function:
+    # Set to False for functions that must not run concurrently with other calls of the same reply
+    parallel = True
+    # Seconds after which a call is abandoned and reported as an error, None waits forever
+    timeout = None
+    # Pure functions can reuse the outputs of previous calls with the same arguments
+    cacheable = False
+    cache_size = 1024
+    cache_ttl = None
+
     def __init__(self):
         self.call_signature = inspect.signature(self.__call__)        
         self.call_parameters = []
@@ -17,12 +52,53 @@ class Function:
             
             self.call_parameters.append(dict(
                 name=name,
-                annotation=parameter.annotation
+                annotation=parameter.annotation,
+                default=parameter.default
             ))
         self.state = None
         self.engine = None
+        self.is_async = inspect.iscoroutinefunction(self.__call__)
+        self.cache = None
+        self.process_pool = None
+
+    def __getstate__(self):
+        # What a worker process needs to run the function, the engine and the langfuse wrapper stay in the parent
+        state = self.__dict__.copy()
+        for name in ["engine", "cache", "process_pool", "__call__"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.engine = None
+        self.cache = None
+        self.process_pool = None
+
+    def compile_validator(self):
+        # Precomputes everything needed to check the arguments of a call without inspecting the signature
+        self.parameter_names = [parameter["name"] for parameter in self.call_parameters]
+        self.parameter_types = {parameter["name"]: accepted_types(parameter["annotation"]) for parameter in self.call_parameters}
+        self.required_parameters = frozenset(parameter["name"] for parameter in self.call_parameters if parameter["default"] is inspect.Parameter.empty)
+
+    def check_arguments(self, args, kwargs):
+        if len(args) > len(self.parameter_names):
+            return False
+        names = self.parameter_names[:len(args)]
+        for name in kwargs:
+            if name not in self.parameter_types or name in names:
+                return False
+        if not self.required_parameters.issubset(names + list(kwargs)):
+            return False
+        for name, value in zip(names, args):
+            if not isinstance(value, self.parameter_types[name]):
+                return False
+        for name, value in kwargs.items():
+            if not isinstance(value, self.parameter_types[name]):
+                return False
+        return True
     
     def bind(self, *, state, engine):
+        self.invalidate()
         self.state = state
         self.engine = engine
         if self.engine.agent is not None and getattr(self.engine.agent, "enable_langfuse", False):
@@ -40,48 +116,121 @@ class Function:
     def name(self):
         return type(self).__name__
 
-    @property
+    def invalidate(self):
+        # Drops the memoized metadata, called when the function is (re)registered
+        for name in ["example", "signature", "help", "error", "timeout_error"]:
+            self.__dict__.pop(name, None)
+
+    @cached_property
     def example(self):
-        if not isinstance(self.example_args, list):
+        example_args = self.example_args
+        if not isinstance(example_args, list):
             raise ValueError("example_args must be a list")
-        if len(self.example_args) != len(self.call_parameters):
+        if len(example_args) != len(self.call_parameters):
             raise ValueError(f"example_args must have the same length as call_parameters ({len(self.call_parameters)})")
 
-        bound = self.call_signature.bind(*self.example_args)
+        bound = self.call_signature.bind(*example_args)
         return f"{self.name}({', '.join([f'{name}={repr(value)}' for name, value in bound.arguments.items()])})"
     
-    @property
+    @cached_property
     def signature(self):
         arguments = [f"{parameter['name']}: {parameter['annotation'].__name__}" for parameter in self.call_parameters]
         return f"{self.name}({', '.join(arguments)})"
 
-    @property
+    @cached_property
     def help(self):
         return f"{self.signature}\n{self.description}.\nExample: {self.example}\n"
 
-    @property
+    @cached_property
     def error(self):
         return f"Error: wrong format. Use {self.signature}. Example: {self.example}. Please try again."
 
+    @cached_property
+    def timeout_error(self):
+        return f"Error: {self.name} timed out after {self.timeout} seconds. Please try again."
+
+    @property
+    def hit_rate(self):
+        return self.cache.hit_rate(self.name) if self.cache is not None else 0
+
     def check_bind(self):
         if self.state is None:
             raise ValueError("You must register the function to an Engine")
 
+    async def call_with_timeout(self, args, kwargs):
+        # Sync functions run in a worker thread that is left running if it times out
+        if self.is_async:
+            task = asyncio.ensure_future(self.__call__(*args, **kwargs))
+        else:
+            task = asyncio.ensure_future(asyncio.to_thread(self.__call__, *args, **kwargs))
+        if self.timeout is None:
+            return await task
+        done, _ = await asyncio.wait([task], timeout=self.timeout)
+        if len(done) == 0:
+            task.cancel()
+            raise FunctionTimeout()
+        return task.result()
+
     def safe_call(self, args, kwargs):
         self.check_bind()
+        if self.process_pool is not None:
+            return self.process_pool.call(self, args, kwargs)
         try:
-            return FunctionResult.SUCCESS, str(self.__call__(*args, **kwargs))
+            if not self.is_async and self.timeout is None:
+                return FunctionResult.SUCCESS, str(self.__call__(*args, **kwargs))
+            future = asyncio.run_coroutine_threadsafe(self.call_with_timeout(args, kwargs), background_loop())
+            return FunctionResult.SUCCESS, str(future.result())
         except Exception as e:
-            stacktrace = ''.join(traceback.TracebackException.from_exception(e).format())
+            return self.handle_exception(e)
+
+    async def asafe_call(self, args, kwargs):
+        self.check_bind()
+        if self.process_pool is not None:
+            return await asyncio.to_thread(self.process_pool.call, self, args, kwargs)
+        try:
+            if not self.is_async and self.timeout is None:
+                # Blocking functions run in a worker thread so that they do not stall the other agents on the loop
+                return FunctionResult.SUCCESS, str(await asyncio.to_thread(self.__call__, *args, **kwargs))
+            return FunctionResult.SUCCESS, str(await self.call_with_timeout(args, kwargs))
+        except Exception as e:
+            return self.handle_exception(e)
+
+    def call(self, args, kwargs):
+        # safe_call behind the cache of cacheable functions, only successful outputs are cached
+        if self.cache is not None:
+            output = self.cache.get(self, args, kwargs)
+            if output is not None:
+                return FunctionResult.SUCCESS, output
+        result, output = self.safe_call(args, kwargs)
+        if self.cache is not None and result == FunctionResult.SUCCESS:
+            self.cache.put(self, args, kwargs, output)
+        return result, output
+
+    async def acall(self, args, kwargs):
+        if self.cache is not None:
+            output = self.cache.get(self, args, kwargs)
+            if output is not None:
+                return FunctionResult.SUCCESS, output
+        result, output = await self.asafe_call(args, kwargs)
+        if self.cache is not None and result == FunctionResult.SUCCESS:
+            self.cache.put(self, args, kwargs, output)
+        return result, output
+
+    def handle_exception(self, e):
+        if isinstance(e, FunctionTimeout):
+            return FunctionResult.ERROR, self.timeout_error
+
+        stacktrace = ''.join(traceback.TracebackException.from_exception(e).format())
+        if not getattr(self.engine.agent, "quiet", False):
             print(colored(f"Exception in Function call {e}", "red"))
             print(colored(stacktrace, "red"))
 
-            if type(e) in [TypeError, SyntaxError]:
-                # Catch remaining errors from a bad call
-                return FunctionResult.ERROR, self.error
-            else:
-                # Return the stacktrace of the error from inside the function
-                return FunctionResult.ERROR, f"Error inside function call: {stacktrace}"
+        if type(e) in [TypeError, SyntaxError]:
+            # Catch remaining errors from a bad call
+            return FunctionResult.ERROR, self.error
+        else:
+            # Return the stacktrace of the error from inside the function
+            return FunctionResult.ERROR, f"Error inside function call: {stacktrace}"
 
     def __call__(self, command):
         raise NotImplementedError
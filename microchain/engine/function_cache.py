@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class FunctionCache:
+    # LRU cache of the outputs of pure functions, keyed on the function name and its arguments bound to the parameter names.
+    # Pass the same instance to several Engine.register calls to share it across engines
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = dict()
+        self.misses = dict()
+
+    def key(self, function, args, kwargs):
+        # Sum(1, 2), Sum(a=1, b=2) and Sum(1, b=2) share an entry, arguments that do not bind are not cached
+        try:
+            bound = function.call_signature.bind(*args, **kwargs)
+        except TypeError:
+            return None
+        bound.apply_defaults()
+        return function.name, repr(tuple(bound.arguments.items()))
+
+    def get(self, function, args, kwargs):
+        key = self.key(function, args, kwargs)
+        name = function.name
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses[name] = self.misses.get(name, 0) + 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits[name] = self.hits.get(name, 0) + 1
+            return entry[0]
+
+    def put(self, function, args, kwargs, output):
+        key = self.key(function, args, kwargs)
+        if key is None:
+            return
+        with self.lock:
+            self.entries[key] = (output, time.monotonic())
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def hit_rate(self, name):
+        with self.lock:
+            total = self.hits.get(name, 0) + self.misses.get(name, 0)
+            return self.hits.get(name, 0) / total if total > 0 else 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
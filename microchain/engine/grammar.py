@@ -0,0 +1,171 @@
+import json
+import re
+from functools import cached_property
+
+
+# Argument values that Engine.parse accepts in a text reply
+GBNF_TERMINALS = {
+    "int": '"-"? [0-9]+',
+    "float": '"-"? [0-9]+ ("." [0-9]+)? ([eE] [-+]? [0-9]+)?',
+    "str": '"\\"" ([^"\\\\\\n] | "\\\\" [^\\n])* "\\""',
+    "bool": '"True" | "False"',
+    "value": 'float | str | bool | "None"',
+    "ws": '" "?',
+}
+
+REGEX_TERMINALS = {
+    "int": r'-?\d+',
+    "float": r'-?\d+(\.\d+)?([eE][-+]?\d+)?',
+    "str": r'"([^"\\\n]|\\.)*"',
+    "bool": r'(True|False)',
+}
+REGEX_TERMINALS["value"] = f'({REGEX_TERMINALS["float"]}|{REGEX_TERMINALS["str"]}|{REGEX_TERMINALS["bool"]}|None)'
+
+JSON_TYPES = {
+    "int": dict(type="integer"),
+    "float": dict(type="number"),
+    "str": dict(type="string"),
+    "bool": dict(type="boolean"),
+    "value": dict(),
+}
+
+def terminal(annotation):
+    if annotation in [int, float, str, bool]:
+        return annotation.__name__
+    return "value"
+
+def optional_tail(parts, required, separator, optional):
+    # Joins the arguments, the ones with a default can be left out from the end
+    head = separator.join(parts[:required])
+    tail = ""
+    for index, part in reversed(list(enumerate(parts[required:], start=required))):
+        tail = optional((separator if index > 0 else "") + part + tail)
+    return head + tail
+
+def format_call(name, arguments):
+    return f"{name}({', '.join(f'{key}={value!r}' for key, value in arguments.items())})"
+
+class ToolCalls(str):
+    # Reply made of native tool calls as (name, arguments) pairs. It reads as the equivalent text reply,
+    # so it fits in Agent.history, and the engine runs the calls without parsing the text
+    def __new__(cls, calls, listed=False):
+        text = ", ".join(format_call(name, arguments) for name, arguments in calls)
+        reply = super().__new__(cls, f"[{text}]" if listed else text)
+        reply.calls = list(calls)
+        return reply
+
+class Grammar:
+    # Formal grammars of the calls accepted by an Engine, for servers with constrained decoding:
+    # GBNF for llama.cpp, a regex or a JSON schema for vLLM guided decoding
+    def __init__(self, functions, multi_call=False):
+        self.functions = list(functions)
+        self.multi_call = multi_call
+
+    def required(self, function):
+        return sum(1 for parameter in function.call_parameters if parameter["default"] is function.call_signature.empty)
+
+    def arguments_schema(self, function):
+        return dict(
+            type="object",
+            properties={parameter["name"]: JSON_TYPES[terminal(parameter["annotation"])] for parameter in function.call_parameters},
+            required=[parameter["name"] for parameter in function.call_parameters[:self.required(function)]],
+            additionalProperties=False,
+        )
+
+    @cached_property
+    def gbnf(self):
+        if len(self.functions) == 0:
+            raise ValueError("The engine has no registered functions")
+        rules = []
+        if self.multi_call:
+            rules.append('root ::= "[" call ("," ws call)* "]"')
+        else:
+            rules.append("root ::= call")
+        rules.append("call ::= " + " | ".join(f"call{index}" for index in range(len(self.functions))))
+        for index, function in enumerate(self.functions):
+            arguments = [terminal(parameter["annotation"]) for parameter in function.call_parameters]
+            body = optional_tail(arguments, self.required(function), ' "," ws ', lambda rule: f" ({rule.strip()})?")
+            rules.append(" ".join(f'call{index} ::= {json.dumps(function.name + "(")} {body} ")"'.split()))
+        rules += [f"{name} ::= {rule}" for name, rule in GBNF_TERMINALS.items()]
+        return "\n".join(rules) + "\n"
+
+    @cached_property
+    def regex(self):
+        if len(self.functions) == 0:
+            raise ValueError("The engine has no registered functions")
+        calls = []
+        for function in self.functions:
+            arguments = [REGEX_TERMINALS[terminal(parameter["annotation"])] for parameter in function.call_parameters]
+            calls.append(re.escape(function.name) + r"\(" + optional_tail(arguments, self.required(function), ", ?", lambda part: f"({part})?") + r"\)")
+        call = "(" + "|".join(calls) + ")"
+        if self.multi_call:
+            return rf"\[{call}(, ?{call})*\]"
+        return call
+
+    @cached_property
+    def json_schema(self):
+        # Calls as {"name": ..., "arguments": {...}}, to_call turns them back into the engine syntax
+        if len(self.functions) == 0:
+            raise ValueError("The engine has no registered functions")
+        calls = []
+        for function in self.functions:
+            calls.append(dict(
+                type="object",
+                properties=dict(
+                    name=dict(const=function.name),
+                    arguments=self.arguments_schema(function),
+                ),
+                required=["name", "arguments"],
+                additionalProperties=False,
+            ))
+        schema = dict(anyOf=calls)
+        if self.multi_call:
+            return dict(type="array", items=schema, minItems=1)
+        return schema
+
+    def to_call(self, reply):
+        # JSON replies become ToolCalls, replies that are not JSON are returned as they are and the engine reports the error
+        try:
+            decoded = json.loads(reply)
+        except ValueError:
+            return reply
+        calls = []
+        for call in decoded if isinstance(decoded, list) else [decoded]:
+            if not isinstance(call, dict) or not isinstance(call.get("arguments", dict()), dict):
+                return reply
+            calls.append((call.get("name"), call.get("arguments", dict())))
+        return ToolCalls(calls, listed=isinstance(decoded, list))
+
+    @cached_property
+    def tools(self):
+        # OpenAI tool definitions
+        if len(self.functions) == 0:
+            raise ValueError("The engine has no registered functions")
+        return [
+            dict(type="function", function=dict(name=function.name, description=function.description, parameters=self.arguments_schema(function)))
+            for function in self.functions
+        ]
+
+    def tool_calls(self, tool_calls):
+        # Reply of an OpenAI message with tool calls, arguments that are not a JSON object are
+        # left in the text so that the engine reports the error
+        calls = []
+        for tool_call in tool_calls:
+            try:
+                arguments = json.loads(tool_call.function.arguments or "{}")
+            except ValueError:
+                arguments = None
+            if not isinstance(arguments, dict):
+                return f"{tool_call.function.name}({tool_call.function.arguments})"
+            calls.append((tool_call.function.name, arguments))
+        return ToolCalls(calls, listed=self.multi_call or len(calls) > 1)
+
+    def request(self, guided_decoding):
+        # Extra body of an OpenAI compatible request
+        if guided_decoding == "gbnf":
+            return dict(grammar=self.gbnf)
+        if guided_decoding == "regex":
+            return dict(guided_regex=self.regex)
+        if guided_decoding == "json":
+            return dict(guided_json=self.json_schema)
+        raise ValueError(f"Unknown guided decoding {guided_decoding}, use gbnf, regex or json")
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class StepMetrics:
+    agent: str
+    step: int
+    result: str
+    tries: int
+    llm_time: float
+    parse_time: float
+    function_time: float
+    total_time: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    saved_tokens: int = 0
+    errors: dict[str, int] = field(default_factory=dict)
+    # Replies fixed by Agent.repair, each one saved an llm round trip
+    repairs: dict[str, int] = field(default_factory=dict)
+
+class MemorySink:
+    def __init__(self):
+        self.steps = []
+
+    def __call__(self, metrics):
+        self.steps.append(metrics)
+
+class JSONLSink:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+
+    def __call__(self, metrics):
+        line = json.dumps(asdict(metrics))
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class PrometheusSink:
+    # Aggregates the steps and rewrites a Prometheus text exposition file, to be collected by the node exporter textfile collector
+    def __init__(self, path, write_every=1):
+        self.path = path
+        self.write_every = write_every
+        self.lock = threading.Lock()
+        self.steps = Counter()
+        self.errors = Counter()
+        self.repairs = Counter()
+        self.totals = defaultdict(float)
+
+    def __call__(self, metrics):
+        with self.lock:
+            self.steps[metrics.result] += 1
+            self.errors.update(metrics.errors)
+            self.repairs.update(metrics.repairs)
+            self.totals["tries"] += metrics.tries
+            self.totals["llm_seconds"] += metrics.llm_time
+            self.totals["parse_seconds"] += metrics.parse_time
+            self.totals["function_seconds"] += metrics.function_time
+            self.totals["step_seconds"] += metrics.total_time
+            self.totals["prompt_tokens"] += metrics.prompt_tokens
+            self.totals["completion_tokens"] += metrics.completion_tokens
+            self.totals["saved_tokens"] += metrics.saved_tokens
+            if sum(self.steps.values()) % self.write_every == 0:
+                self.write()
+
+    def render(self):
+        lines = ["# TYPE microchain_steps_total counter"]
+        lines += [f'microchain_steps_total{{result="{result}"}} {count}' for result, count in sorted(self.steps.items())]
+        lines.append("# TYPE microchain_errors_total counter")
+        lines += [f'microchain_errors_total{{category="{category}"}} {count}' for category, count in sorted(self.errors.items())]
+        lines.append("# TYPE microchain_repairs_total counter")
+        lines += [f'microchain_repairs_total{{repair="{repair}"}} {count}' for repair, count in sorted(self.repairs.items())]
+        for name, value in sorted(self.totals.items()):
+            lines.append(f"# TYPE microchain_{name}_total counter")
+            lines.append(f"microchain_{name}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # Write and rename so that collectors never read a partial file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.render())
+        os.replace(temp_path, self.path)
+
+class Metrics:
+    def __init__(self, sinks=None):
+        self.sinks = sinks if sinks is not None else [MemorySink()]
+
+    def emit(self, metrics):
+        for sink in self.sinks:
+            sink(metrics)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from microchain.engine.agent import Agent, StepOutput
+
+
+@dataclass
+class EpisodeResult:
+    index: int
+    steps: list[StepOutput] = field(default_factory=list)
+    history: list = field(default_factory=list)
+    error: Exception | None = None
+    elapsed: float = 0
+
+    @property
+    def aborted(self):
+        return len(self.steps) > 0 and self.steps[-1].abort
+
+@dataclass
+class PoolStats:
+    episodes: int
+    steps: int
+    errors: int
+    aborted: int
+    elapsed: float
+
+    @property
+    def episodes_per_second(self):
+        return self.episodes / self.elapsed if self.elapsed > 0 else 0
+
+    @property
+    def steps_per_second(self):
+        return self.steps / self.elapsed if self.elapsed > 0 else 0
+
+    def __str__(self):
+        return f"episodes={self.episodes} steps={self.steps} errors={self.errors} aborted={self.aborted} elapsed={self.elapsed:.2f}s ({self.episodes_per_second:.2f} episodes/s, {self.steps_per_second:.2f} steps/s)"
+
+class AgentPool:
+    def __init__(self, factory, concurrency=8, setup=None, timeout=None, agent_kwargs=dict()):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.factory = factory
+        self.concurrency = concurrency
+        self.setup = setup
+        self.timeout = timeout
+        self.agent_kwargs = agent_kwargs
+        self.stats = None
+
+    async def run_episode(self, index, semaphore, iterations):
+        episode = EpisodeResult(index=index)
+        async with semaphore:
+            start = time.perf_counter()
+            agent = None
+            try:
+                llm, engine, prompt = self.factory()
+                on_iteration_step = self.agent_kwargs.get("on_iteration_step")
+                def collect(agent, step_output):
+                    episode.steps.append(step_output)
+                    if on_iteration_step is not None:
+                        on_iteration_step(agent, step_output)
+
+                agent = Agent(
+                    llm=llm,
+                    engine=engine,
+                    **dict(self.agent_kwargs, on_iteration_step=collect)
+                )
+                agent.prompt = prompt
+                if self.setup is not None:
+                    self.setup(agent)
+
+                await asyncio.wait_for(agent.arun(iterations=iterations), timeout=self.timeout)
+            except Exception as e:
+                # An episode failure is reported in its result, it never stops the pool
+                episode.error = e
+            if agent is not None:
+                episode.history = agent.history
+            episode.elapsed = time.perf_counter() - start
+        return episode
+
+    async def arun(self, episodes, iterations=10):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            self.run_episode(index, semaphore, iterations) for index in range(episodes)
+        ])
+        self.stats = PoolStats(
+            episodes=len(results),
+            steps=sum(len(result.steps) for result in results),
+            errors=sum(result.error is not None for result in results),
+            aborted=sum(result.aborted for result in results),
+            elapsed=time.perf_counter() - start,
+        )
+        return results
+
+    def run(self, episodes, iterations=10):
+        return asyncio.run(self.arun(episodes, iterations=iterations))
@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+
+from microchain.engine.checkpoint import pickle_state, state_changes
+from microchain.engine.function import FunctionResult
+
+
+class WorkerEngine:
+    # Stands in for the engine inside a worker: stop() is forwarded to the parent engine, the rest is not available
+    def __init__(self, name, state):
+        self.name = name
+        self.state = state
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def __getattr__(self, attribute):
+        raise AttributeError(f"{self.name} runs in a process pool worker, where self.engine.{attribute} is not available")
+
+def worker_main(connection):
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        function, args, kwargs = message
+        function.engine = WorkerEngine(function.name, function.state)
+        before = pickle_state(function.state)
+        try:
+            output = function(*args, **kwargs)
+            if function.is_async:
+                output = asyncio.run(output)
+            status, output = "success", str(output)
+        except Exception as e:
+            stacktrace = ''.join(traceback.TracebackException.from_exception(e).format())
+            status, output = "arguments" if type(e) in [TypeError, SyntaxError] else "function", stacktrace
+        try:
+            # The keys of engine.state the call changed or deleted, to apply them to the state of the parent
+            changed, deleted = state_changes(before, pickle_state(function.state))
+            changes = ({key: function.state[key] for key in changed}, deleted)
+        except Exception as e:
+            status, output, changes = "function", ''.join(traceback.TracebackException.from_exception(e).format()), (dict(), [])
+        connection.send((status, output, changes, function.engine.stopped))
+
+class ProcessPool:
+    # Runs functions in warm worker processes, each with its own pipe. A worker that times out
+    # or crashes is replaced without affecting the calls running on the other workers
+    def __init__(self, max_workers=None, timeout=None, start_method=None):
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+        self.timeout = timeout
+        self.context = multiprocessing.get_context(start_method)
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.restarts = 0
+
+    def start_worker(self):
+        connection, child_connection = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(child_connection, ), daemon=True)
+        process.start()
+        child_connection.close()
+        return process, connection
+
+    def acquire(self):
+        with self.lock:
+            if self.idle.empty() and self.workers < self.max_workers:
+                self.workers += 1
+                return self.start_worker()
+        return self.idle.get()
+
+    def replace(self, worker):
+        process, connection = worker
+        process.kill()
+        process.join()
+        connection.close()
+        with self.lock:
+            self.restarts += 1
+        self.idle.put(self.start_worker())
+
+    def call(self, function, args, kwargs):
+        timeout = function.timeout if function.timeout is not None else self.timeout
+        worker = self.acquire()
+        process, connection = worker
+        try:
+            connection.send((function, args, kwargs))
+        except Exception as e:
+            # Nothing was sent if the call cannot be pickled
+            self.idle.put(worker)
+            stacktrace = ''.join(traceback.TracebackException.from_exception(e).format())
+            return FunctionResult.ERROR, f"Error inside function call: {stacktrace}"
+
+        if not connection.poll(timeout):
+            self.replace(worker)
+            return FunctionResult.ERROR, f"Error: {function.name} timed out after {timeout} seconds. Please try again."
+        try:
+            status, output, (changed, deleted), stopped = connection.recv()
+        except EOFError:
+            process.join()
+            exitcode = process.exitcode
+            self.replace(worker)
+            return FunctionResult.ERROR, f"Error inside function call: the worker process crashed (exit code {exitcode})"
+        self.idle.put(worker)
+
+        # The state changes and the stop made in the worker are applied in the parent, as if the call ran here
+        with self.lock:
+            for key in deleted:
+                function.state.pop(key, None)
+            function.state.update(changed)
+        if stopped:
+            function.engine.stop()
+
+        if status == "success":
+            return FunctionResult.SUCCESS, output
+        if status == "arguments":
+            return FunctionResult.ERROR, function.error
+        return FunctionResult.ERROR, f"Error inside function call: {output}"
+
+    def close(self):
+        while not self.idle.empty():
+            process, connection = self.idle.get()
+            connection.send(None)
+            process.join(timeout=1)
+            if process.is_alive():
+                process.kill()
+            connection.close()
+        with self.lock:
+            self.workers = 0
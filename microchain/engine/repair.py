@@ -0,0 +1,118 @@
+import difflib
+import re
+import threading
+from collections import Counter
+
+from microchain.engine.function import FunctionResult
+
+
+QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "«": '"', "»": '"', "‘": "'", "’": "'", "‚": "'"})
+CLOSING = {"(": ")", "[": "]", "{": "}"}
+
+def segments(reply):
+    # Splits a reply into (text, is_string) segments, an unclosed string runs to the end
+    parts = []
+    start = 0
+    quote = None
+    escape = False
+    for i, char in enumerate(reply):
+        if quote is not None:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                parts.append((reply[start:i+1], True))
+                start = i + 1
+                quote = None
+        elif char in "'\"":
+            parts.append((reply[start:i], False))
+            start = i
+            quote = char
+    parts.append((reply[start:], quote is not None))
+    return parts
+
+class Repair:
+    # Cheap deterministic fixes of near-miss replies, tried in order on the replies that do not validate
+    # before spending an llm round trip. Each repair is a method taking the reply text and the names of the
+    # registered functions and returning the fixed text, subclasses can add their own and list them in `repairs`
+    default_repairs = ["quotes", "fences", "prefix", "parens", "name"]
+
+    def __init__(self, repairs=None, cutoff=0.75):
+        self.repairs = repairs if repairs is not None else list(self.default_repairs)
+        self.cutoff = cutoff
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.repaired = 0
+        self.failed = 0
+
+    def quotes(self, reply, names):
+        return reply.translate(QUOTES)
+
+    def fences(self, reply, names):
+        match = re.search(r"```[\w+-]*[ \t]*\n?(.*?)(```|$)", reply, re.DOTALL)
+        if match is not None:
+            reply = match.group(1)
+        return reply.strip().strip("`")
+
+    def prefix(self, reply, names):
+        # "Action: Sum(1, 2)", "Function call: Sum(1, 2)"
+        return re.sub(r"^\s*[A-Za-z][\w ]{0,30}:\s*", "", reply, count=1)
+
+    def parens(self, reply, names):
+        # Closes the strings and the brackets left open at the end of the reply
+        stack = []
+        quote = None
+        escape = False
+        for char in reply.rstrip():
+            if quote is not None:
+                if escape:
+                    escape = False
+                elif char == "\\":
+                    escape = True
+                elif char == quote:
+                    quote = None
+            elif char in "'\"":
+                quote = char
+            elif char in CLOSING:
+                stack.append(CLOSING[char])
+            elif char in CLOSING.values() and len(stack) > 0 and stack[-1] == char:
+                stack.pop()
+        return reply.rstrip() + (quote or "") + "".join(reversed(stack))
+
+    def match_name(self, name, names):
+        if name in names:
+            return name
+        for candidate in names:
+            if candidate.lower() == name.lower():
+                return candidate
+        matches = difflib.get_close_matches(name, names, n=1, cutoff=self.cutoff)
+        return matches[0] if len(matches) > 0 else name
+
+    def name(self, reply, names):
+        # Unknown function names are matched against the registry, string arguments are left alone
+        return "".join(
+            text if is_string else re.sub(r"(?<![\w.])([A-Za-z_]\w*)(?=\s*\()", lambda match: self.match_name(match.group(1), names), text)
+            for text, is_string in segments(reply)
+        )
+
+    def __call__(self, reply, clean, validate, names):
+        # Applies the repairs one after the other and stops at the first valid reply.
+        # Returns the repaired reply, or None, and the names of the repairs that changed it
+        names = list(names)
+        applied = []
+        for repair in self.repairs:
+            repaired = getattr(self, repair)(reply, names)
+            if repaired == reply:
+                continue
+            reply = repaired
+            applied.append(repair)
+            cleaned = clean(reply)
+            if len(cleaned) >= 2 and validate(cleaned)[0] == FunctionResult.SUCCESS:
+                with self.lock:
+                    self.repaired += 1
+                    self.counts.update(applied)
+                return cleaned, applied
+        with self.lock:
+            self.failed += 1
+        return None, []
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from microchain.models.llm import sample_replies
+
+
+class CachedGenerator:
+    # Wraps a generator with a persistent SQLite cache of its replies.
+    # Replies are cached only for deterministic settings (temperature 0) unless cache_sampling=True
+    def __init__(self, generator, path="microchain_cache.sqlite", max_entries=100000, max_age=None, read_only=False, cache_sampling=False, evict_every=100):
+        self.generator = generator
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.read_only = read_only
+        self.cache_sampling = cache_sampling
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, output TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def __getattr__(self, name):
+        # Expose model, token_tracker, print_usage... of the wrapped generator
+        if name == "generator":
+            raise AttributeError(name)
+        return getattr(self.generator, name)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    @property
+    def enabled(self):
+        return self.cache_sampling or getattr(self.generator, "temperature", None) == 0
+
+    def key(self, prompt, stop, n=None):
+        request = dict(
+            model=getattr(self.generator, "model", None),
+            prompt=prompt,
+            stop=stop,
+            temperature=getattr(self.generator, "temperature", None),
+            top_p=getattr(self.generator, "top_p", None),
+            max_tokens=getattr(self.generator, "max_tokens", None),
+            guided_decoding=getattr(self.generator, "guided_decoding", None),
+            tools=getattr(self.generator, "tools", False),
+            n=n,
+        )
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT output, created FROM responses WHERE key = ?", (key, )).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                with self.connection:
+                    self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, output):
+        if self.read_only:
+            return
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, output, created, accessed) VALUES (?, ?, ?, ?)", (key, json.dumps(output), now, now))
+            self.writes += 1
+            if self.writes % self.evict_every == 0:
+                self.evict(now)
+
+    def evict(self, now):
+        if self.max_age is not None:
+            self.connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age, ))
+        if self.max_entries is not None:
+            self.connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries, ))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __call__(self, prompt, stop=None):
+        if not self.enabled:
+            return self.generator(prompt, stop=stop)
+
+        key = self.key(prompt, stop)
+        output = self.get(key)
+        if output is None:
+            output = self.generator(prompt, stop=stop)
+            self.put(key, output)
+        return output
+
+    def sample_generator(self, prompt, n, stop):
+        return sample_replies(self.generator, prompt, n, stop)
+
+    def sample(self, prompt, n, stop=None):
+        if not self.enabled:
+            return self.sample_generator(prompt, n, stop)
+
+        key = self.key(prompt, stop, n=n)
+        outputs = self.get(key)
+        if outputs is None:
+            outputs = self.sample_generator(prompt, n, stop)
+            self.put(key, outputs)
+        return outputs
+
+class AsyncCachedGenerator(CachedGenerator):
+    async def __call__(self, prompt, stop=None):
+        if not self.enabled:
+            return await self.generator(prompt, stop=stop)
+
+        key = self.key(prompt, stop)
+        output = self.get(key)
+        if output is None:
+            output = await self.generator(prompt, stop=stop)
+            self.put(key, output)
+        return output
+
+    async def sample_generator(self, prompt, n, stop):
+        if hasattr(self.generator, "sample"):
+            return await self.generator.sample(prompt, n=n, stop=stop)
+        return await asyncio.gather(*[self.generator(prompt, stop=stop) for _ in range(n)])
+
+    async def sample(self, prompt, n, stop=None):
+        if not self.enabled:
+            return await self.sample_generator(prompt, n, stop)
+
+        key = self.key(prompt, stop, n=n)
+        outputs = self.get(key)
+        if outputs is None:
+            outputs = await self.sample_generator(prompt, n, stop)
+            self.put(key, outputs)
+        return outputs
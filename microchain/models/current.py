@@ -0,0 +1,8 @@
+from contextvars import ContextVar
+
+
+# Set by the agent while it is generating, so that shared generators, schedulers and trackers know who is calling
+current_agent = ContextVar("microchain_agent", default=None)
+current_step = ContextVar("microchain_step", default=None)
+# Grammar of the calls the running agent accepts, sent by generators with guided decoding
+current_grammar = ContextVar("microchain_grammar", default=None)
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+import weakref
+
+
+# Connection limits of the shared pools, change them before creating the first generator
+http_limits = dict(max_connections=256, max_keepalive_connections=64, keepalive_expiry=60)
+
+pools = dict(sync=None, async_by_loop=weakref.WeakKeyDictionary(), async_default=None, lock=threading.Lock())
+
+def make_limits():
+    import httpx
+    return httpx.Limits(**http_limits)
+
+def shared_http_client():
+    # Process-wide keep-alive pool shared by the blocking generators
+    import httpx
+    with pools["lock"]:
+        if pools["sync"] is None:
+            pools["sync"] = httpx.Client(limits=make_limits(), timeout=None, follow_redirects=True)
+        return pools["sync"]
+
+def shared_async_http_client():
+    # Async connections are bound to an event loop, so there is a pool per running loop
+    import httpx
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with pools["lock"]:
+        if loop is None:
+            if pools["async_default"] is None:
+                pools["async_default"] = httpx.AsyncClient(limits=make_limits(), timeout=None, follow_redirects=True)
+            return pools["async_default"]
+        if loop not in pools["async_by_loop"]:
+            pools["async_by_loop"][loop] = httpx.AsyncClient(limits=make_limits(), timeout=None, follow_redirects=True)
+        return pools["async_by_loop"][loop]
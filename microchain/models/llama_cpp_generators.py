@@ -0,0 +1,117 @@
+import os
+import threading
+from dataclasses import dataclass, field
+
+from microchain.models.token_tracker import TokenTracker
+
+
+@dataclass
+class Usage:
+    prompt_tokens: int
+    completion_tokens: int
+    # Prompt tokens whose KV cache was reused, reported like the OpenAI prompt cache
+    prompt_tokens_details: dict = field(default_factory=dict)
+
+
+def common_prefix(evaluated, tokens):
+    length = 0
+    for evaluated_token, token in zip(evaluated, tokens):
+        if evaluated_token != token:
+            break
+        length += 1
+    return length
+
+
+class LlamaCppGenerator:
+    # Runs a GGUF model in process with llama-cpp-python. The model and its KV cache stay loaded between
+    # calls and only the tokens after the longest common prefix with the previous call are evaluated,
+    # so a step costs the new messages instead of the whole conversation.
+    # Prompts are strings, use LLM(generator=..., templates=[...]) to render the messages
+    def __init__(
+        self,
+        *,
+        model_path: str | None = None,
+        llama=None,
+        n_ctx: int = 4096,
+        n_threads: int | None = None,
+        n_batch: int = 512,
+        temperature: float = 0.8,
+        top_p: float = 0.95,
+        top_k: int = 40,
+        max_tokens: int = 512,
+        seed: int = 0,
+        token_tracker: TokenTracker | bool | None = None,
+    ) -> None:
+        if llama is None:
+            try:
+                from llama_cpp import Llama
+            except ImportError:
+                raise ImportError("Please install llama-cpp-python using pip install llama-cpp-python")
+            if model_path is None:
+                raise ValueError("model_path is required")
+            llama = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_batch=n_batch, n_gpu_layers=0, seed=seed, verbose=False)
+
+        self.llama = llama
+        self.model = os.path.basename(model_path) if model_path is not None else "llama.cpp"
+        self.n_ctx = n_ctx
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.token_tracker = token_tracker if token_tracker is not None else TokenTracker()
+        # A llama.cpp context runs one sequence at a time
+        self.lock = threading.Lock()
+        self.evaluated_tokens = 0
+        self.reused_tokens = 0
+
+    @property
+    def reuse_rate(self) -> float:
+        total = self.evaluated_tokens + self.reused_tokens
+        return self.reused_tokens / total if total > 0 else 0
+
+    def evaluate_prompt(self, tokens: list[int]) -> int:
+        # Keeps the KV cache of the common prefix, at least one token is evaluated to get fresh logits.
+        # input_ids is a buffer of n_ctx tokens, only the first n_tokens are in the KV cache
+        prefix = min(common_prefix(self.llama.input_ids[:self.llama.n_tokens], tokens), len(tokens) - 1)
+        self.llama.n_tokens = prefix
+        self.llama.eval(tokens[prefix:])
+        self.reused_tokens += prefix
+        self.evaluated_tokens += len(tokens) - prefix
+        return prefix
+
+    def generate(self, stop: list[str]) -> tuple[str, int]:
+        output = b""
+        completion_tokens = 0
+        while completion_tokens < self.max_tokens and self.llama.n_tokens < self.n_ctx:
+            token = self.llama.sample(top_k=self.top_k, top_p=self.top_p, temp=self.temperature, repeat_penalty=1.0)
+            if token == self.llama.token_eos():
+                break
+            completion_tokens += 1
+            output += self.llama.detokenize([token])
+            text = output.decode("utf-8", errors="ignore")
+            stops = [text.find(sequence) for sequence in stop if sequence in text]
+            if len(stops) > 0:
+                return text[:min(stops)], completion_tokens
+            self.llama.eval([token])
+        return output.decode("utf-8", errors="ignore"), completion_tokens
+
+    def __call__(self, prompt: str, stop: list[str] | None = None) -> str:
+        assert isinstance(prompt, str), "prompt must be a string, render the messages with LLM(generator=..., templates=[...])"
+        with self.lock:
+            tokens = self.llama.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+            if len(tokens) >= self.n_ctx:
+                raise ValueError(f"The prompt has {len(tokens)} tokens, more than the context size {self.n_ctx}")
+            prefix = self.evaluate_prompt(tokens)
+            output, completion_tokens = self.generate(stop or [])
+
+        if self.token_tracker:
+            self.token_tracker.update_from_usage(Usage(len(tokens), completion_tokens, dict(cached_tokens=prefix)), model=self.model)
+        return output.strip()
+
+    def reset(self) -> None:
+        # Drops the KV cache, the next call evaluates the whole prompt
+        with self.lock:
+            self.llama.reset()
+
+    def print_usage(self) -> None:
+        print(f"Usage: evaluated={self.evaluated_tokens}, reused={self.reused_tokens} ({self.reuse_rate:.0%})")
@@ -1,8 +1,11 @@
 import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
 from enum import Enum
 
+from microchain.models.retry import RetryPolicy
+from microchain.models.templates import ChatTemplateRenderer
 from microchain.models.token_tracker import TokenTracker
-from pydantic import BaseModel
 
 
 class Llama31SupportedRole(str, Enum):
@@ -17,7 +20,8 @@ class Llama31Message(t.TypedDict):
     content: str
 
 
-class Usage(BaseModel):
+@dataclass
+class Usage:
     prompt_tokens: int
     completion_tokens: int
 
@@ -34,7 +38,9 @@ class ReplicateLlama31ChatGenerator:
         top_p: float = 0.9,
         top_k: int = 50,
         max_tokens: int = 1024,
-        token_tracker: TokenTracker | None = TokenTracker(),
+        token_tracker: TokenTracker | bool | None = None,
+        token_count_cache_size: int = 4096,
+        retry: RetryPolicy | None = None,
         enable_langfuse: bool = False,
     ) -> None:
         try:
@@ -49,11 +55,23 @@ class ReplicateLlama31ChatGenerator:
         self.top_p = top_p
         self.top_k = top_k
         self.max_tokens = max_tokens
-        self.token_tracker = token_tracker
+        self.token_tracker = token_tracker if token_tracker is not None else TokenTracker()
+        self.retry = retry if retry is not None else RetryPolicy()
+        # Replicate errors carry the HTTP status, connection failures are retried as well
+        self.transient_errors: tuple[type[BaseException], ...] = (ConnectionError, TimeoutError)
+        try:
+            import httpx
+            self.transient_errors += (httpx.TransportError, )
+        except ImportError:
+            pass
         self.enable_langfuse = enable_langfuse
         self.tokenizer = AutoTokenizer.from_pretrained(
             tokenizer_pretrained_model_name_or_path
         )
+        self.renderer = ChatTemplateRenderer(self.tokenizer)
+        self.token_count_cache_size = token_count_cache_size
+        self.token_counts: OrderedDict[str, int] = OrderedDict()
+        self.incremental_token_count: bool | None = None
 
         if self.enable_langfuse:
             self.init_langfuse()
@@ -66,39 +84,90 @@ class ReplicateLlama31ChatGenerator:
         
         self.__call__ = observe(name=self.__class__.__name__)(self.__call__)
 
-    def __call__(
-        self, messages: list[Llama31Message], stop: list[str] | None = None
-    ) -> str:
-        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False)
-        completion = self.client.predictions.create(
-            model=self.model,
-            input={
-                "prompt": prompt,
-                "prompt_template": "{prompt}",  # Force Replicate's API to just use our prompt as-is, otherwise they would use their default formatting which doesn't work for list of messages.
-                "stop": stop,
-                "top_k": self.top_k,
-                "top_p": self.top_p,
-                "max_tokens": self.max_tokens,
-                "temperature": self.temperature,
-            },
-            stream=True,
-        )
-        output = "".join(str(event) for event in completion.stream()).strip()
+    def build_input(self, prompt: str, stop: list[str] | None) -> dict:
+        return {
+            "prompt": prompt,
+            "prompt_template": "{prompt}",  # Force Replicate's API to just use our prompt as-is, otherwise they would use their default formatting which doesn't work for list of messages.
+            "stop": stop,
+            "top_k": self.top_k,
+            "top_p": self.top_p,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+        }
+
+    def count_segment_tokens(self, segment: str) -> int:
+        count = self.token_counts.get(segment)
+        if count is None:
+            count = len(self.tokenizer.encode(segment, add_special_tokens=False))
+            self.token_counts[segment] = count
+            if len(self.token_counts) > self.token_count_cache_size:
+                self.token_counts.popitem(last=False)
+        else:
+            self.token_counts.move_to_end(segment)
+        return count
+
+    def count_prompt_tokens(self, messages: list[Llama31Message], segments: tuple[str, ...]) -> int:
+        # Only the segments of newly appended messages are tokenized, the sum is checked once
+        # against the full count and the tokenizer falls back to it if the segment boundaries do not align
+        if self.incremental_token_count is False or len(segments) == 1:
+            return len(self.tokenizer.apply_chat_template(messages))
 
+        count = sum(self.count_segment_tokens(segment) for segment in segments)
+        if self.incremental_token_count is None:
+            full_count = len(self.tokenizer.apply_chat_template(messages))
+            self.incremental_token_count = count == full_count
+            return full_count
+        return count
+
+    def track_usage(self, messages: list[Llama31Message], segments: tuple[str, ...], output: str) -> None:
         if self.token_tracker:
             self.token_tracker.update_from_usage(
                 Usage(
-                    prompt_tokens=len(self.tokenizer.apply_chat_template(messages)),
+                    prompt_tokens=self.count_prompt_tokens(messages, segments),
                     completion_tokens=len(self.tokenizer.encode(output)),
-                )
+                ),
+                model=self.model,
             )
 
+    def __call__(
+        self, messages: list[Llama31Message], stop: list[str] | None = None
+    ) -> str:
+        prompt, segments = self.renderer.render(messages)
+        output = self.retry.call(lambda: self.predict(prompt, stop), Exception, self.transient_errors)
+        self.track_usage(messages, segments, output)
         return output
 
+    def predict(self, prompt: str, stop: list[str] | None) -> str:
+        completion = self.client.predictions.create(
+            model=self.model,
+            input=self.build_input(prompt, stop),
+            stream=True,
+        )
+        return "".join(str(event) for event in completion.stream()).strip()
+
     def print_usage(self) -> None:
         if self.token_tracker:
+            usage = self.token_tracker.totals(model=self.model)
             print(
-                f"Usage: prompt={self.token_tracker.prompt_tokens}, completion={self.token_tracker.completion_tokens}, cost=${self.token_tracker.get_total_cost(self.model):.2f}"
+                f"Usage: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, cost=${self.token_tracker.get_total_cost(self.model):.2f}"
             )
         else:
             print("Token tracker not available")
+
+
+class AsyncReplicateLlama31ChatGenerator(ReplicateLlama31ChatGenerator):
+    async def __call__(
+        self, messages: list[Llama31Message], stop: list[str] | None = None
+    ) -> str:
+        prompt, segments = self.renderer.render(messages)
+        output = await self.retry.acall(lambda: self.apredict(prompt, stop), Exception, self.transient_errors)
+        self.track_usage(messages, segments, output)
+        return output
+
+    async def apredict(self, prompt: str, stop: list[str] | None) -> str:
+        completion = await self.client.predictions.async_create(
+            model=self.model,
+            input=self.build_input(prompt, stop),
+            stream=True,
+        )
+        return "".join([str(event) async for event in completion.async_stream()]).strip()
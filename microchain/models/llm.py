@@ -1,13 +1,55 @@
+import asyncio
+import contextvars
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+
+def sample_replies(generator, prompt, n, stop):
+    if hasattr(generator, "sample"):
+        return generator.sample(prompt, n=n, stop=stop)
+    # Backends without native sampling of n replies get n concurrent calls
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        contexts = [contextvars.copy_context() for _ in range(n)]
+        return list(executor.map(lambda context: context.run(generator, prompt, stop=stop), contexts))
+
 class LLM:
     def __init__(self, *, generator, templates=[]):
         if not isinstance(templates, list):
             templates = [templates]
-        
+
         self.generator = generator
         self.templates = templates
-    
-    def __call__(self, prompt, stop=None):
+
+    @property
+    def is_async(self):
+        return inspect.iscoroutinefunction(self.generator.__call__)
+
+    def apply_templates(self, prompt):
         for template in self.templates:
             prompt = template(prompt)
+        return prompt
+
+    def __call__(self, prompt, stop=None):
+        if self.is_async:
+            raise TypeError(f"{type(self.generator).__name__} is asynchronous, use await llm.acall(...) or agent.arun()")
+        return self.generator(self.apply_templates(prompt), stop=stop)
+
+    async def acall(self, prompt, stop=None):
+        prompt = self.apply_templates(prompt)
+        if self.is_async:
+            return await self.generator(prompt, stop=stop)
+        # Run blocking generators in a worker thread so the event loop stays free
+        return await asyncio.to_thread(self.generator, prompt, stop=stop)
+
+    def sample(self, prompt, n, stop=None):
+        if self.is_async:
+            raise TypeError(f"{type(self.generator).__name__} is asynchronous, use await llm.asample(...) or agent.arun()")
+        return sample_replies(self.generator, self.apply_templates(prompt), n, stop)
 
-        return self.generator(prompt, stop=stop)
\ No newline at end of file
+    async def asample(self, prompt, n, stop=None):
+        prompt = self.apply_templates(prompt)
+        if self.is_async and hasattr(self.generator, "sample"):
+            return await self.generator.sample(prompt, n=n, stop=stop)
+        if self.is_async:
+            return await asyncio.gather(*[self.generator(prompt, stop=stop) for _ in range(n)])
+        return await asyncio.to_thread(sample_replies, self.generator, prompt, n, stop)
@@ -1,20 +1,103 @@
-from termcolor import colored
+import asyncio
+import threading
+import weakref
+
 from microchain.models.token_tracker import TokenTracker
+from microchain.models.streaming import CallDetector, StreamedReply, estimate_usage
+from microchain.models.http import shared_http_client, shared_async_http_client
+from microchain.models.retry import RetryPolicy
+from microchain.models.current import current_grammar
+
+
+def import_openai(enable_langfuse):
+    if enable_langfuse:
+        try:
+            from langfuse.openai import openai
+        except ImportError:
+            raise ImportError("Please install Langfuse and OpenAI python library using pip install langfuse openai")
+    else:
+        try:
+            import openai
+        except ImportError:
+            raise ImportError("Please install OpenAI python library using pip install openai")
+    return openai
+
+def openai_error(openai):
+    return openai.error.OpenAIError if hasattr(openai, "error") else openai.OpenAIError
+
+def scheduled(scheduler, function, request):
+    return function() if scheduler is None else scheduler.call(function, request)
+
+async def ascheduled(scheduler, function, request):
+    return await function() if scheduler is None else await scheduler.acall(function, request)
+
+def guided(request, guided_decoding):
+    # Constrains the reply to the calls of the running agent's engine, on servers that support it
+    grammar = current_grammar.get()
+    if guided_decoding is None or grammar is None:
+        return request
+    return dict(request, extra_body=dict(request.get("extra_body", dict()), **grammar.request(guided_decoding)))
+
+def with_tools(request, tools):
+    # Native tool calling sends the functions of the running agent's engine as tool definitions
+    grammar = current_grammar.get()
+    if not tools or grammar is None:
+        return request
+    return dict(request, tools=grammar.tools, tool_choice="required", extra_body=dict(request.get("extra_body", dict()), parallel_tool_calls=grammar.multi_call))
+
+def unguided(output, guided_decoding):
+    # JSON guided replies are turned back into calls
+    grammar = current_grammar.get()
+    if guided_decoding == "json" and grammar is not None:
+        return grammar.to_call(output)
+    return output
+
+def multi_call():
+    # Agents with multi_call accept several calls per reply, the stream must not stop at the first one
+    grammar = current_grammar.get()
+    return grammar is not None and grammar.multi_call
+
+def openai_transient_errors(openai):
+    # Errors without an HTTP status that are worth retrying
+    module = openai.error if hasattr(openai, "error") else openai
+    return tuple(getattr(module, name) for name in ["APIConnectionError", "APITimeoutError", "Timeout", "ServiceUnavailableError", "TryAgain"] if hasattr(module, name))
+
+
+class AsyncClient:
+    # The connections of an async client are bound to the event loop they are opened on, so the client is
+    # created lazily on first use, one per running loop. A client assigned to self.client is used on every loop
+    def init_client(self, openai):
+        self.clients = weakref.WeakKeyDictionary()
+        self.clients_lock = threading.Lock()
+        self.assigned_client = None
+
+    @property
+    def client(self):
+        if self.assigned_client is not None:
+            return self.assigned_client
+        loop = asyncio.get_running_loop()
+        with self.clients_lock:
+            if loop not in self.clients:
+                self.clients[loop] = self.make_client(import_openai(self.enable_langfuse))
+            return self.clients[loop]
+
+    @client.setter
+    def client(self, client):
+        self.assigned_client = client
+
+    def make_client(self, openai):
+        return openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base,
+            http_client=self.http_client or shared_async_http_client(),
+            max_retries=0
+        )
 
 
 class OpenAIChatGenerator:
-    def __init__(self, *, model, api_key, api_base, temperature=0.9, top_p=1, max_tokens=512, timeout=30, token_tracker=TokenTracker(), enable_langfuse=False):
-        if enable_langfuse:
-            try:
-                from langfuse.openai import openai
-            except ImportError:
-                raise ImportError("Please install Langfuse and OpenAI python library using pip install langfuse openai")
-        else:
-            try:
-                import openai
-            except ImportError:
-                raise ImportError("Please install OpenAI python library using pip install openai")
-    
+    def __init__(self, *, model, api_key, api_base, temperature=0.9, top_p=1, max_tokens=512, timeout=30, token_tracker=None, stream=False, http_client=None, retry=None, scheduler=None, guided_decoding=None, tools=False, enable_langfuse=False):
+        openai = import_openai(enable_langfuse)
+
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
@@ -22,126 +105,283 @@ class OpenAIChatGenerator:
         self.top_p = top_p
         self.max_tokens = max_tokens
         self.timeout = timeout
-        self.token_tracker = token_tracker
+        # Every generator gets its own tracker unless one is shared explicitly, pass False to disable tracking
+        self.token_tracker = token_tracker if token_tracker is not None else TokenTracker()
+        self.stream = stream
+        self.http_client = http_client
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.scheduler = scheduler
+        self.guided_decoding = guided_decoding
+        self.tools = tools
         self.enable_langfuse = enable_langfuse
 
-        self.client = openai.OpenAI(
-            api_key=self.api_key,
-            base_url=self.api_base
-        )
+        self.init_client(openai)
 
         if self.enable_langfuse:
             self.init_langfuse()
 
+    def init_client(self, openai):
+        self.client = self.make_client(openai)
+
+    def make_client(self, openai):
+        # Retries are handled by self.retry
+        return openai.OpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base,
+            http_client=self.http_client or shared_http_client(),
+            max_retries=0
+        )
+
     def init_langfuse(self):
         try:
             from langfuse.decorators import observe
         except ImportError:
             raise ImportError("Please install langfuse using pip install langfuse")
-        
+
         self.__call__ = observe(name=self.__class__.__name__)(self.__call__)
-    
-    def __call__(self, messages, stop=None):
-        if self.enable_langfuse:
-            from langfuse.openai import openai
-        else:
-            import openai
 
-        oai_error = openai.error.OpenAIError if hasattr(openai, "error") else openai.OpenAIError
+    def build_request(self, messages, stop):
         assert isinstance(messages, list), "messages must be a list of messages https://platform.openai.com/docs/guides/text-generation/chat-completions-api"
+        return with_tools(guided(dict(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+            stop=stop,
+            timeout=self.timeout
+        ), self.guided_decoding), self.tools)
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                top_p=self.top_p,
-                stop=stop,
-                timeout=self.timeout
-            )
-        except oai_error as e:
-            print(colored(f"Error: {e}", "red"))
-            return "Error: timeout"
-
-        output = response.choices[0].message.content.strip()
+    def parse_response(self, response):
+        outputs = [self.parse_message(choice.message) for choice in response.choices]
+
+        if self.token_tracker:
+            self.token_tracker.update_from_usage(response.usage, model=self.model)
+
+        return outputs
 
+    def stream_usage(self, request, detector):
+        # The usage chunk comes last, when the stream is closed early it is estimated from the text
+        usage = detector.usage or estimate_usage(request, detector.output)
         if self.token_tracker:
-            self.token_tracker.update_from_usage(response.usage)
+            self.token_tracker.update_from_usage(usage, model=self.model)
+        return usage
+
+    def parse_message(self, message):
+        grammar = current_grammar.get()
+        if getattr(message, "tool_calls", None) and grammar is not None:
+            return grammar.tool_calls(message.tool_calls)
+        return unguided((message.content or "").strip(), self.guided_decoding)
+
+    def stream_request(self, request):
+        return dict(request, stream=True, extra_body=dict(request.get("extra_body", dict()), stream_options=dict(include_usage=True)))
+
+    def parse_chunk(self, chunk, detector):
+        detector.usage = getattr(chunk, "usage", None) or detector.usage
+        if chunk.choices:
+            return detector.feed(chunk.choices[0].delta.content)
+        return False
+
+    def __call__(self, messages, stop=None):
+        return self.sample(messages, n=1, stop=stop)[0]
+
+    def sample(self, messages, n, stop=None):
+        openai = import_openai(self.enable_langfuse)
+        request = self.build_request(messages, stop)
+        if n > 1:
+            request["n"] = n
+
+        # Tool calls are not streamed as content
+        if self.stream and n == 1 and "tools" not in request:
+            return [self.retry.call(lambda: scheduled(self.scheduler, lambda: self.stream_call(request), request), openai_error(openai), openai_transient_errors(openai)).reply]
+        response = self.retry.call(lambda: scheduled(self.scheduler, lambda: self.client.chat.completions.create(**request), request), openai_error(openai), openai_transient_errors(openai))
+
+        return self.parse_response(response)
+
+    def stream_call(self, request):
+        # Closes the stream as soon as the reply holds a complete function call
+        detector = CallDetector(multi_call=multi_call())
+        response = self.client.chat.completions.create(**self.stream_request(request))
+        try:
+            for chunk in response:
+                if self.parse_chunk(chunk, detector):
+                    break
+        finally:
+            response.close()
+        return StreamedReply(unguided(detector.call.strip(), self.guided_decoding), self.stream_usage(request, detector))
 
-        return output
-    
     def print_usage(self):
         if self.token_tracker:
-            print(f"Usage: prompt={self.token_tracker.prompt_tokens}, completion={self.token_tracker.completion_tokens}, cost=${self.token_tracker.get_total_cost(self.model):.2f}")
+            usage = self.token_tracker.totals(model=self.model)
+            print(f"Usage: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, cached={usage.cached_prompt_tokens}, cost=${self.token_tracker.get_total_cost(self.model):.2f}")
         else:
             print("Token tracker not available")
 
+class AsyncOpenAIChatGenerator(AsyncClient, OpenAIChatGenerator):
+    async def __call__(self, messages, stop=None):
+        return (await self.sample(messages, n=1, stop=stop))[0]
+
+    async def sample(self, messages, n, stop=None):
+        openai = import_openai(self.enable_langfuse)
+        request = self.build_request(messages, stop)
+        if n > 1:
+            request["n"] = n
+
+        if self.stream and n == 1 and "tools" not in request:
+            return [(await self.retry.acall(lambda: ascheduled(self.scheduler, lambda: self.stream_call(request), request), openai_error(openai), openai_transient_errors(openai))).reply]
+        response = await self.retry.acall(lambda: ascheduled(self.scheduler, lambda: self.client.chat.completions.create(**request), request), openai_error(openai), openai_transient_errors(openai))
+
+        return self.parse_response(response)
+
+    async def stream_call(self, request):
+        # Closes the stream as soon as the reply holds a complete function call
+        detector = CallDetector(multi_call=multi_call())
+        response = await self.client.chat.completions.create(**self.stream_request(request))
+        try:
+            async for chunk in response:
+                if self.parse_chunk(chunk, detector):
+                    break
+        finally:
+            await response.close()
+        return StreamedReply(unguided(detector.call.strip(), self.guided_decoding), self.stream_usage(request, detector))
+
 class OpenAITextGenerator:
-    def __init__(self, *, model, api_key, api_base, temperature=0.9, top_p=1, max_tokens=512, enable_langfuse=False):
-        if enable_langfuse:
-            try:
-                from langfuse.openai import openai
-            except ImportError:
-                raise ImportError("Please install Langfuse and OpenAI python library using pip install langfuse openai")
-        else:
-            try:
-                import openai
-            except ImportError:
-                raise ImportError("Please install OpenAI python library using pip install openai")
-    
+    def __init__(self, *, model, api_key, api_base, temperature=0.9, top_p=1, max_tokens=512, token_tracker=None, stream=False, http_client=None, retry=None, scheduler=None, guided_decoding=None, enable_langfuse=False):
+        openai = import_openai(enable_langfuse)
+
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
         self.temperature = temperature
         self.top_p = top_p
         self.max_tokens = max_tokens
+        # Every generator gets its own tracker unless one is shared explicitly, pass False to disable tracking
+        self.token_tracker = token_tracker if token_tracker is not None else TokenTracker()
+        self.stream = stream
+        self.http_client = http_client
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.scheduler = scheduler
+        self.guided_decoding = guided_decoding
         self.enable_langfuse = enable_langfuse
 
-        self.client = openai.OpenAI(
-            api_key=self.api_key,
-            base_url=self.api_base
-        )
+        self.init_client(openai)
 
         if self.enable_langfuse:
             self.init_langfuse()
 
+    def init_client(self, openai):
+        self.client = self.make_client(openai)
+
+    def make_client(self, openai):
+        # Retries are handled by self.retry
+        return openai.OpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base,
+            http_client=self.http_client or shared_http_client(),
+            max_retries=0
+        )
+
     def init_langfuse(self):
         try:
             from langfuse.decorators import observe
         except ImportError:
             raise ImportError("Please install langfuse using pip install langfuse")
-        
-        self.__call__ = observe(name=self.__class__.__name__)(self.__call__)
 
-    def __call__(self, prompt, stop=None):
-        if self.enable_langfuse:
-            from langfuse.openai import openai
-        else:
-            import openai
+        self.__call__ = observe(name=self.__class__.__name__)(self.__call__)
 
-        oai_error = openai.error.OpenAIError if hasattr(openai, "error") else openai.OpenAIError
+    def build_request(self, prompt, stop):
         assert isinstance(prompt, str), "prompt must be a string https://platform.openai.com/docs/guides/text-generation/chat-completions-api"
+        return guided(dict(
+            model=self.model,
+            prompt=prompt,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            top_p=self.top_p,
+            stop=stop
+        ), self.guided_decoding)
 
-        try:
-            response = self.client.completions.create(
-                model=self.model,
-                prompt=prompt,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                top_p=self.top_p,
-                stop=stop
-            )
-        except oai_error as e:
-            print(colored(f"Error: {e}", "red"))
-            return "Error: timeout"
-
-        if "choices" in response:  # vllm
-            output = response.choices[0].text.strip()
-        elif "content" in response: # llama.cpp
-            output = response.content.strip()
+    def parse_response(self, response, request):
+        if getattr(response, "choices", None):  # vllm
+            outputs = [unguided(choice.text.strip(), self.guided_decoding) for choice in response.choices]
+        elif getattr(response, "content", None) is not None: # llama.cpp
+            outputs = [unguided(response.content.strip(), self.guided_decoding)]
         else:
             raise Exception("Unknown output format")
-        
-        return output
-    
+
+        if self.token_tracker:
+            # Servers that do not report the usage get an estimate from the text
+            usage = getattr(response, "usage", None) or estimate_usage(request, "".join(outputs))
+            self.token_tracker.update_from_usage(usage, model=self.model)
+
+        return outputs
+
+    def stream_request(self, request):
+        return dict(request, stream=True, extra_body=dict(request.get("extra_body", dict()), stream_options=dict(include_usage=True)))
+
+    def stream_usage(self, request, detector):
+        # The usage chunk comes last, when the stream is closed early it is estimated from the text
+        usage = detector.usage or estimate_usage(request, detector.output)
+        if self.token_tracker:
+            self.token_tracker.update_from_usage(usage, model=self.model)
+        return usage
+
+    def parse_chunk(self, chunk, detector):
+        detector.usage = getattr(chunk, "usage", None) or detector.usage
+        if getattr(chunk, "choices", None):
+            return detector.feed(chunk.choices[0].text)
+        return detector.feed(getattr(chunk, "content", None))
+
+    def __call__(self, prompt, stop=None):
+        return self.sample(prompt, n=1, stop=stop)[0]
+
+    def sample(self, prompt, n, stop=None):
+        openai = import_openai(self.enable_langfuse)
+        request = self.build_request(prompt, stop)
+        if n > 1:
+            request["n"] = n
+
+        if self.stream and n == 1:
+            return [self.retry.call(lambda: scheduled(self.scheduler, lambda: self.stream_call(request), request), openai_error(openai), openai_transient_errors(openai)).reply]
+        response = self.retry.call(lambda: scheduled(self.scheduler, lambda: self.client.completions.create(**request), request), openai_error(openai), openai_transient_errors(openai))
+
+        return self.parse_response(response, request)
+
+    def stream_call(self, request):
+        # Closes the stream as soon as the reply holds a complete function call
+        detector = CallDetector(multi_call=multi_call())
+        response = self.client.completions.create(**self.stream_request(request))
+        try:
+            for chunk in response:
+                if self.parse_chunk(chunk, detector):
+                    break
+        finally:
+            response.close()
+        return StreamedReply(unguided(detector.call.strip(), self.guided_decoding), self.stream_usage(request, detector))
+
+class AsyncOpenAITextGenerator(AsyncClient, OpenAITextGenerator):
+    async def __call__(self, prompt, stop=None):
+        return (await self.sample(prompt, n=1, stop=stop))[0]
+
+    async def sample(self, prompt, n, stop=None):
+        openai = import_openai(self.enable_langfuse)
+        request = self.build_request(prompt, stop)
+        if n > 1:
+            request["n"] = n
+
+        if self.stream and n == 1:
+            return [(await self.retry.acall(lambda: ascheduled(self.scheduler, lambda: self.stream_call(request), request), openai_error(openai), openai_transient_errors(openai))).reply]
+        response = await self.retry.acall(lambda: ascheduled(self.scheduler, lambda: self.client.completions.create(**request), request), openai_error(openai), openai_transient_errors(openai))
+
+        return self.parse_response(response, request)
+
+    async def stream_call(self, request):
+        # Closes the stream as soon as the reply holds a complete function call
+        detector = CallDetector(multi_call=multi_call())
+        response = await self.client.completions.create(**self.stream_request(request))
+        try:
+            async for chunk in response:
+                if self.parse_chunk(chunk, detector):
+                    break
+        finally:
+            await response.close()
+        return StreamedReply(unguided(detector.call.strip(), self.guided_decoding), self.stream_usage(request, detector))
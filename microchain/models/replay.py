@@ -0,0 +1,86 @@
+import hashlib
+import json
+import threading
+from collections import defaultdict, deque
+
+
+def request_key(prompt, stop):
+    return hashlib.sha256(json.dumps(dict(prompt=prompt, stop=stop), sort_keys=True, default=str).encode()).hexdigest()
+
+class RecordingGenerator:
+    # Wraps a generator and appends every request and reply to a JSONL file that ReplayGenerator can play back
+    def __init__(self, generator, path):
+        self.generator = generator
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == "generator":
+            raise AttributeError(name)
+        if name == "sample" and hasattr(self.generator, "sample"):
+            return self.record_sample
+        return getattr(self.generator, name)
+
+    def record(self, prompt, stop, output):
+        line = json.dumps(dict(key=request_key(prompt, stop), prompt=prompt, stop=stop, output=output))
+        with self.lock, open(self.path, "a") as file:
+            file.write(line + "\n")
+
+    def __call__(self, prompt, stop=None):
+        output = self.generator(prompt, stop=stop)
+        self.record(prompt, stop, output)
+        return output
+
+    def record_sample(self, prompt, n, stop=None):
+        # Native sampling of n replies is recorded as n calls with the same request
+        outputs = self.generator.sample(prompt, n=n, stop=stop)
+        for output in outputs:
+            self.record(prompt, stop, output)
+        return outputs
+
+class AsyncRecordingGenerator(RecordingGenerator):
+    async def __call__(self, prompt, stop=None):
+        output = await self.generator(prompt, stop=stop)
+        self.record(prompt, stop, output)
+        return output
+
+    async def record_sample(self, prompt, n, stop=None):
+        outputs = await self.generator.sample(prompt, n=n, stop=stop)
+        for output in outputs:
+            self.record(prompt, stop, output)
+        return outputs
+
+class ReplayGenerator:
+    # Plays back a recorded session. Replies are matched on (prompt, stop), in recording order for repeated requests.
+    # With sequential=True replies are returned in recording order regardless of the request
+    def __init__(self, path, sequential=False, loop=False):
+        self.path = path
+        self.sequential = sequential
+        self.loop = loop
+        self.lock = threading.Lock()
+        with open(path) as file:
+            self.records = [json.loads(line) for line in file if line.strip()]
+        self.rewind()
+
+    def rewind(self):
+        self.queue = deque(record["output"] for record in self.records)
+        self.replies = defaultdict(deque)
+        for record in self.records:
+            self.replies[record["key"]].append(record["output"])
+
+    def next_reply(self, prompt, stop):
+        with self.lock:
+            queue = self.queue if self.sequential else self.replies.get(request_key(prompt, stop))
+            if not queue and self.loop:
+                self.rewind()
+                queue = self.queue if self.sequential else self.replies.get(request_key(prompt, stop))
+            if not queue:
+                raise KeyError("No recorded reply for this request")
+            return queue.popleft()
+
+    def __call__(self, prompt, stop=None):
+        return self.next_reply(prompt, stop)
+
+class AsyncReplayGenerator(ReplayGenerator):
+    async def __call__(self, prompt, stop=None):
+        return self.next_reply(prompt, stop)
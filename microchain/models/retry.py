@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import email.utils
+import random
+import time
+
+
+class GeneratorError(Exception):
+    # The generator could not produce a reply, as opposed to the model producing a bad one
+    def __init__(self, message, retries=0):
+        super().__init__(message)
+        self.retries = retries
+
+def status_code(error):
+    for value in [getattr(error, "status_code", None), getattr(error, "status", None), getattr(getattr(error, "response", None), "status_code", None)]:
+        if isinstance(value, int):
+            return value
+    return None
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # Malformed dates fall back to the exponential backoff
+        return None
+    if date.tzinfo is None:
+        # HTTP dates are in UTC, "-0000" is parsed as a naive datetime
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp() - time.time()
+
+class RetryPolicy:
+    # Retries transient failures (timeouts, connection errors, 408/409/429/5xx) with jittered exponential
+    # backoff, waiting for the Retry-After header when the server sends one
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=30):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_transient(self, error, transient_errors):
+        status = status_code(error)
+        if status is not None:
+            return status in [408, 409, 429] or status >= 500
+        return isinstance(error, transient_errors)
+
+    def delay(self, attempt, error):
+        server_delay = retry_after(error)
+        if server_delay is not None and 0 <= server_delay <= self.max_delay:
+            return server_delay
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def give_up(self, attempt, error, transient_errors):
+        return attempt >= self.max_retries or not self.is_transient(error, transient_errors)
+
+    def call(self, function, errors, transient_errors=()):
+        attempt = 0
+        while True:
+            try:
+                return function()
+            except errors as e:
+                if self.give_up(attempt, e, transient_errors):
+                    raise GeneratorError(f"{type(e).__name__}: {e}", retries=attempt) from e
+                time.sleep(self.delay(attempt, e))
+                attempt += 1
+
+    async def acall(self, function, errors, transient_errors=()):
+        attempt = 0
+        while True:
+            try:
+                return await function()
+            except errors as e:
+                if self.give_up(attempt, e, transient_errors):
+                    raise GeneratorError(f"{type(e).__name__}: {e}", retries=attempt) from e
+                await asyncio.sleep(self.delay(attempt, e))
+                attempt += 1
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+from microchain.engine.context import estimate_tokens
+from microchain.models.current import current_agent
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        # Requests larger than the bucket only wait for it to be full
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return 0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        # Corrects a reservation with the actual usage, the level can go negative
+        self.level = min(self.capacity, self.level - amount)
+
+class Ticket:
+    def __init__(self, agent, tokens, wake):
+        self.agent = agent
+        self.tokens = tokens
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+@dataclass
+class SchedulerStats:
+    requests: int
+    queue_depth: int
+    in_flight: int
+    mean_wait: float
+    p99_wait: float
+    max_wait: float
+
+    def __str__(self):
+        return f"requests={self.requests} queue_depth={self.queue_depth} in_flight={self.in_flight} wait mean={1000 * self.mean_wait:.1f}ms p99={1000 * self.p99_wait:.1f}ms max={1000 * self.max_wait:.1f}ms"
+
+class RequestScheduler:
+    # Shared by the generators that call the same API key or endpoint. Enforces requests/min and tokens/min
+    # with token buckets and caps the requests in flight, serving the waiting agents round robin
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_in_flight=None, count_tokens=estimate_tokens, wait_history=10000):
+        self.requests_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_in_flight = max_in_flight
+        self.count_tokens = count_tokens
+        self.lock = threading.Lock()
+        self.queues = OrderedDict()
+        self.in_flight = 0
+        self.timer = None
+        self.requests = 0
+        self.waits = deque(maxlen=wait_history)
+
+    def estimate(self, request):
+        # Tokens of an OpenAI style request: the prompt plus the completion budget of every choice
+        if "messages" in request:
+            prompt_tokens = sum(self.count_tokens(message["content"] or "") for message in request["messages"])
+        else:
+            prompt_tokens = self.count_tokens(request.get("prompt", ""))
+        return prompt_tokens + (request.get("max_tokens") or 0) * (request.get("n") or 1)
+
+    @property
+    def queue_depth(self):
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    @property
+    def stats(self):
+        with self.lock:
+            waits = sorted(self.waits)
+            return SchedulerStats(
+                requests=self.requests,
+                queue_depth=sum(len(queue) for queue in self.queues.values()),
+                in_flight=self.in_flight,
+                mean_wait=sum(waits) / len(waits) if len(waits) > 0 else 0,
+                p99_wait=waits[min(int(0.99 * len(waits)), len(waits) - 1)] if len(waits) > 0 else 0,
+                max_wait=waits[-1] if len(waits) > 0 else 0,
+            )
+
+    def enqueue(self, ticket):
+        with self.lock:
+            self.queues.setdefault(ticket.agent, deque()).append(ticket)
+        self.dispatch()
+
+    def dispatch(self):
+        granted = []
+        with self.lock:
+            now = time.monotonic()
+            while len(self.queues) > 0:
+                if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+                    break
+                agent, queue = next(iter(self.queues.items()))
+                ticket = queue[0]
+                wait = max(
+                    self.requests_bucket.wait_time(1, now) if self.requests_bucket else 0,
+                    self.tokens_bucket.wait_time(ticket.tokens, now) if self.tokens_bucket else 0,
+                )
+                if wait > 0:
+                    if self.timer is None:
+                        self.timer = threading.Timer(wait, self.on_timer)
+                        self.timer.daemon = True
+                        self.timer.start()
+                    break
+
+                if self.requests_bucket:
+                    self.requests_bucket.consume(1)
+                if self.tokens_bucket:
+                    self.tokens_bucket.consume(ticket.tokens)
+                queue.popleft()
+                # The agent goes to the back of the line
+                del self.queues[agent]
+                if len(queue) > 0:
+                    self.queues[agent] = queue
+                ticket.granted = True
+                self.in_flight += 1
+                self.requests += 1
+                self.waits.append(now - ticket.enqueued)
+                granted.append(ticket)
+        for ticket in granted:
+            ticket.wake()
+
+    def on_timer(self):
+        with self.lock:
+            self.timer = None
+        self.dispatch()
+
+    def acquire(self, tokens):
+        event = threading.Event()
+        ticket = Ticket(current_agent.get(), tokens, event.set)
+        self.enqueue(ticket)
+        event.wait()
+        return ticket
+
+    async def aacquire(self, tokens):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        ticket = Ticket(current_agent.get(), tokens, wake)
+        self.enqueue(ticket)
+        try:
+            await future
+        except asyncio.CancelledError:
+            self.cancel(ticket)
+            raise
+        return ticket
+
+    def cancel(self, ticket):
+        with self.lock:
+            queue = self.queues.get(ticket.agent)
+            if not ticket.granted and queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if len(queue) == 0:
+                    del self.queues[ticket.agent]
+                return
+        if ticket.granted:
+            self.release(ticket)
+
+    def release(self, ticket, tokens=None):
+        # tokens is the actual usage reported by the API, if known
+        with self.lock:
+            self.in_flight -= 1
+            if tokens is not None and self.tokens_bucket:
+                self.tokens_bucket.adjust(tokens - ticket.tokens)
+        self.dispatch()
+
+    def call(self, function, request):
+        ticket = self.acquire(self.estimate(request))
+        response = None
+        try:
+            response = function()
+            return response
+        finally:
+            self.release(ticket, used_tokens(response))
+
+    async def acall(self, function, request):
+        ticket = await self.aacquire(self.estimate(request))
+        response = None
+        try:
+            response = await function()
+            return response
+        finally:
+            self.release(ticket, used_tokens(response))
+
+def used_tokens(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return getattr(usage, "total_tokens", None) or (usage.prompt_tokens + usage.completion_tokens)
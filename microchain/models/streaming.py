@@ -0,0 +1,83 @@
+import ast
+from dataclasses import dataclass
+
+from microchain.engine.context import estimate_tokens
+from microchain.models.token_tracker import TokenUsage
+
+
+def parse_expression(text):
+    try:
+        tree = ast.parse(text.replace("\\_", "_").strip())
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Expr):
+        return None
+    return tree.body[0].value
+
+def is_call(text):
+    return isinstance(parse_expression(text), ast.Call)
+
+def is_call_list(text):
+    expression = parse_expression(text)
+    return isinstance(expression, ast.List) and all(isinstance(element, ast.Call) for element in expression.elts)
+
+@dataclass
+class StreamedReply:
+    # What a streamed request returns to the scheduler and the retry policy, with the usage reported or estimated
+    reply: str
+    usage: TokenUsage
+
+def estimate_usage(request, output):
+    # Streams closed early never receive the usage chunk sent at the end
+    if "messages" in request:
+        prompt = "".join(message["content"] or "" for message in request["messages"])
+    else:
+        prompt = request.get("prompt", "")
+    return TokenUsage(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(output), requests=1)
+
+class CallDetector:
+    # Scans a streamed reply incrementally and detects when it holds a complete, balanced function call.
+    # With multi_call it waits for the closing ] of a list of calls, replies with a call per line are read to the end
+    def __init__(self, multi_call=False):
+        self.multi_call = multi_call
+        self.output = ""
+        self.end = -1
+        self.depth = 0
+        self.quote = None
+        self.escape = False
+        self.scanned = 0
+        self.usage = None
+
+    @property
+    def complete(self):
+        return self.end != -1
+
+    @property
+    def call(self):
+        return self.output[:self.end] if self.complete else self.output
+
+    def feed(self, text):
+        self.output += text or ""
+        while not self.complete and self.scanned < len(self.output):
+            self.scan(self.scanned, self.output[self.scanned])
+            self.scanned += 1
+        return self.complete
+
+    def scan(self, i, char):
+        if self.quote is not None:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == self.quote:
+                self.quote = None
+        elif char in "'\"":
+            self.quote = char
+        elif char in "([{":
+            self.depth += 1
+        elif char in ")]}":
+            self.depth = max(self.depth - 1, 0)
+            if self.depth == 0 and char == ")" and not self.multi_call and is_call(self.output[:i+1]):
+                self.end = i + 1
+            elif self.depth == 0 and char == "]" and self.multi_call and is_call_list(self.output[:i+1]):
+                self.end = i + 1
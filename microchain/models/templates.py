@@ -1,39 +1,145 @@
+def message_keys(messages):
+    return [(message["role"], message["content"]) for message in messages]
+
+class RenderCache:
+    # Remembers the rendering of the last histories so that appending messages only renders the new ones
+    def __init__(self, size=16):
+        self.size = size
+        self.entries = []
+
+    def lookup(self, keys):
+        # Returns how many leading messages of keys are already rendered, their rendering and its segments
+        cached, rendered, segments = 0, None, None
+        for entry_keys, entry_rendered, entry_segments in self.entries:
+            if cached < len(entry_keys) <= len(keys) and keys[:len(entry_keys)] == entry_keys:
+                cached, rendered, segments = len(entry_keys), entry_rendered, entry_segments
+        return cached, rendered, segments
+
+    def store(self, keys, rendered, segments=None):
+        # An entry that is a prefix of the new history is superseded by it
+        self.entries = [entry for entry in self.entries if not (len(entry[0]) <= len(keys) and keys[:len(entry[0])] == entry[0])]
+        self.entries.append((keys, rendered, segments))
+        if len(self.entries) > self.size:
+            self.entries.pop(0)
+
+class ChatTemplateRenderer:
+    # Renders a history with tokenizer.apply_chat_template, rendering only the appended messages when possible.
+    # The suffix of the new messages is obtained rendering them after the last cached message, this is checked
+    # once against a full render and templates that are not message-local always fall back to full renders.
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.cache = RenderCache()
+        self.incremental = None
+        self.generation_prompt = None
+
+    def apply(self, messages, add_generation_prompt):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+
+    def render_suffix(self, anchor, messages):
+        try:
+            base = self.apply([anchor], False)
+            extended = self.apply([anchor] + messages, False)
+        except Exception:
+            return None
+        if not extended.startswith(base):
+            return None
+        return extended[len(base):]
+
+    def render_full(self, messages):
+        rendered = self.apply(messages, False)
+        if self.generation_prompt is None:
+            with_generation_prompt = self.apply(messages, True)
+            if with_generation_prompt.startswith(rendered):
+                self.generation_prompt = with_generation_prompt[len(rendered):]
+        return rendered
+
+    def render_incremental(self, messages, cached, rendered):
+        suffix = self.render_suffix(messages[cached-1], messages[cached:])
+        if suffix is None:
+            self.incremental = False
+            return None
+        rendered = rendered + suffix
+        if self.incremental is None:
+            self.incremental = rendered == self.apply(messages, False)
+            if not self.incremental:
+                return None
+        return suffix
+
+    def render(self, messages):
+        # Returns the rendering without generation prompt and the segments it is made of,
+        # the first segment is a full render and every other one the suffix of appended messages
+        if self.incremental is False:
+            rendered = self.apply(messages, False)
+            return rendered, (rendered, )
+
+        keys = message_keys(messages)
+        cached, rendered, segments = self.cache.lookup(keys)
+        if rendered is not None and cached < len(messages):
+            suffix = self.render_incremental(messages, cached, rendered)
+            if suffix is not None:
+                rendered, segments = rendered + suffix, segments + (suffix, )
+            else:
+                rendered = None
+        if rendered is None:
+            rendered = self.render_full(messages)
+            segments = (rendered, )
+        self.cache.store(keys, rendered, segments)
+        return rendered, segments
+
+    def __call__(self, messages, add_generation_prompt=True):
+        if self.incremental is False:
+            return self.apply(messages, add_generation_prompt)
+
+        rendered, _ = self.render(messages)
+        if not add_generation_prompt:
+            return rendered
+        if self.generation_prompt is None:
+            return self.apply(messages, True)
+        return rendered + self.generation_prompt
+
 class HFChatTemplate:
     def __init__(self, template):
         try:
             import transformers
         except ImportError:
             raise ImportError("Please install transformers python library using pip install transformers")
-        
+
         try:
             import jinja2
         except ImportError:
             raise ImportError("Please install jinja2 python library using pip install jinja2")
 
         self.tokenizer = transformers.AutoTokenizer.from_pretrained(template)
+        self.renderer = ChatTemplateRenderer(self.tokenizer)
 
     def __call__(self, prompt):
-        return self.tokenizer.apply_chat_template(prompt, tokenize=False, add_generation_prompt=True)
+        return self.renderer(prompt, add_generation_prompt=True)
 
 class VicunaTemplate:
     def __init__(self, user="User", assistant="Assistant", system_prompt=None):
         self.user = user
         self.assistant = assistant
         self.system_prompt = system_prompt
-    
+        self.cache = RenderCache()
+
+    def render_message(self, message):
+        if message["role"] == "user":
+            return f"{self.user}: {message['content']}\n"
+        elif message["role"] == "assistant":
+            return f"{self.assistant}: {message['content']}\n"
+        else:
+            raise ValueError(f"Unknown role {message['role']}")
+
     def __call__(self, prompt):
-        ret = f"{self.system_prompt}\n\n" if self.system_prompt else f""
-        for message in prompt:
-            if message["role"] == "user":
-                ret += f"{self.user}: {message['content']}\n"
-            elif message["role"] == "assistant":
-                ret += f"{self.assistant}: {message['content']}\n"
-            else:
-                raise ValueError(f"Unknown role {message['role']}")
-        
+        keys = [(self.system_prompt, self.user, self.assistant)] + message_keys(prompt)
+        cached, rendered, _ = self.cache.lookup(keys)
+        if rendered is None:
+            rendered = f"{self.system_prompt}\n\n" if self.system_prompt else f""
+
+        rendered = rendered + "".join([self.render_message(message) for message in prompt[max(cached - 1, 0):]])
+        self.cache.store(keys, rendered)
+
         if prompt[-1]["role"] == "user":
-            ret += f"{self.assistant}:"
+            return rendered + f"{self.assistant}:"
         else:
             raise ValueError(f"Last message should be from user")
-        
-        return ret
\ No newline at end of file
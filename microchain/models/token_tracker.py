@@ -1,31 +1,132 @@
+import json
+import threading
+from dataclasses import dataclass
+
+from microchain.models.current import current_agent, current_step
+
+
+# USD per token. From https://openai.com/pricing and https://replicate.com/pricing
+PRICING = {
+    "gpt-4o": {"prompt": 5e-6, "completion": 1.5e-05},
+    "gpt-4o-2024-05-13": {"prompt": 5e-6, "completion": 1.5e-05},
+    "gpt-4o-2024-08-06": {"prompt": 2.5e-06, "completion": 1e-05, "cached_prompt": 1.25e-06},
+    "gpt-4o-mini": {"prompt": 1.5e-07, "completion": 6e-07, "cached_prompt": 7.5e-08},
+    "gpt-4-turbo": {"prompt": 1e-05, "completion": 3e-05},
+    "gpt-4-0125-preview": {"prompt": 1e-05, "completion": 3e-05},
+    "gpt-4-1106-preview": {"prompt": 1e-05, "completion": 3e-05},
+    "gpt-4-turbo-preview": {"prompt": 1e-05, "completion": 3e-05},
+    "gpt-3.5-turbo-0125": {"prompt": 5e-07, "completion": 1.5e-06},
+    "meta/meta-llama-3.1-405b-instruct": {"prompt": 9.5e-06, "completion": 9.5e-06},
+}
+
+def load_pricing(path):
+    # JSON object of model -> {"prompt": ..., "completion": ..., "cached_prompt": ...} in USD per token
+    with open(path) as file:
+        return json.load(file)
+
+def cached_tokens(usage):
+    # OpenAI reports the prompt tokens served from its prompt cache in prompt_tokens_details
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+@dataclass
+class TokenUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    requests: int = 0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other):
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_prompt_tokens += other.cached_prompt_tokens
+        self.requests += other.requests
+
 class TokenTracker:
-    def __init__(self):
-        self.prompt_tokens = 0
-        self.completion_tokens = 0
-
-    def update_from_usage(self, usage):
-        self.prompt_tokens += usage.prompt_tokens
-        self.completion_tokens += usage.completion_tokens
-
-    def get_total_cost(self, model):
-        # From https://openai.com/pricing
-        if model in ["gpt-4o", "gpt-4o-2024-05-13"]:
-            costs = {"prompt": 5e-6, "completion": 1.5e-05}
-        elif model == "gpt-4o-2024-08-06":
-            costs = {"prompt": 2.5e-06, "completion": 1e-05}
-        elif model == "gpt-4-turbo":
-            costs = {"prompt": 1e-05, "completion": 3e-05}
-        elif model in ["gpt-4-0125-preview", "gpt-4-1106-preview", "gpt-4-turbo-preview"]:
-            costs = {"prompt": 1e-05, "completion": 3e-05}
-        elif model == "gpt-3.5-turbo-0125":
-            costs = {"prompt": 5e-07, "completion": 1.5e-06}
-        # Took from https://replicate.com/pricing
-        elif model == "meta/meta-llama-3.1-405b-instruct":
-            costs = {"prompt": 9.5e-06, "completion": 9.5e-06}
-        # Fail gracefully
-        else:
-            print(f"Unsupported {model}")
+    # Thread-safe usage counters broken down by agent, step and model. The agent and the step
+    # are the ones running when the usage is reported. max_cost and max_tokens stop every agent using the tracker
+    def __init__(self, pricing=None, max_cost=None, max_tokens=None):
+        self.pricing = dict(PRICING, **(pricing or dict()))
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.total = TokenUsage()
+        self.breakdown = dict()
+        self.agent_models = dict()
+
+    @property
+    def prompt_tokens(self):
+        return self.total.prompt_tokens
+
+    @property
+    def completion_tokens(self):
+        return self.total.completion_tokens
+
+    @property
+    def cached_prompt_tokens(self):
+        return self.total.cached_prompt_tokens
+
+    def update_from_usage(self, usage, model=None):
+        update = TokenUsage(usage.prompt_tokens, usage.completion_tokens, cached_tokens(usage), 1)
+        agent = current_agent.get()
+        with self.lock:
+            self.total.add(update)
+            self.breakdown.setdefault((agent, current_step.get(), model), TokenUsage()).add(update)
+            self.agent_models.setdefault((agent, model), TokenUsage()).add(update)
+
+    def entries(self, agent=None, step=None, model=None):
+        # Usage entries of the agent/step/model (None matches all), entries without a model match every model
+        with self.lock:
+            if step is None:
+                items = [((entry_agent, None, entry_model), usage) for (entry_agent, entry_model), usage in self.agent_models.items()]
+            else:
+                items = list(self.breakdown.items())
+            return [
+                (key, TokenUsage(**vars(usage))) for key, usage in items
+                if (agent is None or key[0] == agent) and (step is None or key[1] == step) and (model is None or key[2] in [model, None])
+            ]
+
+    def totals(self, agent=None, step=None, model=None):
+        if agent is None and step is None and model is None:
+            with self.lock:
+                return TokenUsage(**vars(self.total))
+        total = TokenUsage()
+        for _, usage in self.entries(agent, step, model):
+            total.add(usage)
+        return total
+
+    def priced(self, model):
+        return model in self.pricing
+
+    def unpriced(self, agent=None):
+        # Models with usage but without a price, their cost counts as 0
+        return sorted({key[2] for key, _ in self.entries(agent) if not self.priced(key[2])}, key=str)
+
+    def cost(self, usage, model):
+        costs = self.pricing.get(model)
+        if costs is None:
             return 0
+        cached = min(usage.cached_prompt_tokens, usage.prompt_tokens)
+        return (usage.prompt_tokens - cached) * costs["prompt"] + cached * costs.get("cached_prompt", costs["prompt"]) + usage.completion_tokens * costs["completion"]
 
-        return self.prompt_tokens * costs["prompt"] + self.completion_tokens * costs["completion"]
+    def get_total_cost(self, model=None, agent=None, step=None):
+        # Usage reported without a model is priced as `model`
+        return sum(self.cost(usage, key[2] or model) for key, usage in self.entries(agent, step, model))
 
+    def exceeded(self, max_cost=None, max_tokens=None, agent=None):
+        # Checks the tracker budget and, if given, a budget for a single agent
+        for budget_cost, budget_tokens, budget_agent in [(self.max_cost, self.max_tokens, None), (max_cost, max_tokens, agent)]:
+            if budget_tokens is not None and self.totals(agent=budget_agent).total_tokens >= budget_tokens:
+                return True
+            if budget_cost is not None and len(self.unpriced(budget_agent)) > 0:
+                # A cost budget would never trip
+                raise ValueError(f"No price for the models {self.unpriced(budget_agent)}, pass pricing= to the TokenTracker to use max_cost")
+            if budget_cost is not None and self.get_total_cost(agent=budget_agent) >= budget_cost:
+                return True
+        return False
@@ -20,6 +20,15 @@ class LLM:
         def __call__(self, prompt, stop=None):
             return ""
     
+class CandidatesLLM:
+        def __init__(self, candidates):
+            self.candidates = list(candidates)
+            self.calls = []
+
+        def sample(self, prompt, n, stop=None):
+            self.calls.append(prompt)
+            return self.candidates.pop(0)
+
 class TestAgent(unittest.TestCase):
     
     def test_prompt_not_present(self):
@@ -83,6 +92,61 @@ class TestAgent(unittest.TestCase):
 
         assert "Tried -1 times (agent.max_tries) Aborting" in out.getvalue()
     
+    def test_candidates_first_valid(self):
+        engine = Engine()
+        engine.register(Sum())
+        engine.help_called = True
+        llm = CandidatesLLM([["Sum(2)", "Sum(a=2, b=3)", "Sum(1, 1)"]])
+        agent = Agent(llm=llm, engine=engine, candidates=3)
+        agent.prompt = "Compute"
+
+        out, err = io.StringIO(), io.StringIO()
+        with patch.multiple(sys, stdout=out, stderr=err):
+            agent.build_initial_messages()
+            step_output = agent.step()
+
+        self.assertEqual(step_output.reply, "Sum(a=2, b=3)")
+        self.assertEqual(step_output.output, "5")
+        self.assertEqual(len(llm.calls), 1)
+
+    def test_candidates_all_invalid(self):
+        engine = Engine()
+        engine.register(Sum())
+        engine.help_called = True
+        llm = CandidatesLLM([["", "Sum(2)", "Sum(1, 2, 3)"], ["Sum(1, 1)", "Sum(1)"]])
+        agent = Agent(llm=llm, engine=engine, candidates=2)
+        agent.prompt = "Compute"
+
+        out, err = io.StringIO(), io.StringIO()
+        with patch.multiple(sys, stdout=out, stderr=err):
+            agent.build_initial_messages()
+            step_output = agent.step()
+
+        self.assertEqual(step_output.output, "2")
+        self.assertEqual(len(llm.calls), 2)
+        # Only the error of the first failing candidate is fed back to the model
+        self.assertEqual(llm.calls[1][-2], dict(role="assistant", content="Sum(2)"))
+        self.assertEqual(len(llm.calls[1]), len(llm.calls[0]) + 2)
+
+    def test_candidates_without_sample(self):
+        engine = Engine()
+        engine.register(Sum())
+        engine.help_called = True
+
+        class ScriptedLLM:
+            def __call__(self, prompt, stop=None):
+                return "Sum(1, 2)"
+
+        agent = Agent(llm=ScriptedLLM(), engine=engine, candidates=4)
+        agent.prompt = "Compute"
+
+        out, err = io.StringIO(), io.StringIO()
+        with patch.multiple(sys, stdout=out, stderr=err):
+            agent.build_initial_messages()
+            step_output = agent.step()
+
+        self.assertEqual(step_output.output, "3")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
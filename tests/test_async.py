@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from microchain import Engine, Function, Agent, LLM, FunctionResult
+from unittest.mock import patch
+import io
+import sys
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class ScriptedGenerator:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def __call__(self, prompt, stop=None):
+        return self.replies.pop(0)
+
+class AsyncScriptedGenerator(ScriptedGenerator):
+    async def __call__(self, prompt, stop=None):
+        await asyncio.sleep(0.01)
+        return self.replies.pop(0)
+
+def make_agent(generator):
+    engine = Engine()
+    engine.register(Sum())
+    engine.help_called = True
+    agent = Agent(llm=LLM(generator=generator), engine=engine)
+    agent.prompt = "Compute the sums"
+    return agent
+
+class TestAsyncAgent(unittest.TestCase):
+
+    def test_astep_async_generator(self):
+        agent = make_agent(AsyncScriptedGenerator(["Sum(1, 2)"]))
+        agent.build_initial_messages()
+        with patch.multiple(sys, stdout=io.StringIO()):
+            step_output = asyncio.run(agent.astep())
+
+        self.assertEqual(step_output.result, FunctionResult.SUCCESS)
+        self.assertEqual(step_output.output, "3")
+
+    def test_astep_sync_generator(self):
+        agent = make_agent(ScriptedGenerator(["Sum(a=2,", "Sum(2, 2)"]))
+        agent.build_initial_messages()
+        with patch.multiple(sys, stdout=io.StringIO()):
+            step_output = asyncio.run(agent.astep())
+
+        self.assertEqual(step_output.output, "4")
+
+    def test_sync_call_with_async_generator(self):
+        llm = LLM(generator=AsyncScriptedGenerator(["Sum(1, 2)"]))
+        self.assertRaises(TypeError, llm, [])
+
+    def test_arun_concurrent(self):
+        agents = [make_agent(AsyncScriptedGenerator([f"Sum({i}, 1)"] * 3)) for i in range(20)]
+
+        async def run_all():
+            await asyncio.gather(*[agent.arun(iterations=3) for agent in agents])
+
+        with patch.multiple(sys, stdout=io.StringIO()):
+            asyncio.run(run_all())
+
+        for i, agent in enumerate(agents):
+            self.assertEqual(len(agent.history), 1 + 2*3)
+            self.assertEqual(agent.history[-1]["content"], str(i + 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from microchain import CachedGenerator, AsyncCachedGenerator, LLM
+
+class CountingGenerator:
+    def __init__(self, temperature=0):
+        self.model = "model"
+        self.temperature = temperature
+        self.calls = 0
+
+    def __call__(self, prompt, stop=None):
+        self.calls += 1
+        return f"Reply({self.calls})"
+
+class AsyncCountingGenerator(CountingGenerator):
+    async def __call__(self, prompt, stop=None):
+        self.calls += 1
+        return f"Reply({self.calls})"
+
+MESSAGES = [dict(role="user", content="Hello")]
+
+class TestCachedGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_deterministic_hit(self):
+        generator = CountingGenerator()
+        cached = CachedGenerator(generator, path=self.path)
+        llm = LLM(generator=cached)
+        self.assertEqual(llm(MESSAGES, stop=["\n"]), "Reply(1)")
+        self.assertEqual(llm(MESSAGES, stop=["\n"]), "Reply(1)")
+        self.assertEqual(llm(MESSAGES), "Reply(2)")
+        self.assertEqual((cached.hits, cached.misses), (1, 2))
+        self.assertEqual(cached.model, "model")
+
+    def test_persistent(self):
+        CachedGenerator(CountingGenerator(), path=self.path)(MESSAGES)
+        generator = CountingGenerator()
+        self.assertEqual(CachedGenerator(generator, path=self.path)(MESSAGES), "Reply(1)")
+        self.assertEqual(generator.calls, 0)
+
+    def test_sampling_not_cached(self):
+        generator = CountingGenerator(temperature=0.7)
+        cached = CachedGenerator(generator, path=self.path)
+        cached(MESSAGES)
+        cached(MESSAGES)
+        self.assertEqual(generator.calls, 2)
+
+        cached = CachedGenerator(generator, path=self.path, cache_sampling=True)
+        self.assertEqual(cached(MESSAGES), cached(MESSAGES))
+
+    def test_read_only(self):
+        cached = CachedGenerator(CountingGenerator(), path=self.path, read_only=True)
+        cached(MESSAGES)
+        self.assertEqual(len(cached), 0)
+
+    def test_eviction(self):
+        cached = CachedGenerator(CountingGenerator(), path=self.path, max_entries=3, evict_every=1)
+        for i in range(10):
+            cached([dict(role="user", content=str(i))])
+        self.assertEqual(len(cached), 3)
+
+        cached = CachedGenerator(CountingGenerator(), path=self.path, max_age=-1)
+        self.assertEqual(cached([dict(role="user", content="9")]), "Reply(1)")
+
+    def test_async(self):
+        generator = AsyncCountingGenerator()
+        llm = LLM(generator=AsyncCachedGenerator(generator, path=self.path))
+        replies = [asyncio.run(llm.acall(MESSAGES)) for _ in range(3)]
+        self.assertEqual(replies, ["Reply(1)"] * 3)
+        self.assertEqual(generator.calls, 1)
+
+if __name__ == '__main__':
+    unittest.main()
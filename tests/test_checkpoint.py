@@ -0,0 +1,119 @@
+import unittest
+from microchain import Engine, Function, Agent, Checkpoint
+import os
+import tempfile
+
+class Add(Function):
+    @property
+    def description(self):
+        return "Use this function to add a number to the total"
+    
+    @property
+    def example_args(self):
+        return [2]
+    
+    def __call__(self, value: int):
+        self.state["total"] += value
+        return self.state["total"]
+
+class Log(Function):
+    @property
+    def description(self):
+        return "Use this function to write a line to the log"
+
+    @property
+    def example_args(self):
+        return ["hello"]
+
+    def __call__(self, line: str):
+        self.state["calls"] += 1
+        self.state.setdefault("lines", []).append(line)
+        self.state.pop("total", None)
+        return "logged"
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, prompt, stop=None):
+        self.calls += 1
+        return f"Add({self.calls})"
+
+class FailingLLM:
+    def __call__(self, prompt, stop=None):
+        raise AssertionError("The llm must not be called when restoring")
+
+def make_agent(llm, checkpoint):
+    engine = Engine(state=dict(total=0))
+    engine.register(Add())
+    agent = Agent(llm=llm, engine=engine, checkpoint=checkpoint, quiet=True)
+    agent.prompt = f"Add numbers\n{engine.help}"
+    agent.bootstrap = ["Add(100)"]
+    return agent
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "session.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_restore(self):
+        agent = make_agent(CountingLLM(), Checkpoint(self.path, snapshot_every=2))
+        agent.run(iterations=5)
+        agent.checkpoint.close()
+        self.assertEqual(agent.engine.state["total"], 115)
+
+        restored = make_agent(FailingLLM(), Checkpoint(self.path))
+        restored.restore()
+        self.assertEqual(restored.history, agent.history)
+        self.assertEqual(restored.pinned, agent.pinned)
+        self.assertEqual(restored.engine.state, dict(total=115))
+        self.assertEqual(restored.step_count, 5)
+
+    def test_restore_does_not_run_functions(self):
+        engine = Engine(state=dict(total=0, calls=0))
+        engine.register(Log())
+        replies = iter(["Log('a')", "Log('b')", "Log('c')"])
+        agent = Agent(llm=lambda prompt, stop=None: next(replies), engine=engine, checkpoint=Checkpoint(self.path, snapshot_every=10), quiet=True)
+        agent.prompt = f"Write lines\n{engine.help}"
+        agent.run(iterations=3)
+        agent.checkpoint.close()
+
+        engine = Engine(state=dict(total=0, calls=0))
+        log = Log()
+        engine.register(log)
+        restored = Agent(llm=FailingLLM(), engine=engine, checkpoint=Checkpoint(self.path), quiet=True)
+        restored.prompt = f"Write lines\n{engine.help}"
+        log.__call__ = lambda line: self.fail("functions must not run when restoring")
+        restored.restore()
+        self.assertEqual(restored.engine.state, dict(calls=3, lines=["a", "b", "c"]))
+
+    def test_random_access(self):
+        agent = make_agent(CountingLLM(), Checkpoint(self.path))
+        agent.run(iterations=5)
+        self.assertEqual(len(agent.checkpoint), 5)
+        record = agent.checkpoint.read_step(3)
+        self.assertEqual({key: record[key] for key in ["type", "step", "reply", "output", "result"]}, dict(type="step", step=3, reply="Add(3)", output="106", result="success"))
+        with self.assertRaises(IndexError):
+            agent.checkpoint.read_step(6)
+
+    def test_torn_tail_and_resume(self):
+        agent = make_agent(CountingLLM(), Checkpoint(self.path, snapshot_every=1))
+        agent.run(iterations=3)
+        agent.checkpoint.close()
+        with open(self.path, "ab") as log:
+            log.write(b'{"type":"step","step":4,"re')
+
+        llm = CountingLLM()
+        llm.calls = 3
+        restored = make_agent(llm, Checkpoint(self.path))
+        restored.restore()
+        self.assertEqual(restored.engine.state["total"], 106)
+        restored.run(iterations=2, resume=True)
+        self.assertEqual(restored.engine.state["total"], 115)
+        self.assertEqual(len(restored.checkpoint), 5)
+        self.assertEqual(restored.checkpoint.read_step(5)["reply"], "Add(5)")
+        self.assertEqual([record["type"] for _, _, record in restored.checkpoint.records()].count("step"), 5)
@@ -0,0 +1,153 @@
+import unittest
+import asyncio
+from microchain import Engine, Function, Agent, SlidingWindowContext, SummaryContext, FullContext, LLMSummarizer
+from unittest.mock import patch
+import io
+import sys
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class RecordingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt, stop=None):
+        self.prompts.append(prompt)
+        return "Sum(1, 1)"
+
+class AsyncLLM:
+    def __init__(self):
+        self.prompts = []
+
+    async def __call__(self, prompt, stop=None):
+        self.prompts.append(prompt)
+        return f"Summary {len(self.prompts)}"
+
+def exchanges(n):
+    messages = []
+    for i in range(n):
+        messages.append(dict(role="assistant", content=f"Sum({i}, 1)"))
+        messages.append(dict(role="user", content=str(i + 1)))
+    return messages
+
+PINNED = [dict(role="system", content="System prompt"), dict(role="user", content="Prompt")]
+
+class TestContextPolicy(unittest.TestCase):
+
+    def test_full_context(self):
+        policy = FullContext()
+        history = PINNED + exchanges(5)
+        self.assertEqual(policy(history, 2), history)
+        self.assertEqual(policy.last_saved_tokens, 0)
+
+    def test_sliding_window(self):
+        policy = SlidingWindowContext(keep_last=3)
+        history = PINNED + exchanges(10)
+        self.assertEqual(policy(history, 2), PINNED + exchanges(10)[-6:])
+        self.assertEqual(policy.last_saved_tokens, policy.count(exchanges(10)[:-6]))
+
+    def test_sliding_window_budget(self):
+        policy = SlidingWindowContext(keep_last=10, max_tokens=10, count_tokens=lambda text: 1)
+        history = PINNED + exchanges(10)
+        self.assertEqual(policy(history, 2), PINNED + exchanges(10)[-8:])
+
+    def test_summary(self):
+        calls = []
+        def summarize(summary, messages):
+            calls.append(len(messages))
+            return f"{summary or ''}+{len(messages)}"
+
+        policy = SummaryContext(summarize, keep_last=2)
+        messages = policy(PINNED + exchanges(3), 2)
+        self.assertEqual(messages[1]["content"], "Prompt\n\nSummary of the previous steps:\n+2")
+        self.assertEqual(messages[2:], exchanges(3)[-4:])
+
+        messages = policy(PINNED + exchanges(5), 2)
+        self.assertEqual(messages[1]["content"], "Prompt\n\nSummary of the previous steps:\n+2+4")
+        self.assertEqual(calls, [2, 4])
+
+    def test_summary_window_grows(self):
+        def summarize(summary, messages):
+            return f"{summary or ''}+{len(messages)}"
+
+        policy = SummaryContext(summarize, keep_last=1)
+        messages = policy(PINNED + exchanges(5), 2)
+        self.assertEqual(policy.summary, "+8")
+        self.assertEqual(messages[2:], exchanges(5)[-2:])
+
+        # The folded exchanges stay in the summary and are not sent again
+        policy.keep_last = 3
+        messages = policy(PINNED + exchanges(6), 2)
+        self.assertEqual(policy.summary, "+8")
+        self.assertEqual(messages[1]["content"], "Prompt\n\nSummary of the previous steps:\n+8")
+        self.assertEqual(messages[2:], exchanges(6)[-4:])
+
+        # A new history starts a new summary
+        self.assertEqual(policy(PINNED + exchanges(1), 2), PINNED + exchanges(1))
+        self.assertIsNone(policy.summary)
+
+    def test_summary_budget(self):
+        def summarize(summary, messages):
+            return "long summary " * 10
+
+        policy = SummaryContext(summarize, keep_last=10, max_tokens=100)
+        history = PINNED + [dict(role=message["role"], content=message["content"] * 5) for message in exchanges(10)]
+        messages = policy(history, 2)
+        self.assertLessEqual(policy.count(messages), 100)
+        self.assertEqual(messages[2:], history[-len(messages) + 2:])
+
+    def test_saved_tokens_size(self):
+        policy = FullContext(saved_tokens_size=3)
+        for _ in range(5):
+            policy(PINNED + exchanges(2), 2)
+        self.assertEqual(len(policy.saved_tokens), 3)
+
+    def test_async_summarizer(self):
+        engine = Engine()
+        engine.register(Sum())
+        engine.help_called = True
+        llm = RecordingLLM()
+        summarizer = AsyncLLM()
+        policy = SummaryContext(LLMSummarizer(summarizer), keep_last=2)
+        agent = Agent(llm=llm, engine=engine, context_policy=policy)
+        agent.prompt = "Compute"
+
+        with patch.multiple(sys, stdout=io.StringIO()):
+            with self.assertRaisesRegex(TypeError, "AsyncLLM is asynchronous, use agent.arun()"):
+                agent.run(iterations=4)
+            asyncio.run(agent.arun(iterations=4))
+
+        self.assertEqual(policy.folded, 2)
+        self.assertEqual(policy.summary, "Summary 1")
+        self.assertEqual(llm.prompts[-1][0]["content"], "Compute\n\nSummary of the previous steps:\nSummary 1")
+
+    def test_agent_context_policy(self):
+        engine = Engine()
+        engine.register(Sum())
+        engine.help_called = True
+        llm = RecordingLLM()
+        policy = SlidingWindowContext(keep_last=2)
+        agent = Agent(llm=llm, engine=engine, context_policy=policy)
+        agent.prompt = "Compute"
+        agent.bootstrap = ["Sum(1, 2)"]
+
+        with patch.multiple(sys, stdout=io.StringIO()):
+            agent.run(iterations=5)
+
+        self.assertEqual(len(agent.history), 3 + 2*5)
+        self.assertEqual(llm.prompts[-1], agent.history[:3] + agent.history[-6:-2])
+        self.assertEqual(len(policy.saved_tokens), 5)
+        self.assertGreater(policy.last_saved_tokens, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,18 @@ class Sum(Function):
     def __call__(self, a: float, b: float):
         return a + b
 
+class Power(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the power of a number"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, base: int, exponent: int = 2):
+        return base ** exponent
+
 
 class TestEngine(unittest.TestCase):
     
@@ -76,6 +88,77 @@ class TestEngine(unittest.TestCase):
         engine.register(Sum())
         self.assertEqual((FunctionResult.SUCCESS, "4"), engine.execute("Sum(2,2)"))
 
+    def test_function_wrong_argument_type(self):
+        engine = Engine()
+        engine.agent=object()   
+        engine.help_called = True
+        engine.register(Sum())
+        self.assertEqual((FunctionResult.ERROR, "Error: wrong format. Use Sum(a: float, b: float). Example: Sum(a=2, b=2). Please try again."), engine.execute("Sum(a='2', b=2)"))
+
+    def test_function_unknown_keyword(self):
+        engine = Engine()
+        engine.agent=object()   
+        engine.help_called = True
+        engine.register(Sum())
+        self.assertEqual(FunctionResult.ERROR, engine.execute("Sum(2, c=2)")[0])
+        self.assertEqual(FunctionResult.ERROR, engine.execute("Sum(2, a=2)")[0])
+
+    def test_function_default_arguments(self):
+        engine = Engine()
+        engine.agent=object()   
+        engine.help_called = True
+        engine.register(Power())
+        self.assertEqual((FunctionResult.SUCCESS, "9"), engine.execute("Power(3)"))
+        self.assertEqual((FunctionResult.SUCCESS, "8"), engine.execute("Power(exponent=3, base=2)"))
+        self.assertEqual(FunctionResult.ERROR, engine.execute("Power(exponent=3)")[0])
+        self.assertEqual(FunctionResult.ERROR, engine.execute("Power(2.5)")[0])
+
+    def test_parse_cache(self):
+        engine = Engine(parse_cache_size=2)
+        engine.agent=object()   
+        engine.help_called = True
+        engine.register(Sum())
+        for command in ["Sum(1, 1)", "Sum(2, 2)", "Sum(1, 1)", "Sum(3, 3)"]:
+            engine.execute(command)
+        self.assertEqual(list(engine.parse_cache.keys()), ["Sum(1, 1)", "Sum(3, 3)"])
+        self.assertEqual((FunctionResult.SUCCESS, "2"), engine.execute("Sum(1, 1)"))
+
+    def test_help_cache(self):
+        engine = Engine()
+        engine.register(Sum())
+        help = engine.help
+        self.assertIs(help, engine.help)
+
+        engine.register(Power())
+        self.assertIn("Power(base: int, exponent: int)", engine.help)
+
+        engine.unregister("Power")
+        self.assertEqual(help, engine.help)
+        self.assertRaises(ValueError, engine.unregister, "Power")
+
+    def test_function_metadata_cache(self):
+        accesses = []
+
+        class Counted(Sum):
+            @property
+            def example_args(self):
+                accesses.append(1)
+                return [2, 2]
+
+        engine = Engine()
+        engine.agent=object()
+        engine.help_called = True
+        function = Counted()
+        engine.register(function)
+        for _ in range(3):
+            engine.execute("Counted(2)")
+        self.assertEqual(function.help, f"{function.signature}\n{function.description}.\nExample: Counted(a=2, b=2)\n")
+        self.assertEqual(len(accesses), 1)
+
+        engine.register(function)
+        function.error
+        self.assertEqual(len(accesses), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import unittest
+from microchain import Engine, Function, Agent, FunctionResult, FunctionCache
+from unittest.mock import patch
+import time
+
+class Convert(Function):
+    cacheable = True
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    @property
+    def description(self):
+        return "Use this function to convert meters to feet"
+    
+    @property
+    def example_args(self):
+        return [1]
+    
+    def __call__(self, meters: float):
+        self.calls += 1
+        if meters > 1000:
+            raise ValueError("too long")
+        return round(meters * 3.28084, 2)
+
+class Counter(Function):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    @property
+    def description(self):
+        return "Use this function to count"
+    
+    @property
+    def example_args(self):
+        return []
+    
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+def make_engine(*functions, cache=None):
+    engine = Engine()
+    for function in functions:
+        engine.register(function, cache=cache)
+    engine.help
+    Agent(llm=None, engine=engine)
+    return engine
+
+class TestFunctionCache(unittest.TestCase):
+
+    def test_cacheable(self):
+        convert = Convert()
+        engine = make_engine(convert)
+        self.assertEqual(engine.execute("Convert(2)"), (FunctionResult.SUCCESS, "6.56"))
+        self.assertEqual(engine.execute("Convert(meters=2)"), (FunctionResult.SUCCESS, "6.56"))
+        self.assertEqual(engine.execute("Convert(2)"), (FunctionResult.SUCCESS, "6.56"))
+        self.assertEqual(convert.calls, 1)
+        self.assertAlmostEqual(convert.hit_rate, 2 / 3)
+
+    def test_errors_are_not_cached(self):
+        convert = Convert()
+        engine = make_engine(convert)
+        with patch("sys.stdout"):
+            self.assertEqual(engine.execute("Convert(2000)")[0], FunctionResult.ERROR)
+            self.assertEqual(engine.execute("Convert(2000)")[0], FunctionResult.ERROR)
+        self.assertEqual(convert.calls, 2)
+
+    def test_not_cacheable(self):
+        counter = Counter()
+        engine = make_engine(counter)
+        self.assertEqual(engine.execute("Counter()"), (FunctionResult.SUCCESS, "1"))
+        self.assertEqual(engine.execute("Counter()"), (FunctionResult.SUCCESS, "2"))
+        self.assertIsNone(counter.cache)
+
+    def test_shared_cache(self):
+        cache = FunctionCache(max_size=2)
+        first, second = Convert(), Convert()
+        first_engine = make_engine(first, cache=cache)
+        second_engine = make_engine(second, cache=cache)
+        first_engine.execute("Convert(1)")
+        self.assertEqual(second_engine.execute("Convert(1)"), (FunctionResult.SUCCESS, "3.28"))
+        self.assertEqual((first.calls, second.calls), (1, 0))
+        self.assertEqual(cache.hit_rate("Convert"), 0.5)
+
+        second_engine.execute("Convert(2)")
+        second_engine.execute("Convert(3)")
+        self.assertEqual(len(cache), 2)
+        first_engine.execute("Convert(1)")
+        self.assertEqual(first.calls, 2)
+
+    def test_ttl(self):
+        convert = Convert()
+        engine = make_engine(convert, cache=FunctionCache(ttl=0.05))
+        engine.execute("Convert(1)")
+        engine.execute("Convert(1)")
+        self.assertEqual(convert.calls, 1)
+        time.sleep(0.1)
+        engine.execute("Convert(1)")
+        self.assertEqual(convert.calls, 2)
@@ -0,0 +1,118 @@
+import unittest
+from microchain import Engine, Function, Agent, FunctionResult, Metrics, MemorySink
+from unittest.mock import patch
+import asyncio
+import io
+import time
+
+class Fetch(Function):
+    @property
+    def description(self):
+        return "Use this function to fetch a page"
+    
+    @property
+    def example_args(self):
+        return ["index", 0]
+    
+    async def __call__(self, page: str, delay: float = 0):
+        await asyncio.sleep(delay)
+        return f"<{page}>"
+
+class SlowFetch(Fetch):
+    timeout = 0.05
+
+class Sleep(Function):
+    timeout = 0.05
+
+    @property
+    def description(self):
+        return "Use this function to sleep"
+    
+    @property
+    def example_args(self):
+        return [1]
+    
+    def __call__(self, seconds: float):
+        time.sleep(seconds)
+        return "done"
+
+class Block(Function):
+    @property
+    def description(self):
+        return "Use this function to block"
+
+    @property
+    def example_args(self):
+        return [1]
+
+    def __call__(self, seconds: float):
+        time.sleep(seconds)
+        return "done"
+
+class ScriptedLLM:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def __call__(self, prompt, stop=None):
+        return self.replies.pop(0)
+
+def make_engine():
+    engine = Engine()
+    for function in [Fetch(), SlowFetch(), Sleep(), Block()]:
+        engine.register(function)
+    engine.help
+    return engine
+
+class TestAsyncFunctions(unittest.TestCase):
+
+    def test_sync_execute(self):
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        self.assertEqual(engine.execute('Fetch("home")'), (FunctionResult.SUCCESS, "<home>"))
+        self.assertEqual(engine.execute('SlowFetch("home")'), (FunctionResult.SUCCESS, "<home>"))
+
+    def test_timeout(self):
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        result, output = engine.execute('SlowFetch("home", 10)')
+        self.assertEqual(result, FunctionResult.ERROR)
+        self.assertEqual(output, "Error: SlowFetch timed out after 0.05 seconds. Please try again.")
+        self.assertEqual(engine.last_error, "timeout")
+
+        start = time.perf_counter()
+        self.assertEqual(engine.execute("Sleep(0.5)"), (FunctionResult.ERROR, "Error: Sleep timed out after 0.05 seconds. Please try again."))
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(engine.execute("Sleep(0)"), (FunctionResult.SUCCESS, "done"))
+
+    def test_async_execute(self):
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        async def main():
+            self.assertEqual(await engine.aexecute('Fetch("home")'), (FunctionResult.SUCCESS, "<home>"))
+            self.assertEqual((await engine.aexecute('SlowFetch("home", 10)'))[0], FunctionResult.ERROR)
+            start = time.perf_counter()
+            result, output = await engine.aexecute_many('[Fetch("a", 0.2), Fetch("b", 0.2), Fetch("c", 0.2)]')
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(output, '[success] Fetch("a", 0.2) -> <a>\n[success] Fetch("b", 0.2) -> <b>\n[success] Fetch("c", 0.2) -> <c>')
+        asyncio.run(main())
+
+    def test_blocking_function_on_loop(self):
+        # A blocking function without a timeout runs in a thread and does not stall the other coroutines
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        async def main():
+            start = time.perf_counter()
+            results = await asyncio.gather(engine.aexecute("Block(0.2)"), engine.aexecute("Block(0.2)"), engine.aexecute("Block(0.2)"))
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(results, [(FunctionResult.SUCCESS, "done")] * 3)
+        asyncio.run(main())
+
+    def test_agent(self):
+        sink = MemorySink()
+        engine = make_engine()
+        agent = Agent(llm=ScriptedLLM(['SlowFetch("home", 10)', 'Fetch("home")']), engine=engine, metrics=Metrics([sink]))
+        agent.prompt = "Fetch the home page"
+        with patch("sys.stdout", new=io.StringIO()):
+            asyncio.run(agent.arun(iterations=1))
+        self.assertEqual(agent.history[-1]["content"], "<home>")
+        self.assertEqual(sink.steps[0].errors, dict(timeout=1))
@@ -0,0 +1,140 @@
+import unittest
+import json
+import re
+from microchain import Engine, Function, Agent, OpenAIChatGenerator, OpenAITextGenerator
+from microchain.engine.function import FunctionResult
+from microchain.models.current import current_grammar
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class Echo(Function):
+    @property
+    def description(self):
+        return "Use this function to repeat a text"
+
+    @property
+    def example_args(self):
+        return ["hello", 1, False]
+
+    def __call__(self, text: str, times: int = 1, upper: bool = False):
+        return (text.upper() if upper else text) * times
+
+class Stop(Function):
+    @property
+    def description(self):
+        return "Use this function to stop"
+
+    @property
+    def example_args(self):
+        return []
+
+    def __call__(self):
+        return "stopped"
+
+def make_engine():
+    engine = Engine()
+    engine.register(Sum())
+    engine.register(Echo())
+    engine.register(Stop())
+    return engine
+
+class TestGrammar(unittest.TestCase):
+    def test_gbnf(self):
+        gbnf = make_engine().grammar().gbnf
+        self.assertIn("root ::= call\n", gbnf)
+        self.assertIn("call ::= call0 | call1 | call2\n", gbnf)
+        self.assertIn('call0 ::= "Sum(" float "," ws float ")"\n', gbnf)
+        self.assertIn('call1 ::= "Echo(" str ("," ws int ("," ws bool)?)? ")"\n', gbnf)
+        self.assertIn('call2 ::= "Stop(" ")"\n', gbnf)
+
+    def test_gbnf_multi_call(self):
+        gbnf = make_engine().grammar(multi_call=True).gbnf
+        self.assertIn('root ::= "[" call ("," ws call)* "]"\n', gbnf)
+
+    def test_regex(self):
+        engine = make_engine()
+        regex = engine.grammar().regex
+        valid = ["Sum(2, 3.5)", "Sum(2,1e3)", "Sum(-1, -2.5)", 'Echo("a \\"b\\"")', 'Echo("a", 2)', 'Echo("a", -2, True)', "Stop()"]
+        invalid = ["Sum(2)", "Sum(--1, 2)", "Sum(-a, 2)", "Sum(a, 2)", "Echo(2)", "Echo('a', True, 2)", "Stop(1)", "Product(1, 2)"]
+        for command in valid:
+            self.assertIsNotNone(re.fullmatch(regex, command), command)
+            result, _ = engine.validate(command)
+            self.assertEqual(result, FunctionResult.SUCCESS, command)
+        for command in invalid:
+            self.assertIsNone(re.fullmatch(regex, command), command)
+
+    def test_regex_multi_call(self):
+        regex = make_engine().grammar(multi_call=True).regex
+        self.assertIsNotNone(re.fullmatch(regex, '[Sum(1, 2), Echo("a")]'))
+        self.assertIsNone(re.fullmatch(regex, "Sum(1, 2)"))
+
+    def test_json_schema(self):
+        grammar = make_engine().grammar()
+        schema = grammar.json_schema
+        self.assertEqual(len(schema["anyOf"]), 3)
+        echo = schema["anyOf"][1]
+        self.assertEqual(echo["properties"]["name"], dict(const="Echo"))
+        self.assertEqual(echo["properties"]["arguments"]["required"], ["text"])
+        self.assertEqual(echo["properties"]["arguments"]["properties"]["times"]["type"], "integer")
+        self.assertEqual(grammar.to_call(json.dumps(dict(name="Echo", arguments=dict(text="a", times=2)))), "Echo(text='a', times=2)")
+        self.assertEqual(grammar.to_call("Sum(1, 2)"), "Sum(1, 2)")
+        engine = make_engine()
+        engine.bind(object())
+        engine.help
+        self.assertEqual(engine.execute(grammar.to_call('{"name": "Sum", "arguments": {"a": -1.5, "b": 2}}')), (FunctionResult.SUCCESS, "0.5"))
+
+        multi = make_engine().grammar(multi_call=True)
+        self.assertEqual(multi.json_schema["type"], "array")
+        self.assertEqual(multi.to_call('[{"name": "Sum", "arguments": {"a": 1, "b": 2}}, {"name": "Stop", "arguments": {}}]'), "[Sum(a=1, b=2), Stop()]")
+
+    def test_cache_invalidation(self):
+        engine = make_engine()
+        grammar = engine.grammar()
+        self.assertIs(engine.grammar(), grammar)
+        engine.unregister("Stop")
+        self.assertIsNot(engine.grammar(), grammar)
+        self.assertNotIn("Stop", engine.grammar().gbnf)
+
+    def test_no_functions(self):
+        with self.assertRaises(ValueError):
+            Engine().grammar().gbnf
+
+    def test_generator_request(self):
+        grammar = make_engine().grammar()
+        chat = OpenAIChatGenerator(model="model", api_key="key", api_base="http://localhost:1/v1", guided_decoding="gbnf")
+        text = OpenAITextGenerator(model="model", api_key="key", api_base="http://localhost:1/v1", guided_decoding="regex")
+        self.assertNotIn("extra_body", chat.build_request([], None))
+
+        token = current_grammar.set(grammar)
+        try:
+            self.assertEqual(chat.build_request([], None)["extra_body"], dict(grammar=grammar.gbnf))
+            self.assertEqual(chat.stream_request(chat.build_request([], None))["extra_body"]["grammar"], grammar.gbnf)
+            self.assertEqual(text.build_request("", None)["extra_body"], dict(guided_regex=grammar.regex))
+        finally:
+            current_grammar.reset(token)
+
+    def test_agent_sets_grammar(self):
+        grammars = []
+        def generator(messages, stop=None):
+            grammars.append(current_grammar.get())
+            return "Stop()"
+
+        engine = make_engine()
+        agent = Agent(llm=generator, engine=engine, quiet=True)
+        agent.prompt = f"Act as a calculator. {engine.help}"
+        agent.step()
+        self.assertIs(grammars[0], engine.grammar())
+        self.assertIsNone(current_grammar.get())
+
+if __name__ == "__main__":
+    unittest.main()
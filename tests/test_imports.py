@@ -0,0 +1,37 @@
+import unittest
+import subprocess
+import sys
+import json
+import microchain
+
+def imported_modules(statement):
+    script = f"{statement}\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return set(json.loads(result.stdout))
+
+class TestImports(unittest.TestCase):
+    def test_import_is_lazy(self):
+        modules = imported_modules("import microchain")
+        for module in ["openai", "pydantic", "httpx", "replicate", "microchain.models.openai_generators", "microchain.engine.agent"]:
+            self.assertNotIn(module, modules)
+
+    def test_engine_does_not_import_generators(self):
+        modules = imported_modules("from microchain import Agent, Engine, Function")
+        self.assertIn("microchain.engine.agent", modules)
+        self.assertNotIn("openai", modules)
+        self.assertNotIn("microchain.models.openai_generators", modules)
+
+    def test_lazy_attributes(self):
+        from microchain.engine.agent import Agent
+        self.assertIs(microchain.Agent, Agent)
+        self.assertIn("Agent", dir(microchain))
+        self.assertEqual(set(microchain.__all__) - set(dir(microchain)), set())
+        for name in microchain.__all__:
+            self.assertIsNotNone(getattr(microchain, name))
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            microchain.DoesNotExist
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import sys
+import types
+import unittest
+from unittest.mock import patch
+from microchain import LlamaCppGenerator, LLM, TokenTracker, VicunaTemplate
+
+class Llama:
+    # Characters as tokens, the model replies with a scripted text one character at a time.
+    # Like llama-cpp-python, input_ids is a fixed size buffer and the tokens after n_tokens are stale
+    def __init__(self, reply="Sum(1, 2)\nmore", n_ctx=4096, **kwargs):
+        self.kwargs = dict(kwargs, n_ctx=n_ctx)
+        self.reply = reply
+        self.input_ids = [None] * n_ctx
+        self._n_tokens = 0
+        self.prompts = []
+        self.position = 0
+        self.prompt = False
+
+    @property
+    def n_tokens(self):
+        return self._n_tokens
+
+    @n_tokens.setter
+    def n_tokens(self, value):
+        # The generator moves n_tokens back only before evaluating a prompt
+        assert value <= self._n_tokens, "the KV cache past n_tokens was removed"
+        self._n_tokens = value
+        self.prompt = True
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return ["<s>"] * add_bos + list(text.decode())
+
+    def detokenize(self, tokens):
+        return "".join(tokens).encode()
+
+    def eval(self, tokens):
+        if self.prompt:
+            self.prompts.append(len(tokens))
+            self.position = 0
+            self.prompt = False
+        self.input_ids[self._n_tokens:self._n_tokens + len(tokens)] = tokens
+        self._n_tokens += len(tokens)
+
+    def sample(self, top_k, top_p, temp, repeat_penalty):
+        self.position += 1
+        return self.reply[self.position - 1] if self.position <= len(self.reply) else None
+
+    def token_eos(self):
+        return None
+
+    def reset(self):
+        self._n_tokens = 0
+
+def fake_modules():
+    llama_cpp = types.ModuleType("llama_cpp")
+    llama_cpp.Llama = Llama
+    return {"llama_cpp": llama_cpp}
+
+class TestLlamaCpp(unittest.TestCase):
+    def test_load(self):
+        with patch.dict(sys.modules, fake_modules()):
+            generator = LlamaCppGenerator(model_path="/models/llama.gguf", n_ctx=2048, n_threads=4)
+        self.assertEqual(generator.model, "llama.gguf")
+        self.assertEqual(generator.llama.kwargs["n_ctx"], 2048)
+        self.assertEqual(generator.llama.kwargs["n_gpu_layers"], 0)
+
+    def test_stop(self):
+        generator = LlamaCppGenerator(llama=Llama(), token_tracker=False)
+        self.assertEqual(generator("prompt", stop=["\n"]), "Sum(1, 2)")
+        generator = LlamaCppGenerator(llama=Llama(), token_tracker=False)
+        self.assertEqual(generator("prompt"), "Sum(1, 2)\nmore")
+        generator = LlamaCppGenerator(llama=Llama(), token_tracker=False, max_tokens=3)
+        self.assertEqual(generator("prompt"), "Sum")
+
+    def test_prefix_reuse(self):
+        tracker = TokenTracker()
+        llama = Llama()
+        generator = LlamaCppGenerator(llama=llama, token_tracker=tracker)
+        llm = LLM(generator=generator, templates=[VicunaTemplate()])
+
+        messages = [dict(role="user", content="Compute 1 + 2")]
+        reply = llm(messages, stop=["\n"])
+        self.assertEqual(reply, "Sum(1, 2)")
+        first = llama.tokenize(VicunaTemplate()(messages).encode())
+        self.assertEqual(llama.prompts, [len(first)])
+        self.assertEqual(generator.reused_tokens, 0)
+
+        messages += [dict(role="assistant", content=reply), dict(role="user", content="3")]
+        llm(messages, stop=["\n"])
+        second = llama.tokenize(VicunaTemplate()(messages).encode())
+        # Only the tokens after the common prefix are evaluated
+        self.assertGreaterEqual(generator.reused_tokens, len(first) - 1)
+        self.assertEqual(llama.prompts[1], len(second) - generator.reused_tokens)
+        self.assertEqual(generator.evaluated_tokens, len(first) + llama.prompts[1])
+        self.assertEqual(tracker.prompt_tokens, len(first) + len(second))
+        self.assertEqual(tracker.cached_prompt_tokens, generator.reused_tokens)
+
+        generator.reset()
+        llm(messages, stop=["\n"])
+        self.assertEqual(llama.prompts[2], len(second))
+
+    def test_same_prompt(self):
+        generator = LlamaCppGenerator(llama=Llama(), token_tracker=False)
+        generator("prompt", stop=["\n"])
+        generator("prompt", stop=["\n"])
+        # The last token is evaluated again to sample from fresh logits
+        self.assertEqual(generator.reused_tokens, len("prompt"))
+
+    def test_context_size(self):
+        generator = LlamaCppGenerator(llama=Llama(), n_ctx=4, token_tracker=False)
+        with self.assertRaises(ValueError):
+            generator("prompt")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from microchain import Engine, Function, Agent, Metrics, MemorySink, JSONLSink, PrometheusSink
+from unittest.mock import patch
+import io
+import json
+import os
+import tempfile
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class Divide(Function):
+    @property
+    def description(self):
+        return "Use this function to divide two numbers"
+    
+    @property
+    def example_args(self):
+        return [4, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a / b
+
+class ScriptedLLM:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def __call__(self, prompt, stop=None):
+        return self.replies.pop(0)
+
+def make_agent(replies, **kwargs):
+    engine = Engine()
+    engine.register(Sum())
+    engine.register(Divide())
+    engine.help
+    agent = Agent(llm=ScriptedLLM(replies), engine=engine, **kwargs)
+    agent.prompt = "Compute the sums"
+    return agent
+
+class TestMetrics(unittest.TestCase):
+
+    def test_step_metrics(self):
+        sink = MemorySink()
+        agent = make_agent(["", "Sum(1,, 2)", "Mul(1, 2)", "1 + Sum(1, 2)", "Sum(x, 2)", "Sum('a', 2)", "Divide(1, 0)", "Sum(1, 2)"], metrics=Metrics([sink]), name="calculator")
+        with patch("sys.stdout", new=io.StringIO()):
+            agent.run(iterations=1)
+
+        self.assertEqual(len(sink.steps), 1)
+        metrics = sink.steps[0]
+        self.assertEqual(metrics.agent, "calculator")
+        self.assertEqual(metrics.step, 1)
+        self.assertEqual(metrics.result, "success")
+        self.assertEqual(metrics.tries, 8)
+        self.assertEqual(metrics.errors, dict(empty=1, syntax=1, unknown=1, not_call=1, variables=1, arguments=1, function=1))
+        self.assertGreaterEqual(metrics.total_time, metrics.llm_time + metrics.parse_time + metrics.function_time)
+
+    def test_abort(self):
+        sink = MemorySink()
+        agent = make_agent(["Mul(1, 2)"] * 10, metrics=Metrics([sink]))
+        with patch("sys.stdout", new=io.StringIO()):
+            agent.run(iterations=1)
+        self.assertEqual(sink.steps[0].result, "abort")
+        self.assertEqual(sink.steps[0].tries, agent.max_tries)
+        self.assertEqual(sink.steps[0].errors, dict(unknown=10))
+
+    def test_quiet(self):
+        agent = make_agent(["Divide(1, 0)", "Sum(1, 2)"], quiet=True)
+        with patch("sys.stdout", new=io.StringIO()) as stdout:
+            agent.run(iterations=1)
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertEqual(agent.history[-1]["content"], "3")
+
+    def test_file_sinks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jsonl = JSONLSink(os.path.join(directory, "steps.jsonl"))
+            prometheus = PrometheusSink(os.path.join(directory, "microchain.prom"))
+            agent = make_agent(["Sum(1, 2)", "Mul(1, 2)", "Sum(2, 2)"], metrics=Metrics([jsonl, prometheus]), quiet=True)
+            agent.run(iterations=2)
+            jsonl.close()
+
+            with open(jsonl.path) as file:
+                steps = [json.loads(line) for line in file]
+            self.assertEqual([step["step"] for step in steps], [1, 2])
+            self.assertEqual(steps[1]["errors"], dict(unknown=1))
+
+            with open(prometheus.path) as file:
+                text = file.read()
+            self.assertIn('microchain_steps_total{result="success"} 2', text)
+            self.assertIn('microchain_errors_total{category="unknown"} 1', text)
+            self.assertIn("microchain_tries_total 3", text)
@@ -0,0 +1,106 @@
+import unittest
+from microchain import Engine, Function, Agent, FunctionResult
+from unittest.mock import patch
+import io
+import threading
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class Wait(Function):
+    # Every call waits for the other one, so it only returns if they run concurrently
+    barrier = threading.Barrier(2, timeout=5)
+
+    @property
+    def description(self):
+        return "Use this function to wait"
+    
+    @property
+    def example_args(self):
+        return ["a"]
+    
+    def __call__(self, name: str):
+        self.barrier.wait()
+        return name
+
+class Append(Function):
+    parallel = False
+
+    @property
+    def description(self):
+        return "Use this function to append a value to the list"
+    
+    @property
+    def example_args(self):
+        return [1]
+    
+    def __call__(self, value: int):
+        self.state["values"].append(value)
+        return self.state["values"]
+
+class ScriptedLLM:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.stops = []
+
+    def __call__(self, prompt, stop=None):
+        self.stops.append(stop)
+        return self.replies.pop(0)
+
+def make_engine():
+    engine = Engine(state=dict(values=[]))
+    for function in [Sum(), Wait(), Append()]:
+        engine.register(function)
+    engine.help
+    return engine
+
+class TestMultiCall(unittest.TestCase):
+
+    def test_split(self):
+        engine = make_engine()
+        self.assertEqual(engine.split("Sum(1, 2)\nSum(3, 4)"), ["Sum(1, 2)", "Sum(3, 4)"])
+        self.assertEqual(engine.split("[Sum(1, 2), Sum(a=3, b=4)]"), ["Sum(1, 2)", "Sum(a=3, b=4)"])
+        self.assertEqual(engine.split("Sum(1, 2)"), ["Sum(1, 2)"])
+        self.assertEqual(engine.split("Sum(1,, 2)"), ["Sum(1,, 2)"])
+
+    def test_concurrent_execution(self):
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        result, output = engine.execute_many('Wait("a")\nWait("b")\nSum(1, 2)')
+        self.assertEqual(result, FunctionResult.SUCCESS)
+        self.assertEqual(output, '[success] Wait("a") -> a\n[success] Wait("b") -> b\n[success] Sum(1, 2) -> 3')
+
+    def test_unsafe_functions_run_in_order(self):
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        result, output = engine.execute_many("[Append(1), Append(2), Append(3)]")
+        self.assertEqual(result, FunctionResult.SUCCESS)
+        self.assertEqual(engine.state["values"], [1, 2, 3])
+
+    def test_invalid_call_runs_nothing(self):
+        engine = make_engine()
+        Agent(llm=None, engine=engine)
+        result, output = engine.execute_many("Append(1)\nMul(1, 2)")
+        self.assertEqual(result, FunctionResult.ERROR)
+        self.assertEqual(output, "[error] Mul(1, 2) -> Error: unknown command Mul(1, 2). Please try again.")
+        self.assertEqual(engine.state["values"], [])
+
+    def test_agent(self):
+        engine = make_engine()
+        llm = ScriptedLLM(["[Sum(1, 2), Mul(1, 2)] and more", "Sum(1, 2)\nAppend(4)"])
+        agent = Agent(llm=llm, engine=engine, multi_call=True)
+        agent.prompt = "Compute the sums"
+        with patch("sys.stdout", new=io.StringIO()):
+            agent.run(iterations=1)
+        self.assertEqual(llm.stops, [[], []])
+        self.assertEqual(agent.history[-2]["content"], "Sum(1, 2)\nAppend(4)")
+        self.assertEqual(agent.history[-1]["content"], "[success] Sum(1, 2) -> 3\n[success] Append(4) -> [4]")
@@ -1,5 +1,5 @@
 import unittest
-from microchain import OpenAIChatGenerator, LLM
+from microchain import OpenAIChatGenerator, LLM, GeneratorError, RetryPolicy
 
 class TestOpenAI(unittest.TestCase):
     def test_oai_error(self):
@@ -7,12 +7,13 @@ class TestOpenAI(unittest.TestCase):
             model="gpt-3.5-turbo",
             api_key="WRONG_API_KEY",
             api_base="https://api.openai.com/v1",
-            temperature=0.7
+            temperature=0.7,
+            retry=RetryPolicy(max_retries=0)
         )
 
         llm = LLM(generator=generator)
-        error = llm([dict(role="user", content="First message"),])
-        self.assertEqual(error, "Error: timeout")
+        with self.assertRaises(GeneratorError):
+            llm([dict(role="user", content="First message"),])
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from microchain import Engine, Function, LLM, AgentPool
+from unittest.mock import patch
+import io
+import sys
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class AsyncGenerator:
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def __call__(self, prompt, stop=None):
+        await asyncio.sleep(0.01)
+        if self.reply is None:
+            raise RuntimeError("generator failure")
+        return self.reply
+
+def make_factory(replies):
+    replies = list(replies)
+    def factory():
+        engine = Engine(state=dict())
+        engine.register(Sum())
+        engine.help_called = True
+        return LLM(generator=AsyncGenerator(replies.pop(0))), engine, "Compute the sums"
+    return factory
+
+class TestAgentPool(unittest.TestCase):
+
+    def test_pool_collects_steps(self):
+        pool = AgentPool(make_factory(["Sum(1, 1)"] * 10), concurrency=4)
+        with patch.multiple(sys, stdout=io.StringIO()):
+            results = pool.run(10, iterations=3)
+
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(len(result.steps) == 3 for result in results))
+        self.assertEqual(results[0].history[-1]["content"], "2")
+        self.assertEqual(pool.stats.steps, 30)
+        self.assertGreater(pool.stats.steps_per_second, 0)
+
+    def test_pool_errors_and_aborts(self):
+        pool = AgentPool(make_factory(["Sum(1, 1)", None, "Sum(1)"]), concurrency=2)
+        with patch.multiple(sys, stdout=io.StringIO()):
+            results = pool.run(3, iterations=2)
+
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, RuntimeError)
+        self.assertTrue(results[2].aborted)
+        self.assertEqual(pool.stats.errors, 1)
+        self.assertEqual(pool.stats.aborted, 1)
+
+    def test_pool_concurrency_limit(self):
+        running = []
+        peak = []
+
+        class CountingGenerator:
+            async def __call__(self, prompt, stop=None):
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+                return "Sum(1, 1)"
+
+        def factory():
+            engine = Engine(state=dict())
+            engine.register(Sum())
+            engine.help_called = True
+            return LLM(generator=CountingGenerator()), engine, "Compute the sums"
+
+        pool = AgentPool(factory, concurrency=3)
+        with patch.multiple(sys, stdout=io.StringIO()):
+            pool.run(9, iterations=2)
+
+        self.assertEqual(max(peak), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+from microchain import Engine, Function, Agent, FunctionResult, ProcessPool
+import os
+import time
+
+class Pid(Function):
+    @property
+    def description(self):
+        return "Use this function to get the process id"
+    
+    @property
+    def example_args(self):
+        return []
+    
+    def __call__(self):
+        return os.getpid()
+
+class Fibonacci(Function):
+    @property
+    def description(self):
+        return "Use this function to compute a fibonacci number"
+    
+    @property
+    def example_args(self):
+        return [10]
+    
+    def __call__(self, n: int):
+        if n > 1000:
+            raise ValueError("n is too large")
+        a, b = 0, 1
+        for _ in range(n):
+            a, b = b, a + b
+        return a
+
+class Sleep(Function):
+    timeout = 0.2
+
+    @property
+    def description(self):
+        return "Use this function to sleep"
+    
+    @property
+    def example_args(self):
+        return [1]
+    
+    def __call__(self, seconds: float):
+        time.sleep(seconds)
+        return self.state["name"]
+
+class Crash(Function):
+    @property
+    def description(self):
+        return "Use this function to crash the process"
+    
+    @property
+    def example_args(self):
+        return []
+    
+    def __call__(self):
+        os._exit(3)
+
+class Count(Function):
+    @property
+    def description(self):
+        return "Use this function to count and stop at a limit"
+
+    @property
+    def example_args(self):
+        return [3]
+
+    def __call__(self, limit: int):
+        self.state["count"] = self.state.get("count", 0) + 1
+        self.state.pop("name", None)
+        if self.state["count"] >= limit:
+            self.engine.stop()
+        return self.state["count"]
+
+class Agents(Function):
+    @property
+    def description(self):
+        return "Use this function to read the agent"
+
+    @property
+    def example_args(self):
+        return []
+
+    def __call__(self):
+        return self.engine.agent
+
+class TestProcessPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ProcessPool(max_workers=2)
+        self.engine = Engine(state=dict(name="worker"))
+        for function in [Pid(), Fibonacci(), Sleep(), Crash(), Count(), Agents()]:
+            self.engine.register(function, process_pool=self.pool)
+        self.engine.help
+        self.agent = Agent(llm=None, engine=self.engine, quiet=True)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_call(self):
+        result, pid = self.engine.execute("Pid()")
+        self.assertEqual(result, FunctionResult.SUCCESS)
+        self.assertNotEqual(int(pid), os.getpid())
+        self.assertEqual(self.engine.execute("Fibonacci(10)"), (FunctionResult.SUCCESS, "55"))
+        self.assertEqual(self.engine.execute("Pid()"), (FunctionResult.SUCCESS, pid))
+        self.assertEqual(self.engine.execute("Sleep(0)"), (FunctionResult.SUCCESS, "worker"))
+
+    def test_errors(self):
+        result, output = self.engine.execute("Fibonacci(2000)")
+        self.assertEqual(result, FunctionResult.ERROR)
+        self.assertTrue(output.startswith("Error inside function call"))
+        self.assertIn("n is too large", output)
+        self.assertEqual(self.engine.last_error, "function")
+
+    def test_timeout(self):
+        start = time.perf_counter()
+        self.assertEqual(self.engine.execute("Sleep(10)"), (FunctionResult.ERROR, "Error: Sleep timed out after 0.2 seconds. Please try again."))
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(self.engine.last_error, "timeout")
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(self.engine.execute("Fibonacci(10)"), (FunctionResult.SUCCESS, "55"))
+
+    def test_crash(self):
+        self.assertEqual(self.engine.execute("Crash()"), (FunctionResult.ERROR, "Error inside function call: the worker process crashed (exit code 3)"))
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(self.engine.execute("Fibonacci(10)"), (FunctionResult.SUCCESS, "55"))
+
+    def test_state_and_stop(self):
+        self.assertEqual(self.engine.execute("Count(2)"), (FunctionResult.SUCCESS, "1"))
+        self.assertEqual(self.engine.state, dict(count=1))
+        self.assertFalse(self.agent.do_stop)
+        self.assertEqual(self.engine.execute("Count(2)"), (FunctionResult.SUCCESS, "2"))
+        self.assertEqual(self.engine.state, dict(count=2))
+        self.assertTrue(self.agent.do_stop)
+
+    def test_engine_not_available(self):
+        result, output = self.engine.execute("Agents()")
+        self.assertEqual(result, FunctionResult.ERROR)
+        self.assertIn("Agents runs in a process pool worker, where self.engine.agent is not available", output)
+
+if __name__ == "__main__":
+    unittest.main()
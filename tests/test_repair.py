@@ -0,0 +1,115 @@
+import unittest
+from microchain import Engine, Function, Agent, Repair, Metrics, MemorySink
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class GetWeather(Function):
+    @property
+    def description(self):
+        return "Use this function to get the weather of a city"
+
+    @property
+    def example_args(self):
+        return ["Rome"]
+
+    def __call__(self, city: str):
+        return f"Sunny in {city}"
+
+class ScriptedLLM:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def __call__(self, prompt, stop=None):
+        self.calls += 1
+        return self.replies.pop(0)
+
+def make_agent(replies, **kwargs):
+    engine = Engine()
+    engine.register(Sum())
+    engine.register(GetWeather())
+    engine.help
+    agent = Agent(llm=ScriptedLLM(replies), engine=engine, quiet=True, **kwargs)
+    agent.prompt = "Answer the questions"
+    return agent
+
+def repair(reply, repair=None, multi_call=False):
+    agent = make_agent([], repair=repair or Repair(), multi_call=multi_call)
+    validate = agent.engine.validate_many if multi_call else agent.engine.validate
+    return agent.repair(reply, agent.clean_reply, validate, agent.engine.functions)
+
+class TestRepair(unittest.TestCase):
+    def test_repairs(self):
+        cases = [
+            ("```python\nSum(1, 2)\n```", "Sum(1, 2)", ["fences"]),
+            ("`Sum(1, 2)`", "Sum(1, 2)", ["fences"]),
+            ("Action: Sum(1, 2)", "Sum(1, 2)", ["prefix"]),
+            ("Sum(1, 2", "Sum(1, 2)", ["parens"]),
+            ('GetWeather("Rome', 'GetWeather("Rome")', ["parens"]),
+            ("GetWeather(“Rome”)", 'GetWeather("Rome")', ["quotes"]),
+            ("sum(1, 2)", "Sum(1, 2)", ["name"]),
+            ("GetWheather('Rome')", "GetWeather('Rome')", ["name"]),
+            ("Action: get_weather(‘Rome’", "GetWeather('Rome')", ["quotes", "prefix", "parens", "name"]),
+        ]
+        for reply, expected, applied in cases:
+            self.assertEqual(repair(reply), (expected, applied), reply)
+
+    def test_unrepairable(self):
+        repairer = Repair()
+        self.assertEqual(repair("Multiply(1, 2)", repair=repairer), (None, []))
+        self.assertEqual(repair("Sum('a', 2)", repair=repairer), (None, []))
+        self.assertEqual(repairer.failed, 2)
+        self.assertEqual(repairer.repaired, 0)
+
+    def test_configurable(self):
+        self.assertEqual(repair("sum(1, 2)", repair=Repair(repairs=["fences", "prefix"])), (None, []))
+
+        class Strip(Repair):
+            def semicolon(self, reply, names):
+                return reply.rstrip(";")
+        self.assertEqual(repair("Sum(1, 2);", repair=Strip(repairs=["semicolon"])), ("Sum(1, 2)", ["semicolon"]))
+
+    def test_strings_are_not_renamed(self):
+        self.assertEqual(repair('getweather("Rome, not sum(x)")'), ('GetWeather("Rome, not sum(x)")', ["name"]))
+
+    def test_shared_between_engines(self):
+        repairer = Repair()
+        self.assertEqual(repair("sum(1, 2)", repair=repairer), ("Sum(1, 2)", ["name"]))
+        self.assertFalse(hasattr(repairer, "names"))
+
+    def test_multi_call(self):
+        self.assertEqual(repair("[sum(1, 2), GetWeather('Rome')", multi_call=True), ("[Sum(1, 2), GetWeather('Rome')]", ["parens", "name"]))
+
+    def test_agent(self):
+        sink = MemorySink()
+        repairer = Repair()
+        agent = make_agent(["Action: Sum(1, 2)", "sum(3, 4)", "Multiply(1, 2)", "Sum(5, 6)"], repair=repairer, metrics=Metrics([sink]))
+        agent.run(iterations=3)
+
+        # Two replies were repaired without a round trip, the third one was not fixable
+        self.assertEqual(agent.llm.calls, 4)
+        self.assertEqual([step.tries for step in sink.steps], [1, 1, 2])
+        self.assertEqual([step.repairs for step in sink.steps], [dict(prefix=1), dict(name=1), dict()])
+        self.assertEqual(sink.steps[2].errors, dict(unknown=1))
+        self.assertEqual(repairer.repaired, 2)
+        self.assertEqual(repairer.failed, 1)
+        self.assertEqual(repairer.counts, dict(prefix=1, name=1))
+        self.assertEqual(agent.history[-6:-4], [dict(role="assistant", content="Sum(1, 2)"), dict(role="user", content="3")])
+
+    def test_without_repair(self):
+        agent = make_agent(["Action: Sum(1, 2)", "Sum(1, 2)"])
+        agent.run(iterations=1)
+        self.assertEqual(agent.llm.calls, 2)
+
+if __name__ == "__main__":
+    unittest.main()
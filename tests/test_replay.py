@@ -0,0 +1,72 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from microchain import LLM
+from microchain.models.replay import RecordingGenerator, AsyncRecordingGenerator, ReplayGenerator, AsyncReplayGenerator
+
+class CountingGenerator:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, prompt, stop=None):
+        self.calls += 1
+        return f"Reply({self.calls})"
+
+class SamplingGenerator(CountingGenerator):
+    def sample(self, prompt, n, stop=None):
+        return [self(prompt, stop=stop) for _ in range(n)]
+
+class AsyncSamplingGenerator(CountingGenerator):
+    async def __call__(self, prompt, stop=None):
+        return super().__call__(prompt, stop=stop)
+
+    async def sample(self, prompt, n, stop=None):
+        return [await self(prompt, stop=stop) for _ in range(n)]
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "session.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self):
+        llm = LLM(generator=RecordingGenerator(CountingGenerator(), self.path))
+        return [llm([dict(role="user", content=content)], stop=["\n"]) for content in ["a", "b", "a"]]
+
+    def test_record_replay(self):
+        replies = self.record()
+        llm = LLM(generator=ReplayGenerator(self.path))
+        self.assertEqual(llm([dict(role="user", content="b")], stop=["\n"]), replies[1])
+        self.assertEqual(llm([dict(role="user", content="a")], stop=["\n"]), replies[0])
+        self.assertEqual(llm([dict(role="user", content="a")], stop=["\n"]), replies[2])
+        self.assertRaises(KeyError, llm, [dict(role="user", content="a")], stop=["\n"])
+        self.assertRaises(KeyError, llm, [dict(role="user", content="b")])
+
+    def test_sequential_loop(self):
+        replies = self.record()
+        llm = LLM(generator=AsyncReplayGenerator(self.path, sequential=True, loop=True))
+        outputs = [asyncio.run(llm.acall([dict(role="user", content="x")])) for _ in range(4)]
+        self.assertEqual(outputs, replies + replies[:1])
+
+    def test_record_sample(self):
+        messages = [dict(role="user", content="a")]
+        llm = LLM(generator=RecordingGenerator(SamplingGenerator(), self.path))
+        replies = [llm(messages)] + llm.sample(messages, n=3)
+        self.assertFalse(hasattr(RecordingGenerator(CountingGenerator(), self.path), "sample"))
+
+        llm = LLM(generator=ReplayGenerator(self.path))
+        self.assertEqual([llm(messages)] + llm.sample(messages, n=3), replies)
+
+    def test_record_async_sample(self):
+        messages = [dict(role="user", content="a")]
+        llm = LLM(generator=AsyncRecordingGenerator(AsyncSamplingGenerator(), self.path))
+        replies = asyncio.run(llm.asample(messages, n=3))
+        llm = LLM(generator=AsyncReplayGenerator(self.path))
+        self.assertEqual(asyncio.run(llm.asample(messages, n=3)), replies)
+
+if __name__ == '__main__':
+    unittest.main()
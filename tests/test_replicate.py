@@ -0,0 +1,55 @@
+import sys
+import types
+import unittest
+from unittest.mock import patch
+from microchain import ReplicateLlama31ChatGenerator, TokenTracker
+
+class Tokenizer:
+    # Every message starts with a special token, like the Llama 3.1 template
+    def __init__(self):
+        self.encoded_characters = 0
+
+    def apply_chat_template(self, messages, tokenize=True, add_generation_prompt=False):
+        ret = "<|begin_of_text|>" + "".join(f"<|start_header_id|>{message['role']}<|end_header_id|> {message['content']}<|eot_id|>" for message in messages)
+        return self.encode(ret, add_special_tokens=False) if tokenize else ret
+
+    def encode(self, text, add_special_tokens=True):
+        self.encoded_characters += len(text)
+        tokens = text.replace("<|", " <|").replace("|>", "|> ").split()
+        return ["<|begin_of_text|>"] + tokens if add_special_tokens else tokens
+
+class Predictions:
+    def create(self, **kwargs):
+        return types.SimpleNamespace(stream=lambda: ["Sum(1, ", "2)"])
+
+def fake_modules(tokenizer):
+    transformers = types.ModuleType("transformers")
+    transformers.AutoTokenizer = types.SimpleNamespace(from_pretrained=lambda name: tokenizer)
+    client = types.ModuleType("replicate.client")
+    client.Client = lambda api_token: types.SimpleNamespace(predictions=Predictions())
+    return {"transformers": transformers, "replicate": types.ModuleType("replicate"), "replicate.client": client}
+
+class TestReplicateTokenCount(unittest.TestCase):
+
+    def test_incremental_prompt_tokens(self):
+        tokenizer = Tokenizer()
+        with patch.dict(sys.modules, fake_modules(tokenizer)):
+            tracker = TokenTracker()
+            generator = ReplicateLlama31ChatGenerator(model="model", tokenizer_pretrained_model_name_or_path="tokenizer", api_key="KEY", token_tracker=tracker)
+
+        messages = [dict(role="system", content="Be helpful"), dict(role="user", content="Compute the sum")]
+        expected = 0
+        for step in range(30):
+            self.assertEqual(generator(messages), "Sum(1, 2)")
+            expected += len(Tokenizer().apply_chat_template(messages))
+            self.assertEqual(tracker.prompt_tokens, expected)
+            messages = messages + [dict(role="assistant", content="Sum(1, 2)"), dict(role="user", content=f"Result number {step}")]
+
+        self.assertTrue(generator.incremental_token_count)
+        # Only the new messages are tokenized at every step
+        tokenizer.encoded_characters = 0
+        generator(messages)
+        self.assertLess(tokenizer.encoded_characters, 200)
+
+if __name__ == '__main__':
+    unittest.main()
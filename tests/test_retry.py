@@ -0,0 +1,145 @@
+import unittest
+from microchain import OpenAIChatGenerator, AsyncOpenAIChatGenerator, Agent, Engine, Function, LLM, GeneratorError, RetryPolicy, Metrics, MemorySink
+from microchain.models.http import shared_http_client
+from microchain.models.retry import retry_after
+from types import SimpleNamespace
+import email.utils
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+import asyncio
+import io
+import json
+import threading
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests += 1
+        status, headers = self.server.failures.pop(0) if self.server.failures else (200, dict())
+        if status == 200:
+            body = dict(
+                id="test", object="chat.completion", created=0, model="test",
+                choices=[dict(index=0, message=dict(role="assistant", content="Sum(1, 2)"), finish_reason="stop")],
+                usage=dict(prompt_tokens=1, completion_tokens=1, total_tokens=2),
+            )
+        else:
+            body = dict(error=dict(message="failure"))
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        self.server.requests = 0
+        self.server.failures = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_generator(self, **kwargs):
+        host, port = self.server.server_address[:2]
+        return OpenAIChatGenerator(model="test", api_key="test", api_base=f"http://{host}:{port}/v1", temperature=0, **kwargs)
+
+    def test_retry_transient(self):
+        self.server.failures = [(429, {"Retry-After": "0"}), (503, dict())]
+        generator = self.make_generator(retry=RetryPolicy(max_retries=3, base_delay=0.01))
+        self.assertEqual(generator([dict(role="user", content="Sum 1 and 2")]), "Sum(1, 2)")
+        self.assertEqual(self.server.requests, 3)
+
+    def test_retry_after_dates(self):
+        def error(value):
+            return SimpleNamespace(response=SimpleNamespace(headers={"retry-after": value}))
+        self.assertIsNone(retry_after(error("soon")))
+        self.assertIsNone(retry_after(error("Mon, 99 Foo 2024 25:00:00 GMT")))
+        self.assertAlmostEqual(retry_after(error(email.utils.formatdate(time.time() + 10, usegmt=True))), 10, delta=2)
+        self.assertAlmostEqual(retry_after(error(email.utils.formatdate(time.time() + 10))), 10, delta=2)
+
+    def test_malformed_retry_after(self):
+        self.server.failures = [(429, {"Retry-After": "soon"})]
+        generator = self.make_generator(retry=RetryPolicy(max_retries=3, base_delay=0.01))
+        self.assertEqual(generator([dict(role="user", content="Sum 1 and 2")]), "Sum(1, 2)")
+        self.assertEqual(self.server.requests, 2)
+
+    def test_no_retry_on_client_errors(self):
+        self.server.failures = [(400, dict())]
+        generator = self.make_generator(retry=RetryPolicy(max_retries=3, base_delay=0.01))
+        with self.assertRaises(GeneratorError) as context:
+            generator([dict(role="user", content="Sum 1 and 2")])
+        self.assertEqual(context.exception.retries, 0)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_give_up(self):
+        self.server.failures = [(500, dict())] * 3
+        generator = self.make_generator(retry=RetryPolicy(max_retries=2, base_delay=0.01))
+        with self.assertRaises(GeneratorError) as context:
+            generator([dict(role="user", content="Sum 1 and 2")])
+        self.assertEqual(context.exception.retries, 2)
+
+    def test_shared_pool(self):
+        self.assertIs(self.make_generator().client._client, shared_http_client())
+        self.assertIs(self.make_generator().client._client, self.make_generator().client._client)
+
+    def test_async_client_per_loop(self):
+        host, port = self.server.server_address[:2]
+        generator = AsyncOpenAIChatGenerator(model="test", api_key="test", api_base=f"http://{host}:{port}/v1", temperature=0)
+        messages = [dict(role="user", content="Sum 1 and 2")]
+        self.assertEqual(asyncio.run(generator(messages)), "Sum(1, 2)")
+        self.assertEqual(asyncio.run(generator(messages)), "Sum(1, 2)")
+        self.assertEqual(self.server.requests, 2)
+
+    def test_agent_does_not_use_tries(self):
+        self.server.failures = [(500, dict())]
+        engine = Engine()
+        engine.register(Sum())
+        sink = MemorySink()
+        steps = []
+        agent = Agent(llm=LLM(generator=self.make_generator(retry=RetryPolicy(max_retries=0))), engine=engine, metrics=Metrics([sink]), on_iteration_step=lambda agent, step: steps.append(step))
+        agent.prompt = f"Compute the sums\n{engine.help}"
+        with patch("sys.stdout", new=io.StringIO()):
+            agent.run(iterations=1)
+            self.assertTrue(steps[0].abort)
+            self.assertIn("500", steps[0].output)
+            self.assertEqual(sink.steps[0].errors, dict(generator=1))
+            self.assertEqual((sink.steps[0].result, sink.steps[0].tries), ("abort", 1))
+            agent.run(iterations=1)
+        self.assertEqual(agent.history[-2:], [dict(role="assistant", content="Sum(1, 2)"), dict(role="user", content="3")])
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=4)
+        for attempt, cap in [(0, 1), (1, 2), (2, 4), (5, 4)]:
+            delay = policy.delay(attempt, HTTPError(500))
+            self.assertTrue(cap / 2 <= delay <= cap)
+        self.assertTrue(policy.is_transient(HTTPError(429), ()))
+        self.assertFalse(policy.is_transient(HTTPError(401), ()))
+        self.assertTrue(policy.is_transient(TimeoutError(), (TimeoutError, )))
@@ -0,0 +1,82 @@
+import unittest
+from microchain import RequestScheduler
+from microchain.models.current import current_agent
+import asyncio
+import threading
+import time
+import types
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def test_max_in_flight(self):
+        scheduler = RequestScheduler(max_in_flight=2)
+        lock = threading.Lock()
+        running = []
+        peak = []
+        def request():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            return "reply"
+
+        threads = [threading.Thread(target=scheduler.call, args=(request, dict(prompt="Hello"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(scheduler.stats.requests, 8)
+        self.assertEqual(scheduler.stats.in_flight, 0)
+        self.assertGreater(scheduler.stats.max_wait, 0)
+
+    def test_tokens_per_minute(self):
+        scheduler = RequestScheduler(tokens_per_minute=60000, count_tokens=int)
+        start = time.perf_counter()
+        scheduler.call(lambda: None, dict(prompt="60000"))
+        self.assertLess(time.perf_counter() - start, 0.05)
+        scheduler.call(lambda: None, dict(prompt="100"))
+        self.assertGreater(time.perf_counter() - start, 0.08)
+
+    def test_usage_correction(self):
+        scheduler = RequestScheduler(tokens_per_minute=60000, count_tokens=int)
+        response = types.SimpleNamespace(usage=types.SimpleNamespace(prompt_tokens=10, completion_tokens=10, total_tokens=20))
+        scheduler.call(lambda: response, dict(prompt="1000", max_tokens=1000))
+        self.assertAlmostEqual(scheduler.tokens_bucket.level, 60000 - 20, delta=5)
+
+    def test_estimate(self):
+        scheduler = RequestScheduler(count_tokens=len)
+        self.assertEqual(scheduler.estimate(dict(messages=[dict(role="user", content="abcd")], max_tokens=10, n=2)), 24)
+        self.assertEqual(scheduler.estimate(dict(prompt="abc")), 3)
+
+    def test_fair_queueing(self):
+        scheduler = RequestScheduler(max_in_flight=1)
+        order = []
+        async def request(agent):
+            current_agent.set(agent)
+            ticket = await scheduler.aacquire(1)
+            order.append(agent)
+            await asyncio.sleep(0.01)
+            scheduler.release(ticket)
+
+        async def main():
+            await asyncio.gather(*[request(agent) for agent in ["a", "a", "a", "b", "b", "b"]])
+        asyncio.run(main())
+        self.assertEqual(order, ["a", "a", "b", "a", "b", "b"])
+        self.assertEqual(scheduler.queue_depth, 0)
+
+    def test_cancel(self):
+        scheduler = RequestScheduler(max_in_flight=1)
+        async def main():
+            first = await scheduler.aacquire(1)
+            waiting = asyncio.ensure_future(scheduler.aacquire(1))
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.queue_depth, 1)
+            waiting.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.queue_depth, 0)
+            scheduler.release(first)
+            await asyncio.wait_for(scheduler.aacquire(1), timeout=1)
+        asyncio.run(main())
@@ -0,0 +1,156 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from microchain import Engine, Function, Agent, LLM, OpenAIChatGenerator, AsyncOpenAIChatGenerator, OpenAITextGenerator, TokenTracker, RequestScheduler
+from microchain.models.streaming import CallDetector
+
+def chat_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+class AsyncFakeStream(FakeStream):
+    async def close(self):
+        self.closed = True
+
+class FakeCompletions:
+    def __init__(self, stream):
+        self.stream = stream
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        return self.stream
+
+class AsyncFakeCompletions(FakeCompletions):
+    async def create(self, **request):
+        self.requests.append(request)
+        return self.stream
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+
+    @property
+    def example_args(self):
+        return [2, 2]
+
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class TestCallDetector(unittest.TestCase):
+
+    def test_complete_call(self):
+        detector = CallDetector()
+        self.assertFalse(detector.feed("Sum(a=2, "))
+        self.assertTrue(detector.feed("b=3) and then I will"))
+        self.assertEqual(detector.call, "Sum(a=2, b=3)")
+
+    def test_parenthesis_in_string(self):
+        detector = CallDetector()
+        self.assertFalse(detector.feed('Reasoning("first (a) then \\")'))
+        self.assertTrue(detector.feed(' b")\n'))
+        self.assertEqual(detector.call, 'Reasoning("first (a) then \\") b")')
+
+    def test_incomplete(self):
+        detector = CallDetector()
+        self.assertFalse(detector.feed("I think that (2*4) + 3 = "))
+        self.assertEqual(detector.call, "I think that (2*4) + 3 = ")
+
+    def test_multi_call(self):
+        detector = CallDetector(multi_call=True)
+        self.assertFalse(detector.feed("[Sum(1, 2), "))
+        self.assertFalse(detector.feed("Sum(3, [4])"))
+        self.assertTrue(detector.feed("] done"))
+        self.assertEqual(detector.call, "[Sum(1, 2), Sum(3, [4])]")
+
+        detector = CallDetector(multi_call=True)
+        self.assertFalse(detector.feed("Sum(1, 2)\nSum(3, 4)"))
+        self.assertEqual(detector.call, "Sum(1, 2)\nSum(3, 4)")
+
+class TestStreamingGenerators(unittest.TestCase):
+
+    def test_chat_early_stop(self):
+        generator = OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", stream=True)
+        stream = FakeStream([chat_chunk(text) for text in ["Sum", "(2, ", "2)", " Now", " I", " will"]])
+        generator.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(stream)))
+
+        self.assertEqual(generator([dict(role="user", content="Hi")]), "Sum(2, 2)")
+        self.assertEqual(stream.consumed, 3)
+        self.assertTrue(stream.closed)
+
+    def test_async_chat_early_stop(self):
+        generator = AsyncOpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", stream=True)
+        stream = AsyncFakeStream([chat_chunk(text) for text in ["Stop()", " done"]])
+        generator.client = SimpleNamespace(chat=SimpleNamespace(completions=AsyncFakeCompletions(stream)))
+
+        self.assertEqual(asyncio.run(generator([dict(role="user", content="Hi")])), "Stop()")
+        self.assertEqual(stream.consumed, 1)
+        self.assertTrue(stream.closed)
+
+    def test_early_stop_usage(self):
+        tracker = TokenTracker()
+        scheduler = RequestScheduler(tokens_per_minute=100000)
+        generator = OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", stream=True, token_tracker=tracker, scheduler=scheduler)
+        stream = FakeStream([chat_chunk(text) for text in ["Sum", "(2, ", "2)", " Now"]])
+        generator.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(stream)))
+
+        generator([dict(role="user", content="Compute the sum of 2 and 2")], stop=["\n"])
+        self.assertEqual((tracker.prompt_tokens, tracker.completion_tokens), (7, 3))
+        self.assertGreater(scheduler.tokens_bucket.level, 100000 - 512)
+
+    def test_reported_usage(self):
+        tracker = TokenTracker()
+        generator = OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", stream=True, token_tracker=tracker)
+        chunks = [chat_chunk("I do not know"), SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=20, completion_tokens=4))]
+        completions = FakeCompletions(FakeStream(chunks))
+        generator.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        generator([dict(role="user", content="Hi")])
+        self.assertEqual((tracker.prompt_tokens, tracker.completion_tokens), (20, 4))
+        self.assertEqual(completions.requests[0]["extra_body"]["stream_options"], dict(include_usage=True))
+
+    def test_multi_call_agent(self):
+        for texts, expected in [
+            (["[Sum(1, 2), ", "Sum(3, 4)]", " and more"], "[success] Sum(1, 2) -> 3\n[success] Sum(3, 4) -> 7"),
+            (["Sum(1, 2)\n", "Sum(3, 4)"], "[success] Sum(1, 2) -> 3\n[success] Sum(3, 4) -> 7"),
+        ]:
+            generator = OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", stream=True)
+            stream = FakeStream([chat_chunk(text) for text in texts])
+            generator.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(stream)))
+            engine = Engine()
+            engine.register(Sum())
+            agent = Agent(llm=LLM(generator=generator), engine=engine, multi_call=True, quiet=True)
+            agent.prompt = engine.help
+            self.assertEqual(agent.step().output, expected)
+            self.assertTrue(stream.closed)
+
+    def test_text_stream_without_call(self):
+        generator = OpenAITextGenerator(model="model", api_key="KEY", api_base="http://localhost", stream=True)
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(text=text)]) for text in ["I do", " not know "]]
+        completions = FakeCompletions(FakeStream(chunks))
+        generator.client = SimpleNamespace(completions=completions)
+
+        self.assertEqual(generator("prompt"), "I do not know")
+        self.assertTrue(completions.requests[0]["stream"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from microchain import VicunaTemplate
+from microchain.models.templates import ChatTemplateRenderer
+
+class LocalTokenizer:
+    def __init__(self):
+        self.rendered_messages = 0
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        self.rendered_messages += len(messages)
+        ret = "<s>" + "".join(f"<|{message['role']}|>{message['content']}</s>" for message in messages)
+        return ret + "<|assistant|>" if add_generation_prompt else ret
+
+class CountingTokenizer(LocalTokenizer):
+    # The rendering of every message depends on the length of the history
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        ret = super().apply_chat_template(messages, tokenize, add_generation_prompt)
+        return f"[{len(messages)}]" + ret
+
+def history(n):
+    messages = [dict(role="system", content="Be helpful")]
+    for i in range(n):
+        messages.append(dict(role="user", content=f"Question {i}"))
+        messages.append(dict(role="assistant", content=f"Answer {i}"))
+    messages.append(dict(role="user", content="Last question"))
+    return messages
+
+class TestTemplates(unittest.TestCase):
+
+    def test_vicuna_incremental(self):
+        template = VicunaTemplate(system_prompt="System")
+        messages = history(3)[1:]
+        for n in range(1, len(messages) + 1, 2):
+            self.assertEqual(template(messages[:n]), VicunaTemplate(system_prompt="System")(messages[:n]))
+
+        rewritten = [dict(role="user", content="Another question")]
+        self.assertEqual(template(rewritten), "System\n\nUser: Another question\nAssistant:")
+
+    def test_vicuna_errors(self):
+        template = VicunaTemplate()
+        self.assertRaises(ValueError, template, [dict(role="system", content="System")])
+        self.assertRaises(ValueError, template, [dict(role="user", content="Hi"), dict(role="assistant", content="Hello")])
+
+    def test_chat_template_incremental(self):
+        tokenizer = LocalTokenizer()
+        renderer = ChatTemplateRenderer(tokenizer)
+        messages = history(20)
+        for n in range(2, len(messages) + 1, 2):
+            self.assertEqual(renderer(messages[:n]), LocalTokenizer().apply_chat_template(messages[:n], add_generation_prompt=True))
+        self.assertTrue(renderer.incremental)
+
+        tokenizer.rendered_messages = 0
+        renderer(messages + [dict(role="assistant", content="Reply"), dict(role="user", content="Output")])
+        self.assertEqual(tokenizer.rendered_messages, 1 + 1 + 2)
+
+        rewritten = history(2)
+        self.assertEqual(renderer(rewritten), LocalTokenizer().apply_chat_template(rewritten, add_generation_prompt=True))
+
+    def test_chat_template_fallback(self):
+        renderer = ChatTemplateRenderer(CountingTokenizer())
+        messages = history(5)
+        for n in range(2, len(messages) + 1, 2):
+            self.assertEqual(renderer(messages[:n]), CountingTokenizer().apply_chat_template(messages[:n], add_generation_prompt=True))
+        self.assertFalse(renderer.incremental)
+
+if __name__ == '__main__':
+    unittest.main()
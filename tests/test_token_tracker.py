@@ -0,0 +1,141 @@
+import unittest
+from microchain import Engine, Function, Agent, LLM, TokenTracker, load_pricing, Metrics, MemorySink, OpenAIChatGenerator, OpenAITextGenerator, VicunaTemplate
+from unittest.mock import patch
+import io
+import json
+import os
+import tempfile
+import threading
+import types
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+def usage(prompt_tokens, completion_tokens, cached_tokens=None):
+    details = types.SimpleNamespace(cached_tokens=cached_tokens) if cached_tokens is not None else None
+    return types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, prompt_tokens_details=details)
+
+class TrackedGenerator:
+    def __init__(self, token_tracker, model="gpt-4o-mini"):
+        self.token_tracker = token_tracker
+        self.model = model
+
+    def __call__(self, prompt, stop=None):
+        self.token_tracker.update_from_usage(usage(8, 2), model=self.model)
+        return "Sum(1, 1)"
+
+def make_agent(tracker, model="gpt-4o-mini", **kwargs):
+    engine = Engine()
+    engine.register(Sum())
+    agent = Agent(llm=LLM(generator=TrackedGenerator(tracker, model=model)), engine=engine, quiet=True, **kwargs)
+    agent.prompt = f"Compute the sums\n{engine.help}"
+    return agent
+
+class TestTokenTracker(unittest.TestCase):
+
+    def test_generator_defaults(self):
+        first = OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost")
+        second = OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost")
+        self.assertIsNot(first.token_tracker, second.token_tracker)
+        self.assertIsNot(first.retry, second.retry)
+        tracker = TokenTracker()
+        self.assertIs(OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", token_tracker=tracker).token_tracker, tracker)
+        self.assertFalse(OpenAIChatGenerator(model="gpt-4o", api_key="KEY", api_base="http://localhost", token_tracker=False).token_tracker)
+
+    def test_text_generator(self):
+        generator = OpenAITextGenerator(model="gpt-4o-mini", api_key="KEY", api_base="http://localhost")
+        self.assertIsNot(generator.token_tracker, OpenAITextGenerator(model="gpt-4o-mini", api_key="KEY", api_base="http://localhost").token_tracker)
+        responses = [
+            types.SimpleNamespace(choices=[types.SimpleNamespace(text="Sum(1, 1)")], usage=usage(8, 2)),
+            types.SimpleNamespace(content="Sum(1, 1)"),
+        ]
+        generator.client = types.SimpleNamespace(completions=types.SimpleNamespace(create=lambda **request: responses.pop(0)))
+        engine = Engine()
+        engine.register(Sum())
+        agent = Agent(llm=LLM(generator=generator, templates=[VicunaTemplate()]), engine=engine, max_tokens=11, quiet=True)
+        agent.prompt = f"Compute the sums\n{engine.help}"
+        agent.run(iterations=5)
+        # The second response has no usage and is estimated, then the budget stops the agent
+        self.assertEqual(len(agent.history), 1 + 2*2)
+        self.assertEqual(generator.token_tracker.totals().requests, 2)
+        self.assertGreater(agent.token_usage()[0], 8)
+
+    def test_thread_safety(self):
+        tracker = TokenTracker()
+        def update():
+            for _ in range(1000):
+                tracker.update_from_usage(usage(1, 2), model="gpt-4o")
+        threads = [threading.Thread(target=update) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((tracker.prompt_tokens, tracker.completion_tokens), (8000, 16000))
+        self.assertEqual(tracker.totals(model="gpt-4o").requests, 8000)
+
+    def test_breakdown(self):
+        tracker = TokenTracker()
+        first, second = make_agent(tracker, name="first"), make_agent(tracker, name="second")
+        first.run(iterations=3)
+        second.run(iterations=2)
+        self.assertEqual(tracker.totals(agent="first").total_tokens, 30)
+        self.assertEqual(tracker.totals(agent="second").total_tokens, 20)
+        self.assertEqual(tracker.totals(agent="first", step=2).prompt_tokens, 8)
+        self.assertEqual(tracker.totals(model="gpt-4o-mini").requests, 5)
+        self.assertEqual(tracker.totals().total_tokens, 50)
+
+    def test_pricing(self):
+        tracker = TokenTracker()
+        tracker.update_from_usage(usage(1000, 100, cached_tokens=400), model="gpt-4o-2024-08-06")
+        self.assertEqual(tracker.cached_prompt_tokens, 400)
+        self.assertAlmostEqual(tracker.get_total_cost(), 600 * 2.5e-06 + 400 * 1.25e-06 + 100 * 1e-05)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "pricing.json")
+            with open(path, "w") as file:
+                json.dump({"local-model": {"prompt": 1e-06, "completion": 2e-06}}, file)
+            tracker = TokenTracker(pricing=load_pricing(path))
+        tracker.update_from_usage(usage(10, 10))
+        self.assertAlmostEqual(tracker.get_total_cost("local-model"), 3e-05)
+        with patch("sys.stdout", new=io.StringIO()) as stdout:
+            self.assertEqual(tracker.get_total_cost("unknown-model"), 0)
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_cost_budget_needs_pricing(self):
+        with self.assertRaisesRegex(ValueError, "No price for the model local-model"):
+            make_agent(TokenTracker(), max_cost=1.0, model="local-model")
+        with self.assertRaisesRegex(ValueError, "max_cost needs a generator with a token_tracker"):
+            make_agent(False, max_cost=1.0)
+        agent = make_agent(TokenTracker(pricing={"local-model": {"prompt": 1e-06, "completion": 2e-06}}), max_cost=1.0, model="local-model")
+        self.assertFalse(agent.budget_exceeded())
+
+        tracker = TokenTracker(max_cost=1.0)
+        agent = make_agent(tracker, model="local-model")
+        with self.assertRaisesRegex(ValueError, "No price for the models \\['local-model'\\]"):
+            agent.run(iterations=2)
+
+    def test_agent_budget(self):
+        sink = MemorySink()
+        tracker = TokenTracker()
+        agent = make_agent(tracker, max_tokens=25, metrics=Metrics([sink]))
+        agent.run(iterations=10)
+        self.assertEqual(tracker.totals(agent=agent.name).total_tokens, 30)
+        self.assertEqual([step.result for step in sink.steps], ["success", "success", "success", "abort"])
+        self.assertEqual(sink.steps[-1].errors, dict(budget=1))
+        self.assertEqual(sink.steps[0].prompt_tokens, 8)
+
+    def test_tracker_budget(self):
+        tracker = TokenTracker(max_cost=2.5 * (8 * 1.5e-07 + 2 * 6e-07))
+        first, second = make_agent(tracker), make_agent(tracker)
+        first.run(iterations=2)
+        second.run(iterations=10)
+        self.assertEqual(tracker.totals().requests, 3)
@@ -0,0 +1,185 @@
+import unittest
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+from microchain import Engine, Function, Agent, OpenAIChatGenerator, LLM, SummaryContext, LLMSummarizer, CachedGenerator
+from microchain.engine.function import FunctionResult
+from microchain.engine.grammar import ToolCalls
+
+class Sum(Function):
+    @property
+    def description(self):
+        return "Use this function to compute the sum of two numbers"
+    
+    @property
+    def example_args(self):
+        return [2, 2]
+    
+    def __call__(self, a: float, b: float):
+        return a + b
+
+class Stop(Function):
+    @property
+    def description(self):
+        return "Use this function to stop"
+
+    @property
+    def example_args(self):
+        return []
+
+    def __call__(self):
+        self.engine.stop()
+        return "The End"
+
+class Ask(Function):
+    def __init__(self, llm):
+        super().__init__()
+        self.llm = llm
+
+    @property
+    def description(self):
+        return "Use this function to ask a question"
+
+    @property
+    def example_args(self):
+        return ["Why?"]
+
+    def __call__(self, question: str):
+        return self.llm([dict(role="user", content=question)])
+
+def tool_call(name, arguments):
+    return SimpleNamespace(function=SimpleNamespace(name=name, arguments=arguments))
+
+def response(*messages):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message) for message in messages],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+    )
+
+class FakeCompletions:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+def make_agent(responses, multi_call=False):
+    engine = Engine()
+    engine.register(Sum())
+    engine.register(Stop())
+    generator = OpenAIChatGenerator(model="gpt-4o-mini", api_key="key", api_base="http://localhost:1/v1", tools=True)
+    completions = FakeCompletions(responses)
+    generator.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    agent = Agent(llm=LLM(generator=generator), engine=engine, multi_call=multi_call, quiet=True)
+    engine.tools
+    agent.prompt = "Act as a calculator"
+    return agent, completions
+
+class TestTools(unittest.TestCase):
+    def test_tool_definitions(self):
+        engine = Engine()
+        engine.register(Sum())
+        self.assertFalse(engine.help_called)
+        tools = engine.tools
+        self.assertTrue(engine.help_called)
+        self.assertEqual(tools[0]["function"]["name"], "Sum")
+        self.assertEqual(tools[0]["function"]["parameters"]["required"], ["a", "b"])
+        self.assertEqual(tools[0]["function"]["parameters"]["properties"]["a"]["type"], "number")
+
+    def test_tool_calls_reply(self):
+        reply = ToolCalls([("Sum", dict(a=1, b=2))])
+        self.assertEqual(reply, "Sum(a=1, b=2)")
+        self.assertEqual(ToolCalls([("Sum", dict(a=1, b=2)), ("Stop", dict())], listed=True), "[Sum(a=1, b=2), Stop()]")
+
+    def test_agent(self):
+        agent, completions = make_agent([
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Sum", '{"a": 2, "b": 3}')])),
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Stop", "{}")])),
+        ])
+        with patch.object(agent.engine, "parse_command", wraps=agent.engine.parse_command) as parse_command:
+            agent.run(iterations=5)
+        parse_command.assert_not_called()
+
+        self.assertEqual([tool["function"]["name"] for tool in completions.requests[0]["tools"]], ["Sum", "Stop"])
+        self.assertEqual(completions.requests[0]["tool_choice"], "required")
+        self.assertFalse(completions.requests[0]["extra_body"]["parallel_tool_calls"])
+        # The history holds the equivalent text replies
+        self.assertEqual(agent.history[-4:], [
+            dict(role="assistant", content="Sum(a=2, b=3)"),
+            dict(role="user", content="5"),
+            dict(role="assistant", content="Stop()"),
+            dict(role="user", content="The End"),
+        ])
+
+    def test_negative_numbers(self):
+        agent, _ = make_agent([
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Sum", '{"a": -3, "b": 5}')])),
+        ])
+        agent.run(iterations=1)
+        self.assertEqual(agent.history[-2:], [dict(role="assistant", content="Sum(a=-3, b=5)"), dict(role="user", content="2")])
+        self.assertNotIn("minimum", agent.engine.tools[0]["function"]["parameters"]["properties"]["a"])
+
+    def test_negative_numbers_cache(self):
+        # Cached replies are plain text, the engine parses the negative numbers of the tool calls
+        agent, _ = make_agent([])
+        agent.engine.help
+        with tempfile.TemporaryDirectory() as directory:
+            generator = CachedGenerator(lambda messages, stop=None: ToolCalls([("Sum", dict(a=-3, b=-1.5))]), path=os.path.join(directory, "cache.sqlite"), cache_sampling=True)
+            generator([dict(role="user", content="Sum")])
+            reply = generator([dict(role="user", content="Sum")])
+        self.assertNotIsInstance(reply, ToolCalls)
+        self.assertEqual(agent.engine.execute(reply), (FunctionResult.SUCCESS, "-4.5"))
+        self.assertEqual(agent.engine.execute("Sum(+1, -1)"), (FunctionResult.SUCCESS, "0"))
+        self.assertEqual(agent.engine.execute("Sum(-x, 1)")[0], FunctionResult.ERROR)
+
+    def test_wrong_arguments(self):
+        agent, _ = make_agent([
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Sum", '{"a": "2", "b": 3}')])),
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Sum", '{"a": 2')])),
+            response(SimpleNamespace(content="Stop()", tool_calls=None)),
+        ])
+        agent.run(iterations=1)
+        self.assertEqual(agent.history[-2:], [dict(role="assistant", content="Stop()"), dict(role="user", content="The End")])
+
+    def test_multi_call(self):
+        agent, completions = make_agent([
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Sum", '{"a": 1, "b": 2}'), tool_call("Sum", '{"a": 3, "b": 4}')])),
+        ], multi_call=True)
+        agent.run(iterations=1)
+        self.assertTrue(completions.requests[0]["extra_body"]["parallel_tool_calls"])
+        self.assertEqual(agent.history[-2]["content"], "[Sum(a=1, b=2), Sum(a=3, b=4)]")
+        self.assertEqual(agent.history[-1]["content"], "[success] Sum(a=1, b=2) -> 3\n[success] Sum(a=3, b=4) -> 7")
+
+    def test_other_calls_are_not_constrained(self):
+        agent, completions = make_agent([
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Ask", '{"question": "Why?"}')])),
+            response(SimpleNamespace(content="Because", tool_calls=None)),
+            response(SimpleNamespace(content="Asked why", tool_calls=None)),
+            response(SimpleNamespace(content=None, tool_calls=[tool_call("Stop", "{}")])),
+        ])
+        agent.engine.register(Ask(agent.llm))
+        agent.context_policy = SummaryContext(LLMSummarizer(agent.llm), keep_last=0)
+        agent.run(iterations=2)
+
+        self.assertEqual(agent.history[-4:], [
+            dict(role="assistant", content="Ask(question='Why?')"),
+            dict(role="user", content="Because"),
+            dict(role="assistant", content="Stop()"),
+            dict(role="user", content="The End"),
+        ])
+        # The function call and the summary are plain requests, only the agent's own calls get the tools
+        self.assertEqual(["tools" in request for request in completions.requests], [True, False, False, True])
+        self.assertNotIn("extra_body", completions.requests[1])
+        self.assertNotIn("extra_body", completions.requests[2])
+
+    def test_without_agent(self):
+        engine = Engine()
+        engine.register(Sum())
+        generator = OpenAIChatGenerator(model="gpt-4o-mini", api_key="key", api_base="http://localhost:1/v1", tools=True)
+        self.assertNotIn("tools", generator.build_request([], None))
+
+if __name__ == "__main__":
+    unittest.main()